@@ -0,0 +1,96 @@
+import logging
+import multiprocessing
+from math_equivalence import is_equiv, normalize_answer
+
+# Get a logger for this module
+logger = logging.getLogger(__name__)
+
+# Extraction statuses of find_boxed().
+OK = "ok"
+MISSING = "missing"
+UNBALANCED = "unbalanced"
+EMPTY = "empty"
+
+_BOXED_TAGS = ("\\boxed", "\\fbox")
+
+def find_closing_brace(text, start):
+    # Index of the brace closing the one just before 'start', or -1. Escaped characters (\{, \}, \\) are skipped.
+    depth = 1
+    i = start
+    while i < len(text):
+        if text[i] == "\\":
+            i += 2
+            continue
+        if text[i] == "{":
+            depth += 1
+        elif text[i] == "}":
+            depth -= 1
+            if depth == 0:
+                return i
+        i += 1
+    return -1
+
+def find_boxed(response):
+    # (content, status) of the last \boxed{...} (or \fbox{...}) in a response. The content is brace-balanced,
+    # so nested braces are kept and text after the closing brace is not; it is None unless the status is OK.
+    if not response:
+        return None, MISSING
+    tag = max(_BOXED_TAGS, key=response.rfind)
+    start = response.rfind(tag)
+    if start == -1:
+        return None, MISSING
+    i = start + len(tag)
+    while i < len(response) and response[i] == " ":
+        i += 1
+    if i == len(response):
+        return None, UNBALANCED
+    if response[i] != "{":
+        # Short form "\boxed 5$": the answer runs up to the next space or dollar sign.
+        end = i
+        while end < len(response) and response[end] not in " $\n":
+            end += 1
+        content = response[i:end]
+    else:
+        end = find_closing_brace(response, i + 1)
+        if end == -1:
+            # Usually a response cut off before the answer was closed.
+            return None, UNBALANCED
+        content = response[i + 1:end].strip()
+    if not content:
+        return None, EMPTY
+    return content, OK
+
+def extract_boxed(response):
+    # Content of the last \boxed{...} in a response, or None if there is none.
+    return find_boxed(response)[0]
+
+def score_item(item):
+    # 'item' is (id, response, official answer); returns (id, status, model answer, correct). 'correct' is
+    # None when no answer could be extracted.
+    item_id, response, official_answer = item
+    model_answer, status = find_boxed(response)
+    if model_answer is None:
+        return item_id, status, None, None
+    return item_id, status, model_answer, is_equiv(model_answer, (official_answer or "").strip())
+
+def score_items(items, processes=None, chunksize=256, symbolic=None):
+    # Scores (id, response, official answer) items across a process pool, in input order. With a
+    # symbolic_equivalence.SymbolicChecker, answers whose normalized strings differ get the symbolic tier as one batch.
+    items = list(items)
+    if processes == 1 or len(items) < chunksize:
+        results = [score_item(item) for item in items]
+    else:
+        # Spawned like symbolic_equivalence.SymbolicChecker's workers, since the caller's logging thread is running.
+        with multiprocessing.get_context("spawn").Pool(processes) as pool:
+            results = pool.map(score_item, items, chunksize)
+    if symbolic is not None:
+        mismatches = []
+        for i, result in enumerate(results):
+            if result[3] is False:
+                forms = normalize_answer(result[2]), normalize_answer((items[i][2] or "").strip())
+                if None not in forms:
+                    mismatches.append((i, forms))
+        verdicts = symbolic.check_many([forms for _, forms in mismatches]) if mismatches else []
+        for (i, _), verdict in zip(mismatches, verdicts):
+            results[i] = results[i][:3] + (verdict,)
+    return results
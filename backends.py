@@ -0,0 +1,221 @@
+import asyncio
+import json
+import logging
+import math
+import os
+import random
+import threading
+import time
+from rate_limiter import estimate_tokens
+
+# Get a logger for this module
+logger = logging.getLogger(__name__)
+
+class ModelBackend:
+    # Interface of a model provider. 'config' is a generation config dict such as {"temperature": 0.05};
+    # both methods return the response text and raise on failure (VertexAI decides what to retry).
+    name = ""
+    # Backends with provider-side context caching implement acreate_context/delete_context and accept
+    # 'context' in agenerate_with_usage (see context_cache.ContextCache).
+    supports_context_cache = False
+    # Smallest prefix, in estimated tokens, the provider accepts as a context cache.
+    min_context_tokens = None
+
+    def generate(self, prompt, config):
+        return asyncio.run(self.agenerate(prompt, config))
+
+    async def agenerate(self, prompt, config):
+        raise NotImplementedError
+
+    async def agenerate_with_usage(self, prompt, config, context=None):
+        # Returns (text, usage) where usage is {"input_tokens": ..., "output_tokens": ..., "cached_tokens": ...}
+        # or None if the provider doesn't report it. With 'context', 'prompt' is what follows the cached prefix.
+        if context is not None:
+            raise NotImplementedError
+        return await self.agenerate(prompt, config), None
+
+    async def astream(self, prompt, config, context=None):
+        # Yields (text chunk, usage) pairs; usage (as in agenerate_with_usage) may only come with the last chunk.
+        # Closing the generator early stops the generation.
+        text, usage = await self.agenerate_with_usage(prompt, config, context)
+        yield text, usage
+
+    async def acreate_context(self, prefix, ttl):
+        raise NotImplementedError
+
+    def delete_context(self, context):
+        raise NotImplementedError
+
+class VertexBackend(ModelBackend):
+    supports_context_cache = True
+    # Vertex AI rejects CachedContent below this size.
+    min_context_tokens = 2048
+
+    def __init__(self, model_name, project_id, location):
+        # Initialize GCP VM instance with service account that could access Vertex AI and "Allow full access to all cloud APIs"
+        if project_id:
+            os.environ.setdefault('GOOGLE_CLOUD_PROJECT', project_id)
+        if location:
+            os.environ.setdefault('GOOGLE_CLOUD_LOCATION', location)
+        os.environ.setdefault('GOOGLE_GENAI_USE_VERTEXAI', 'True')
+        import vertexai
+        from vertexai.generative_models import GenerativeModel
+        vertexai.init(project=project_id, location=location)
+        self.name = model_name
+        self.model = GenerativeModel(model_name)
+        # Models bound to a CachedContent, by cache name.
+        self._context_models = {}
+
+    def generate(self, prompt, config):
+        return self.model.generate_content(prompt, generation_config=config).text
+
+    async def agenerate(self, prompt, config):
+        response = await self.model.generate_content_async(prompt, generation_config=config)
+        return response.text
+
+    def _usage(self, response):
+        usage = getattr(response, "usage_metadata", None)
+        if usage is None or not usage.prompt_token_count:
+            return
+        # cached_content_token_count also covers the provider's implicit prefix caching.
+        return {"input_tokens": usage.prompt_token_count, "output_tokens": usage.candidates_token_count,
+                "cached_tokens": getattr(usage, "cached_content_token_count", 0) or 0}
+
+    async def agenerate_with_usage(self, prompt, config, context=None):
+        model = self.model if context is None else self._context_models[context.name]
+        response = await model.generate_content_async(prompt, generation_config=config)
+        return response.text, self._usage(response)
+
+    async def astream(self, prompt, config, context=None):
+        model = self.model if context is None else self._context_models[context.name]
+        responses = await model.generate_content_async(prompt, generation_config=config, stream=True)
+        async for response in responses:
+            try:
+                text = response.text
+            except ValueError:
+                # Chunks without text, e.g. the final one carrying only the finish reason.
+                text = ""
+            yield text, self._usage(response)
+
+    async def acreate_context(self, prefix, ttl):
+        import datetime
+        from vertexai.preview import caching
+        from vertexai.preview.generative_models import GenerativeModel
+        context = await asyncio.to_thread(caching.CachedContent.create, model_name=self.name, contents=[prefix],
+                                          ttl=datetime.timedelta(seconds=ttl))
+        self._context_models[context.name] = GenerativeModel.from_cached_content(cached_content=context)
+        return context
+
+    def delete_context(self, context):
+        self._context_models.pop(context.name, None)
+        context.delete()
+
+def latency_sampler(spec, seed=None):
+    # Builds a function returning simulated latencies in seconds from a number, a callable, or a tuple
+    # ("constant", s), ("uniform", low, high), ("exponential", mean) or ("lognormal", median, sigma).
+    if spec is None:
+        return lambda: 0.0
+    if callable(spec):
+        return spec
+    if isinstance(spec, (int, float)):
+        return lambda: float(spec)
+    rng = random.Random(seed)
+    kind, *params = spec
+    if kind == "constant":
+        return lambda: float(params[0])
+    if kind == "uniform":
+        return lambda: rng.uniform(params[0], params[1])
+    if kind == "exponential":
+        return lambda: rng.expovariate(1 / params[0])
+    if kind == "lognormal":
+        return lambda: rng.lognormvariate(math.log(params[0]), params[1])
+    raise ValueError(f"Unknown latency distribution: {kind}")
+
+class ReplayBackend(ModelBackend):
+    # Serves recorded responses from a JSONL capture (see ResponseCapture) without network access.
+    # Repeated requests for a prompt cycle through its recorded samples; prompts missing from the
+    # capture go to 'responder' (a function of prompt and config) if given, and raise KeyError otherwise.
+    # With 'min_context_tokens' it also simulates provider-side context caching of prefixes of at least that size.
+
+    def __init__(self, path=None, model_name=None, responder=None, latency=None, seed=None, min_context_tokens=None):
+        self.name = model_name or "replay"
+        self.responder = responder
+        self.supports_context_cache = min_context_tokens is not None
+        self.min_context_tokens = min_context_tokens
+        self.calls = 0
+        self._latency = latency_sampler(latency, seed)
+        self._responses = {}
+        self._served = {}
+        self._lock = threading.Lock()
+        if path is not None:
+            with open(path, "r", encoding="utf-8") as fin:
+                for line in fin:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    record = json.loads(line)
+                    if model_name is not None and record.get("model") != model_name:
+                        continue
+                    self._responses.setdefault(record["prompt"], []).append(record["response"])
+            logger.info(f"Loaded recorded responses for {len(self._responses)} prompts from {path}.")
+
+    def _respond(self, prompt, config):
+        with self._lock:
+            self.calls += 1
+            samples = self._responses.get(prompt)
+            if samples:
+                served = self._served.get(prompt, 0)
+                self._served[prompt] = served + 1
+                return samples[served % len(samples)]
+        if self.responder is not None:
+            return self.responder(prompt, config)
+        raise KeyError(f"No recorded response for prompt: {prompt[:80]}")
+
+    def generate(self, prompt, config):
+        time.sleep(self._latency())
+        return self._respond(prompt, config)
+
+    async def agenerate(self, prompt, config):
+        await asyncio.sleep(self._latency())
+        return self._respond(prompt, config)
+
+    async def agenerate_with_usage(self, prompt, config, context=None):
+        # A context is the cached prefix itself; the response is the one for the full prompt.
+        if context is None:
+            return await self.agenerate(prompt, config), None
+        text = await self.agenerate(context + prompt, config)
+        return text, {"input_tokens": estimate_tokens(context + prompt), "output_tokens": estimate_tokens(text),
+                      "cached_tokens": estimate_tokens(context)}
+
+    async def acreate_context(self, prefix, ttl):
+        return prefix
+
+    def delete_context(self, context):
+        pass
+
+    async def astream(self, prompt, config, context=None, chunk_chars=64):
+        # The simulated latency is spread evenly over the chunks, like tokens arriving at a steady rate.
+        text = self._respond((context or "") + prompt, config)
+        chunks = [text[i:i + chunk_chars] for i in range(0, len(text), chunk_chars)] or [""]
+        delay = self._latency() / len(chunks)
+        for chunk in chunks:
+            await asyncio.sleep(delay)
+            yield chunk, None
+
+class ResponseCapture:
+    # Appends every response received from a backend to a JSONL file that ReplayBackend can serve.
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, "a", encoding="utf-8")
+
+    def record(self, model_name, prompt, config, response):
+        line = json.dumps({"model": model_name, "prompt": prompt, "config": config, "response": response}, ensure_ascii=False)
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
@@ -0,0 +1,205 @@
+import concurrent.futures
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+
+# Get a logger for this module
+logger = logging.getLogger(__name__)
+
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+# Request and prediction files use the Vertex AI batch prediction JSONL format. Every line also carries the
+# request id, at the top level and as a request label, so predictions can be joined back by id.
+
+def request_record(request_id, prompt, config):
+    return {
+        "id": request_id,
+        "request": {
+            "contents": [{"role": "user", "parts": [{"text": prompt}]}],
+            "generationConfig": config,
+            "labels": {"id": request_id},
+        },
+    }
+
+def write_requests(path, requests, config):
+    # 'requests' are (id, prompt) pairs.
+    with open(path, "w", encoding="utf-8") as fout:
+        for request_id, prompt in requests:
+            fout.write(json.dumps(request_record(request_id, prompt, config), ensure_ascii=False) + "\n")
+
+def prompt_of(record):
+    return "".join(part.get("text", "") for part in record["request"]["contents"][0]["parts"])
+
+def prediction_record(record, text=None, usage=None, error=None):
+    # Prediction line for a request 'record': the response, or the error in "status" if it failed.
+    prediction = {"id": record["id"], "request": record["request"], "status": error or ""}
+    if error is None:
+        prediction["response"] = {"candidates": [{"content": {"role": "model", "parts": [{"text": text}]}}]}
+        if usage:
+            prediction["response"]["usageMetadata"] = {"promptTokenCount": usage.get("input_tokens"),
+                                                       "candidatesTokenCount": usage.get("output_tokens")}
+    return prediction
+
+def read_predictions(path):
+    # {request id: (text, usage)} of a predictions file; failed requests have text None.
+    results = {}
+    with open(path, "r", encoding="utf-8") as fin:
+        for line in fin:
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            request_id = record.get("id") or record["request"].get("labels", {}).get("id")
+            response = record.get("response") or {}
+            candidates = response.get("candidates") or []
+            parts = candidates[0].get("content", {}).get("parts", []) if candidates else []
+            text = "".join(part.get("text", "") for part in parts) or None
+            if text is None:
+                logger.info(f"Batch request {request_id} failed: {record.get('status') or 'no candidates'}")
+            usage = None
+            metadata = response.get("usageMetadata")
+            if metadata and metadata.get("promptTokenCount"):
+                usage = {"input_tokens": metadata["promptTokenCount"],
+                         "output_tokens": metadata.get("candidatesTokenCount", 0)}
+            results[request_id] = (text, usage)
+    return results
+
+class BatchBackend:
+    # Interface of a batch prediction service: submit a JSONL request file, poll the job until it is
+    # SUCCEEDED or FAILED, then fetch the predictions as a local JSONL file.
+    name = ""
+
+    def submit(self, requests_path):
+        # Returns a job handle.
+        raise NotImplementedError
+
+    def poll(self, job):
+        # Returns RUNNING, SUCCEEDED or FAILED.
+        raise NotImplementedError
+
+    def predictions(self, job, workdir):
+        # Returns the path of the predictions file, downloaded into 'workdir' if necessary.
+        raise NotImplementedError
+
+class LocalBatchBackend(BatchBackend):
+    # File-based stand-in for a batch prediction service. A job is a directory under 'root'; a background
+    # thread answers its requests with 'backend' (a backends.ModelBackend, e.g. a ReplayBackend) and writes
+    # the predictions and the job state there. Nothing but the job directory is shared with the caller.
+
+    def __init__(self, backend, root="batch_jobs", workers=8):
+        self.backend = backend
+        self.name = backend.name
+        self.root = root
+        self.workers = workers
+
+    def submit(self, requests_path):
+        job = os.path.join(self.root, uuid.uuid4().hex)
+        os.makedirs(job)
+        shutil.copyfile(requests_path, os.path.join(job, "requests.jsonl"))
+        self._set_state(job, RUNNING)
+        threading.Thread(target=self._run, args=(job,), name="local-batch", daemon=True).start()
+        return job
+
+    def _set_state(self, job, state):
+        # Written atomically, so poll() never sees a partial file.
+        with open(os.path.join(job, "state.tmp"), "w", encoding="utf-8") as fout:
+            fout.write(state)
+        os.replace(os.path.join(job, "state.tmp"), os.path.join(job, "state"))
+
+    def _answer(self, record):
+        try:
+            return prediction_record(record, self.backend.generate(prompt_of(record), record["request"]["generationConfig"]))
+        except Exception as e:
+            return prediction_record(record, error=str(e) or type(e).__name__)
+
+    def _run(self, job):
+        try:
+            with open(os.path.join(job, "requests.jsonl"), "r", encoding="utf-8") as fin:
+                records = [json.loads(line) for line in fin if line.strip()]
+            with concurrent.futures.ThreadPoolExecutor(self.workers) as pool:
+                predictions = list(pool.map(self._answer, records))
+            with open(os.path.join(job, "predictions.jsonl"), "w", encoding="utf-8") as fout:
+                for prediction in predictions:
+                    fout.write(json.dumps(prediction, ensure_ascii=False) + "\n")
+            self._set_state(job, SUCCEEDED)
+        except Exception as e:
+            logger.error(f"Local batch job {job} failed: {e}")
+            self._set_state(job, FAILED)
+
+    def poll(self, job):
+        with open(os.path.join(job, "state"), "r", encoding="utf-8") as fin:
+            return fin.read().strip()
+
+    def predictions(self, job, workdir):
+        return os.path.join(job, "predictions.jsonl")
+
+class VertexBatchBackend(BatchBackend):
+    # Vertex AI batch prediction. Request files are uploaded to, and predictions read from, 'staging_uri'
+    # (gs://bucket/prefix), which the service account must be able to write.
+
+    def __init__(self, model_name, project_id, location, staging_uri):
+        import vertexai
+        from google.cloud import storage
+        vertexai.init(project=project_id, location=location)
+        self.name = model_name
+        self.staging_uri = staging_uri.rstrip("/")
+        self._storage = storage.Client(project=project_id)
+
+    def _blob_path(self, uri):
+        bucket, _, path = uri[len("gs://"):].partition("/")
+        return self._storage.bucket(bucket), path
+
+    def submit(self, requests_path):
+        from vertexai.batch_prediction import BatchPredictionJob
+        run_uri = f"{self.staging_uri}/{uuid.uuid4().hex}"
+        bucket, path = self._blob_path(f"{run_uri}/requests.jsonl")
+        bucket.blob(path).upload_from_filename(requests_path)
+        job = BatchPredictionJob.submit(source_model=self.name, input_dataset=f"{run_uri}/requests.jsonl",
+                                        output_uri_prefix=f"{run_uri}/output")
+        logger.info(f"Submitted batch prediction job {job.resource_name}.")
+        return job
+
+    def poll(self, job):
+        job.refresh()
+        if not job.has_ended:
+            return RUNNING
+        return SUCCEEDED if job.has_succeeded else FAILED
+
+    def predictions(self, job, workdir):
+        bucket, prefix = self._blob_path(job.output_location)
+        path = os.path.join(workdir, f"{job.name}.predictions.jsonl")
+        with open(path, "w", encoding="utf-8") as fout:
+            for blob in bucket.list_blobs(prefix=prefix):
+                if blob.name.endswith(".jsonl"):
+                    fout.write(blob.download_as_text())
+        return path
+
+def run_batch(batch, requests, config, workdir="batch", poll_interval=30.0, timeout=None):
+    # Writes 'requests' ((id, prompt) pairs) to a request file in 'workdir', runs them as one job on 'batch'
+    # and returns {id: (text, usage)}, with text None for failed requests. A failed job, or one still running
+    # after 'timeout' seconds, returns no results.
+    os.makedirs(workdir, exist_ok=True)
+    requests_path = os.path.join(workdir, f"requests-{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}.jsonl")
+    write_requests(requests_path, requests, config)
+    start = time.monotonic()
+    job = batch.submit(requests_path)
+    logger.info(f"Submitted {len(requests)} requests to {batch.name} as batch job {job}.")
+    state = batch.poll(job)
+    while state == RUNNING:
+        if timeout is not None and time.monotonic() - start > timeout:
+            logger.error(f"Batch job {job} still running after {timeout} s.")
+            return {}
+        time.sleep(poll_interval)
+        state = batch.poll(job)
+    if state != SUCCEEDED:
+        logger.error(f"Batch job {job} ended in state {state}.")
+        return {}
+    results = read_predictions(batch.predictions(job, workdir))
+    logger.info(f"Batch job {job} finished in {time.monotonic() - start:.1f} s with {len(results)} predictions.")
+    return results
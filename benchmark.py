@@ -0,0 +1,524 @@
+import argparse
+import asyncio
+import datetime
+import hashlib
+import json
+import logging
+import os
+import random
+import re
+import subprocess
+import sys
+import time
+from answer_extraction import score_items
+from backends import ReplayBackend
+from context_cache import ContextCache
+from math_equivalence import is_equiv
+from metrics import call_site, registry
+from model import VertexAI
+from rate_limiter import RateLimiter, estimate_tokens
+from results_store import ResultsStore
+import verification
+
+# Get a logger for the main module
+logger = logging.getLogger(__name__)
+
+ANSWERS = [r"\frac12", r"\dfrac{1}{2}", "0.5", r"\sqrt3", r"\sqrt{3}", "3", r"5\%", r"10^{\circ}", "x = 7", r"\left( 1, 2 \right)"]
+
+# Models often keep writing after the JSON block; streamed requests stop reading before this part.
+RECAP = " To recap, every rule used above is a standard result and its premises were checked one by one." * 4
+
+def _fraction(text, seed):
+    return int(hashlib.md5(f"{seed}:{text}".encode("utf-8")).hexdigest(), 16) / 16 ** 32
+
+def stub_responder(contradiction_rate=0.05, seed=0, noise=0.0):
+    # Deterministic stand-in for the model that returns well-formed answers to every prompt the pipeline sends.
+    # Whether a step contradicts depends only on its sentence, so per-step and windowed checks agree.
+    # With 'noise', that fraction of step checks randomly answers 'neither' or the wrong relation instead,
+    # like a weaker model.
+    rng = random.Random(seed)
+
+    def relation(sentence):
+        return "contradict" if _fraction(sentence, seed) < contradiction_rate else "restate"
+
+    def noisy_relation(sentence):
+        if noise and rng.random() < noise:
+            return rng.choice(["neither", "restate" if relation(sentence) == "contradict" else "contradict"])
+        return relation(sentence)
+
+    def respond(prompt, config):
+        if "Now, let's check whether the solution so far is correct" in prompt:
+            first = prompt[prompt.index('sentence from "') + len('sentence from "'):prompt.index('" to "')]
+            last = prompt[prompt.index('" to "') + len('" to "'):prompt.index('" follows from')]
+            checked = prompt[prompt.index(first):prompt.index(" Now, let's check whether")]
+            assert checked.endswith(last)
+            consistent = all(relation(sentence) != "contradict" for sentence in re.split(r"(?<=\.) ", checked))
+            return f'Checked. ```json{{"consistent": {json.dumps(consistent)}}}```' + RECAP
+        if "Now, let's verify each of the following" in prompt:
+            steps = prompt[prompt.index("before it: ") + len("before it: "):prompt.index(". For each sentence:")]
+            entries = [
+                {"proof": {"rule 1": "definition", "conclusion 1": "the sentence holds"}, "rule 1": True, "relation": relation(sentence)}
+                for sentence in re.findall(r'\(\d+\) "(.*?)"(?= \(\d+\) "|$)', steps)
+            ]
+            return f"We check each sentence. ```json{json.dumps(entries)}```" + RECAP
+        if "Now, let's check the proof" in prompt:
+            sentence = prompt[prompt.rindex('contradicts "') + len('contradicts "'):prompt.rindex('". 3.')]
+            return f'The rule holds. ```json{{"rule 1": true, "rule 2": true, "relation": "{noisy_relation(sentence)}"}}```' + RECAP
+        if "Now, let's: 1. prove or disprove" in prompt:
+            return 'We apply the definition. ```json{"rule 1": "definition", "conclusion 1": "the sentence holds"}```' + RECAP
+        if prompt.startswith("Place each sentence") or prompt.startswith("Rewrite the solution"):
+            text = prompt[prompt.index('"') + 1:prompt.rindex('"')]
+            return "```\n" + text.replace(". ", ".\n") + "\n```"
+        return f"We compute the value step by step. The answer is $\\boxed{{{ANSWERS[int(_fraction(prompt, seed) * len(ANSWERS))]}}}$."
+    return respond
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    position = (len(values) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+def latency_summary(latencies):
+    return {f"p{q}": percentile(latencies, q) for q in (50, 95, 99)}
+
+def synthetic_problems(count):
+    return [
+        {"problem": f"Problem {i}: compute the value of the expression number {i}.", "answer": ANSWERS[i % len(ANSWERS)]}
+        for i in range(count)
+    ]
+
+def synthetic_solutions(count, steps):
+    return [
+        (
+            [f"Problem {i} asks for the value of $x_{i}$.", f"We know that $x_{i} = {i} + 1$."],
+            [f"Step {j} gives $x_{i} = {i} + {j}$ by algebra." for j in range(steps)],
+        )
+        for i in range(count)
+    ]
+
+def make_model(concurrency, latency, seed, contradiction_rate, cheap_noise=0.0, leader_latency=None):
+    # With 'cheap_noise' the cheap model is a noisy stub and the leader model a separate, exact one
+    # (with 'leader_latency', if given); otherwise both share one backend.
+    backend = ReplayBackend(responder=stub_responder(contradiction_rate, seed, cheap_noise), latency=latency, seed=seed)
+    leader_backend = backend
+    if cheap_noise:
+        leader_backend = ReplayBackend(responder=stub_responder(contradiction_rate, seed), model_name="replay-leader",
+                                       latency=leader_latency or latency, seed=seed)
+    # No client-side rate limit, so the measurement only reflects the pipeline and the simulated latency.
+    return VertexAI(None, None, max_concurrency=concurrency, backend=backend, leader_backend=leader_backend,
+                    rate_limiter=RateLimiter(requests_per_minute=float("inf")))
+
+def bench_is_equiv(repeat):
+    pairs = [(a, b) for a in ANSWERS for b in ANSWERS]
+    cpu = time.process_time()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for a, b in pairs:
+            is_equiv(a, b)
+    wall = time.perf_counter() - start
+    calls = repeat * len(pairs)
+    return {"calls": calls, "calls_per_sec": calls / wall, "wall_sec": wall, "cpu_sec": time.process_time() - cpu}
+
+def bench_evaluate_solution(problems, repeat):
+    matcher = verification.MatchAnswer()
+    respond = stub_responder()
+    solutions = [respond(problem["problem"], {}) for problem in problems]
+    cpu = time.process_time()
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for problem, solution in zip(problems, solutions):
+            matcher.evaluate_solution(problem, solution)
+    wall = time.perf_counter() - start
+    calls = repeat * len(problems)
+    return {"calls": calls, "calls_per_sec": calls / wall, "wall_sec": wall, "cpu_sec": time.process_time() - cpu}
+
+def bench_score_items(problems, repeat, processes):
+    # Bulk re-scoring as done by score_generations.py: boxed-answer extraction and answer matching.
+    respond = stub_responder()
+    items = [(i, respond(problem["problem"], {}), problem["answer"]) for i, problem in enumerate(problems)] * repeat
+    cpu = time.process_time()
+    start = time.perf_counter()
+    score_items(items, processes)
+    wall = time.perf_counter() - start
+    return {"items": len(items), "processes": processes, "items_per_sec": len(items) / wall, "wall_sec": wall,
+            "cpu_sec": time.process_time() - cpu}
+
+async def _timed(coroutine, latencies):
+    start = time.perf_counter()
+    result = await coroutine
+    latencies.append(time.perf_counter() - start)
+    return result
+
+def bench_generation(problems, concurrency, args):
+    # The find_incorrect_solution.py flow: one generation per problem, then answer matching.
+    model = make_model(concurrency, args.latency, args.seed, args.contradiction_rate)
+    matcher = verification.MatchAnswer()
+    latencies = []
+
+    async def solve(problem):
+        with call_site("solve"):
+            response = await model.agenerate(problem["problem"])
+        return matcher.evaluate_solution(problem, response)
+
+    async def solve_all():
+        return await asyncio.gather(*(_timed(solve(problem), latencies) for problem in problems))
+
+    registry.reset()
+    cpu = time.process_time()
+    start = time.perf_counter()
+    results = asyncio.run(solve_all())
+    wall = time.perf_counter() - start
+    return {
+        "concurrency": concurrency,
+        "problems": len(problems),
+        "problems_per_sec": len(problems) / wall,
+        "model_calls_per_problem": model.backend.calls / len(problems),
+        "incorrect": results.count(False),
+        "latency_sec": latency_summary(latencies),
+        "metrics": registry.summary(),
+        "wall_sec": wall,
+        "cpu_sec": time.process_time() - cpu,
+    }
+
+def _verifier(problem_sentences, solution_sentences, stream=False):
+    verifier = verification.VerifyCotTheorems(stream=stream)
+    verifier.problem_sentences = problem_sentences
+    verifier.solution_sentences = solution_sentences
+    verifier.all_sentences = problem_sentences + solution_sentences
+    return verifier
+
+def bench_find_first_mistake(solutions, concurrency, mode, args):
+    # mode is 'sequential' (find_first_mistake), 'parallel', 'first_only' or 'stream' (afind_first_mistake, the last
+    # one with streamed responses cut off after the JSON block).
+    model = make_model(concurrency, args.latency, args.seed, args.contradiction_rate)
+    latencies = []
+    results = []
+    registry.reset()
+    cpu = time.process_time()
+    start = time.perf_counter()
+    for problem_sentences, solution_sentences in solutions:
+        verifier = _verifier(problem_sentences, solution_sentences, stream=(mode == "stream"))
+        solution_start = time.perf_counter()
+        if mode == "sequential":
+            results.append(verifier.find_first_mistake(model.generate))
+        else:
+            results.append(asyncio.run(verifier.afind_first_mistake(model.agenerate, first_only=(mode == "first_only"))))
+        latencies.append(time.perf_counter() - solution_start)
+    wall = time.perf_counter() - start
+    return {
+        "mode": mode,
+        "concurrency": concurrency,
+        "solutions": len(solutions),
+        "solutions_per_sec": len(solutions) / wall,
+        "model_calls_per_solution": model.backend.calls / len(solutions),
+        "flagged_solutions": sum(1 for result in results if result),
+        "latency_sec": latency_summary(latencies),
+        "metrics": registry.summary(),
+        "wall_sec": wall,
+        "cpu_sec": time.process_time() - cpu,
+    }
+
+def read_sentence_pairs(path, limit):
+    # (problem sentences, solution sentences) pairs of the segmented solutions in a results store written by
+    # prepare_baseline_prompt_2.py.
+    store = ResultsStore(path)
+    pairs = [(problem, solution) for _, problem, solution in store.segmented_generations() if solution]
+    store.close()
+    return pairs[:limit]
+
+def _model_calls():
+    return sum(site.get("calls", 0) for site in registry.summary().values())
+
+def bench_parity(pairs, model, window, concurrency):
+    # Runs the per-step, windowed and bisection verifiers on the same solutions and compares their mistakes
+    # with the per-step results. Bisection only reports the first mistake.
+    async def run(mode):
+        results = []
+        for problem_sentences, solution_sentences in pairs:
+            verifier = _verifier(problem_sentences, solution_sentences)
+            if mode == "windowed":
+                results.append(await verifier.afind_first_mistake_windowed(model.agenerate, window))
+            elif mode == "bisect":
+                results.append(await verifier.afind_first_mistake_bisect(model.agenerate))
+            else:
+                results.append(await verifier.afind_first_mistake(model.agenerate))
+        return results
+
+    report = {"window": window, "concurrency": concurrency, "solutions": len(pairs)}
+    results = {}
+    for mode in ("per_step", "windowed", "bisect"):
+        registry.reset()
+        start = time.perf_counter()
+        results[mode] = asyncio.run(run(mode))
+        report[mode] = {
+            "model_calls_per_solution": _model_calls() / max(1, len(pairs)),
+            "flagged_solutions": sum(1 for result in results[mode] if result),
+            "wall_sec": time.perf_counter() - start,
+            "metrics": registry.summary(),
+        }
+        if mode != "per_step":
+            same = [a == b for a, b in zip(results["per_step"], results[mode])]
+            same_first = [a[:1] == b[:1] for a, b in zip(results["per_step"], results[mode])]
+            report[mode]["agreement"] = sum(same) / max(1, len(same))
+            report[mode]["first_mistake_agreement"] = sum(same_first) / max(1, len(same_first))
+    return report
+
+def bench_context_cache(solutions, concurrency, args):
+    # Per-step verification with a stub backend that caches prefixes of at least --context-min-tokens (the
+    # provider minimum): how many requests get a context and which share of the input tokens it covers.
+    backend = ReplayBackend(responder=stub_responder(args.contradiction_rate, args.seed), latency=args.latency,
+                            seed=args.seed, min_context_tokens=args.context_min_tokens)
+    context_cache = ContextCache()
+    model = VertexAI(None, None, max_concurrency=concurrency, backend=backend, leader_backend=backend,
+                     rate_limiter=RateLimiter(requests_per_minute=float("inf")), context_cache=context_cache)
+    registry.reset()
+    for problem_sentences, solution_sentences in solutions:
+        asyncio.run(_verifier(problem_sentences, solution_sentences).afind_first_mistake(model.agenerate))
+    sites = registry.summary().values()
+    input_tokens = sum(site.get("input_tokens", 0) for site in sites)
+    cached_tokens = sum(site.get("cached_tokens", 0) for site in sites)
+    solution_tokens = sorted(estimate_tokens(' '.join(p + s)) for p, s in solutions)
+    return {
+        "solutions": len(solutions),
+        "min_context_tokens": args.context_min_tokens,
+        "median_solution_tokens": solution_tokens[len(solution_tokens) // 2] if solution_tokens else 0,
+        "cached_token_share": cached_tokens / input_tokens if input_tokens else 0.0,
+        **context_cache.stats(),
+    }
+
+def bench_cascade(solutions, concurrency, args):
+    # Compares the cheap -> leader cascade with checking every step with the cheap model only and with the
+    # leader model only, on a noisy cheap stub and an exact leader stub. Agreement is with the leader-only results.
+    model = make_model(concurrency, args.latency, args.seed, args.contradiction_rate, args.cheap_noise,
+                       ("lognormal", args.latency[1] * args.leader_latency_factor, args.latency[2]))
+    cascade = verification.Cascade(args.cheap_attempts, args.agreement)
+
+    async def run(mode):
+        results = []
+        for problem_sentences, solution_sentences in solutions:
+            verifier = _verifier(problem_sentences, solution_sentences)
+            solution_start = time.perf_counter()
+            if mode == "cascade":
+                results.append(await verifier.afind_first_mistake_cascade(model.agenerate, model.aleader_generate, cascade))
+            else:
+                results.append(await verifier.afind_first_mistake(model.agenerate if mode == "cheap" else model.aleader_generate))
+            latencies.append(time.perf_counter() - solution_start)
+        return results
+
+    report = {"concurrency": concurrency, "solutions": len(solutions), "cheap_noise": args.cheap_noise,
+              "leader_cost_factor": args.leader_cost_factor, "leader_latency_factor": args.leader_latency_factor}
+    results = {}
+    for mode in ("leader", "cheap", "cascade"):
+        latencies = []
+        registry.reset()
+        cheap_calls, leader_calls = model.backend.calls, model.leader_backend.calls
+        start = time.perf_counter()
+        results[mode] = asyncio.run(run(mode))
+        same = [a == b for a, b in zip(results["leader"], results[mode])]
+        report[mode] = {
+            "cheap_calls_per_solution": (model.backend.calls - cheap_calls) / len(solutions),
+            "leader_calls_per_solution": (model.leader_backend.calls - leader_calls) / len(solutions),
+            "agreement": sum(same) / max(1, len(same)),
+            "latency_sec": latency_summary(latencies),
+            "wall_sec": time.perf_counter() - start,
+            "metrics": registry.summary(),
+        }
+        # In units of one cheap call, with leader calls priced at --leader-cost-factor.
+        report[mode]["estimated_cost_per_solution"] = (report[mode]["cheap_calls_per_solution"]
+                                                       + args.leader_cost_factor * report[mode]["leader_calls_per_solution"])
+    return report
+
+def bench_voting(solutions, concurrency, args):
+    # Compares the per-step check with sequential voting on the noisy cheap stub. Agreement is with the exact
+    # (leader stub) per-step results; confidence is averaged over the flagged steps.
+    model = make_model(concurrency, args.latency, args.seed, args.contradiction_rate, args.cheap_noise)
+    # 'vote' probes each step with one low-temperature sample and votes on unsettled and flagged steps,
+    # 'vote_unconfirmed' accepts flagged probes too and 'vote_full' votes on every step.
+    votes = {
+        "vote": verification.SequentialVote(args.vote_accuracy, args.vote_error),
+        "vote_unconfirmed": verification.SequentialVote(args.vote_accuracy, args.vote_error, confirm_mistakes=False),
+        "vote_full": verification.SequentialVote(args.vote_accuracy, args.vote_error, probe=False),
+    }
+
+    async def run(mode):
+        results, latencies, confidences = [], [], []
+        for problem_sentences, solution_sentences in solutions:
+            verifier = _verifier(problem_sentences, solution_sentences)
+            start = time.perf_counter()
+            if mode in votes:
+                result = await verifier.afind_first_mistake_voting(model.agenerate, votes[mode])
+                confidences += [verifier.step_confidence[step - len(problem_sentences) - 1] for step in result]
+            else:
+                result = await verifier.afind_first_mistake(model.aleader_generate if mode == "exact" else model.agenerate)
+            latencies.append(time.perf_counter() - start)
+            results.append(result)
+        return results, latencies, confidences
+
+    report = {"concurrency": concurrency, "solutions": len(solutions), "cheap_noise": args.cheap_noise, "lead": votes["vote"].lead}
+    results = {}
+    for mode in ("exact", "per_step", *votes):
+        registry.reset()
+        calls = model.backend.calls + model.leader_backend.calls
+        results[mode], latencies, confidences = asyncio.run(run(mode))
+        same = [a == b for a, b in zip(results["exact"], results[mode])]
+        report[mode] = {
+            "model_calls_per_solution": (model.backend.calls + model.leader_backend.calls - calls) / len(solutions),
+            "agreement": sum(same) / max(1, len(same)),
+            "latency_sec": latency_summary(latencies),
+            "mean_flagged_confidence": sum(confidences) / len(confidences) if confidences else None,
+            "metrics": registry.summary(),
+        }
+    return report
+
+IMPORT_MODULES = ["math_equivalence", "verification", "model", "find_incorrect_solution", "find_first_mistake",
+                  "prepare_baseline_prompt_2", "pipeline", "score_generations"]
+# Dependencies that are slow to import and should only be loaded when they are used.
+HEAVY_MODULES = ["vertexai", "google.genai", "google.cloud", "datasets", "spacy", "sympy", "numpy", "pyarrow"]
+
+_IMPORT_PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{"sec": elapsed, "heavy": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+def bench_import_time(modules, repeat):
+    # Every import is timed in a fresh interpreter, so nothing is already in sys.modules.
+    report = {}
+    root = os.path.dirname(os.path.abspath(__file__))
+    for module in modules:
+        times = []
+        heavy = []
+        for _ in range(repeat):
+            probe = subprocess.run([sys.executable, "-c", _IMPORT_PROBE.format(module=module, heavy=HEAVY_MODULES)],
+                                   capture_output=True, text=True, cwd=root)
+            if probe.returncode != 0:
+                # Missing optional dependencies are reported, not fatal.
+                report[module] = {"error": probe.stderr.strip().splitlines()[-1] if probe.stderr.strip() else "failed"}
+                break
+            result = json.loads(probe.stdout.strip().splitlines()[-1])
+            times.append(result["sec"])
+            heavy = result["heavy"]
+        else:
+            report[module] = {"sec": sorted(times)[len(times) // 2], "heavy_modules": heavy}
+    return report
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the verification pipeline against a stubbed, latency-simulating model.")
+    parser.add_argument("--problems", type=int, default=200, help="Problems for the generation benchmark.")
+    parser.add_argument("--solutions", type=int, default=5, help="Solutions for the step verification benchmark.")
+    parser.add_argument("--steps", type=int, default=20, help="Solution sentences per synthetic solution.")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16, 64])
+    parser.add_argument("--latency", type=float, default=0.05, help="Median simulated model latency in seconds.")
+    parser.add_argument("--latency-sigma", type=float, default=0.5, help="Sigma of the log-normal latency distribution.")
+    parser.add_argument("--contradiction-rate", type=float, default=0.05)
+    parser.add_argument("--repeat", type=int, default=200, help="Repetitions of the local (model-free) benchmarks.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--window", type=int, default=4, help="Steps per call for the windowed verifier.")
+    parser.add_argument("--cheap-noise", type=float, default=0.1,
+                        help="Fraction of noisy step checks from the cheap model in the cascade benchmark.")
+    parser.add_argument("--leader-latency-factor", type=float, default=4.0, help="Leader model latency relative to the cheap one.")
+    parser.add_argument("--leader-cost-factor", type=float, default=4.0,
+                        help="Price of a leader model call relative to a cheap one, for the cascade cost estimate.")
+    parser.add_argument("--cheap-attempts", type=int, default=3, help="Cheap attempts per step before the cascade escalates.")
+    parser.add_argument("--agreement", type=int, default=2, help="Agreeing cheap verdicts the cascade needs to accept a step.")
+    parser.add_argument("--vote-accuracy", type=float, default=0.9, help="Assumed per-sample accuracy of the sequential vote.")
+    parser.add_argument("--vote-error", type=float, default=0.05, help="Error rate the sequential vote stops at.")
+    parser.add_argument("--context-min-tokens", type=int, default=2048,
+                        help="Smallest prefix the simulated provider caches (Vertex AI's CachedContent minimum).")
+    parser.add_argument("--parity-file", default="results.sqlite",
+                        help="Results store with segmented solutions for the parity check (synthetic solutions if it is missing).")
+    parser.add_argument("--parity-solutions", type=int, default=50)
+    parser.add_argument("--project", help="Run the parity check against Vertex AI in this GCP project instead of the stub.")
+    parser.add_argument("--location", default="us-central1")
+    parser.add_argument("--import-repeat", type=int, default=5, help="Fresh interpreters per module for the import-time benchmark.")
+    parser.add_argument("--output", default="bench_results.json")
+    args = parser.parse_args(argv)
+    args.latency = ("lognormal", args.latency, args.latency_sigma)
+    return args
+
+def main(argv=None):
+    logging.basicConfig(level=logging.WARNING)
+    args = parse_args(argv)
+    problems = synthetic_problems(args.problems)
+    solutions = synthetic_solutions(args.solutions, args.steps)
+    results = {
+        "commit": git_commit(),
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "config": {key: value for key, value in vars(args).items() if key != "output"},
+        "is_equiv": bench_is_equiv(args.repeat),
+        "evaluate_solution": bench_evaluate_solution(problems, max(1, args.repeat // 10)),
+        "score_items": [bench_score_items(problems, args.repeat, processes) for processes in sorted({1, os.cpu_count()})],
+        "generation": [bench_generation(problems, concurrency, args) for concurrency in args.concurrency],
+        "find_first_mistake": [bench_find_first_mistake(solutions, 1, "sequential", args)],
+    }
+    for concurrency in args.concurrency:
+        for mode in ("parallel", "first_only", "stream"):
+            results["find_first_mistake"].append(bench_find_first_mistake(solutions, concurrency, mode, args))
+    pairs = read_sentence_pairs(args.parity_file, args.parity_solutions) if os.path.exists(args.parity_file) else []
+    if not pairs:
+        pairs = synthetic_solutions(args.solutions, args.steps)
+    if args.project:
+        from response_cache import ResponseCache
+        parity_model = VertexAI(args.project, args.location, max_concurrency=max(args.concurrency),
+                                cache=ResponseCache("response_cache.sqlite"))
+    else:
+        parity_model = make_model(max(args.concurrency), args.latency, args.seed, args.contradiction_rate)
+    results["parity"] = bench_parity(pairs, parity_model, args.window, max(args.concurrency))
+    # Typical solutions, and ones with long (~100 token) sentences whose prefixes reach the provider minimum.
+    long_solutions = [(problem, [sentence + " This follows from the previous step by substitution." * 8 for sentence in solution])
+                      for problem, solution in synthetic_solutions(args.solutions, 3 * args.steps)]
+    results["context_cache"] = [bench_context_cache(pairs, max(args.concurrency), args),
+                                bench_context_cache(long_solutions, max(args.concurrency), args)]
+    results["cascade"] = bench_cascade(solutions, max(args.concurrency), args)
+    results["voting"] = bench_voting(solutions, max(args.concurrency), args)
+    results["import_time"] = bench_import_time(IMPORT_MODULES, args.import_repeat)
+    with open(args.output, "w", encoding="utf-8") as fout:
+        json.dump(results, fout, indent=2)
+    print(f"is_equiv: {results['is_equiv']['calls_per_sec']:.0f} calls/sec")
+    for entry in results["score_items"]:
+        print(f"score_items processes={entry['processes']}: {entry['items_per_sec']:.0f} items/sec")
+    for entry in results["generation"]:
+        print(f"generation c={entry['concurrency']}: {entry['problems_per_sec']:.1f} problems/sec, "
+              f"p50={entry['latency_sec']['p50']:.3f}s p99={entry['latency_sec']['p99']:.3f}s, cpu={entry['cpu_sec']:.2f}s")
+    for entry in results["find_first_mistake"]:
+        print(f"find_first_mistake {entry['mode']} c={entry['concurrency']}: {entry['solutions_per_sec']:.2f} solutions/sec, "
+              f"{entry['model_calls_per_solution']:.1f} calls/solution, p50={entry['latency_sec']['p50']:.3f}s, cpu={entry['cpu_sec']:.2f}s")
+    parity = results["parity"]
+    for mode in ("windowed", "bisect"):
+        print(f"{mode} verifier: {parity[mode]['model_calls_per_solution']:.1f} vs {parity['per_step']['model_calls_per_solution']:.1f} "
+              f"calls/solution, agreement={parity[mode]['agreement']:.2f}, "
+              f"first-mistake agreement={parity[mode]['first_mistake_agreement']:.2f} on {parity['solutions']} solutions")
+    for entry in results["context_cache"]:
+        print(f"context cache on {entry['solutions']} solutions of ~{entry['median_solution_tokens']} tokens: "
+              f"hit rate={entry['hit_rate'] or 0:.2f}, {entry['cached_token_share']:.2f} of input tokens from the cache, "
+              f"{entry['contexts_created']} contexts (minimum {entry['min_context_tokens']} tokens)")
+    cascade = results["cascade"]
+    for mode in ("leader", "cheap", "cascade"):
+        print(f"{mode}: {cascade[mode]['cheap_calls_per_solution']:.1f} cheap + {cascade[mode]['leader_calls_per_solution']:.1f} "
+              f"leader calls/solution, est. cost={cascade[mode]['estimated_cost_per_solution']:.1f} cheap-call units "
+              f"(leader x{cascade['leader_cost_factor']:g}), agreement with leader={cascade[mode]['agreement']:.2f}, "
+              f"p50={cascade[mode]['latency_sec']['p50']:.3f}s")
+    voting = results["voting"]
+    for mode in ("per_step", "vote", "vote_unconfirmed", "vote_full"):
+        print(f"{mode} on the noisy model: {voting[mode]['model_calls_per_solution']:.1f} calls/solution, "
+              f"agreement with exact={voting[mode]['agreement']:.2f}, p50={voting[mode]['latency_sec']['p50']:.3f}s")
+    for module, entry in results["import_time"].items():
+        if "error" in entry:
+            print(f"import {module}: {entry['error']}")
+        else:
+            print(f"import {module}: {entry['sec'] * 1000:.0f} ms, heavy modules loaded: {entry['heavy_modules'] or 'none'}")
+    print(f"Results written to {args.output}.")
+
+if __name__ == "__main__":
+    main()
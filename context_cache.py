@@ -0,0 +1,111 @@
+import asyncio
+import collections
+import contextlib
+import contextvars
+import hashlib
+import logging
+import time
+from rate_limiter import estimate_tokens
+
+# Get a logger for this module
+logger = logging.getLogger(__name__)
+
+_shared_prefix = contextvars.ContextVar("shared_prefix", default=None)
+
+@contextlib.contextmanager
+def shared_prefix(prefix):
+    # Declares that prompts sent inside the block start with 'prefix', which other requests share.
+    # Only a hint: the prompt text itself is unchanged.
+    token = _shared_prefix.set(prefix)
+    try:
+        yield
+    finally:
+        _shared_prefix.reset(token)
+
+def current_prefix():
+    return _shared_prefix.get()
+
+class ContextCache:
+    # Provider-side caches (e.g. Vertex AI CachedContent) of long prompt prefixes shared by many requests.
+    # VertexAI sends only the part of the prompt after the prefix together with a reference to the cache.
+    # Prefixes shorter than 'min_tokens' (by default the backend's provider minimum, min_context_tokens) or
+    # backends without support use the full prompt. Must be used from one event loop (VertexAI's background loop).
+
+    def __init__(self, min_tokens=None, ttl=600, max_contexts=64):
+        self.min_tokens = min_tokens
+        self.ttl = ttl
+        self.max_contexts = max_contexts
+        # (backend name, prefix digest) -> (backend, future of the context handle or None, expiry time)
+        self._contexts = collections.OrderedDict()
+        self.created = 0
+        self.failures = 0
+        self.requests = 0
+        self.below_minimum = 0
+        self.prefix_tokens = 0
+
+    def _key(self, backend, prefix):
+        return backend.name, hashlib.sha256(prefix.encode("utf-8")).hexdigest()
+
+    async def acquire(self, backend, prefix):
+        # Returns a context handle for 'prefix', creating it on first use, or None to send the full prompt.
+        if not getattr(backend, "supports_context_cache", False):
+            return
+        min_tokens = self.min_tokens if self.min_tokens is not None else backend.min_context_tokens or 0
+        if estimate_tokens(prefix) < min_tokens:
+            # Counted, so stats() shows how often prefixes are too short for the provider to cache.
+            self.below_minimum += 1
+            return
+        key = self._key(backend, prefix)
+        entry = self._contexts.get(key)
+        if entry is not None and entry[2] <= time.monotonic():
+            # Recreate contexts shortly before the provider expires them.
+            self._contexts.pop(key)
+            entry = None
+        if entry is None:
+            future = asyncio.get_running_loop().create_future()
+            self._contexts[key] = (backend, future, time.monotonic() + 0.9 * self.ttl)
+            try:
+                handle = await backend.acreate_context(prefix, self.ttl)
+                self.created += 1
+                future.set_result(handle)
+            except Exception as e:
+                logger.warning(f"Couldn't create a context cache, sending full prompts instead: {e}")
+                self.failures += 1
+            finally:
+                if not future.done():
+                    future.set_result(None)
+            while len(self._contexts) > self.max_contexts:
+                # Evicted contexts are left to expire on the provider side.
+                self._contexts.popitem(last=False)
+        else:
+            self._contexts.move_to_end(key)
+            future = entry[1]
+        handle = await asyncio.shield(future)
+        if handle is not None:
+            self.requests += 1
+            self.prefix_tokens += estimate_tokens(prefix)
+        return handle
+
+    def discard(self, backend, prefix):
+        # Forget a context the provider rejected (e.g. expired), so the next request recreates it.
+        self._contexts.pop(self._key(backend, prefix), None)
+
+    def stats(self):
+        return {
+            "contexts_created": self.created,
+            "failures": self.failures,
+            "requests_with_context": self.requests,
+            "below_minimum": self.below_minimum,
+            "hit_rate": self.requests / (self.requests + self.below_minimum) if self.requests + self.below_minimum else None,
+            "prefix_tokens_from_cache": self.prefix_tokens,
+        }
+
+    def close(self):
+        # Delete the contexts still held instead of waiting for their TTL.
+        for backend, future, _ in self._contexts.values():
+            if future.done() and future.result() is not None:
+                try:
+                    backend.delete_context(future.result())
+                except Exception as e:
+                    logger.warning(f"Couldn't delete a context cache: {e}")
+        self._contexts.clear()
@@ -1,23 +1,73 @@
-import random
-from datasets import load_dataset
+import hashlib
+import json
+import os
+
+DATASET_NAME = "nlile/hendrycks-MATH-benchmark"
+HARD_EXCLUDED_SUBJECTS = ["Geometry", "Precalculus"]
+# Filtered, shuffled row indices are persisted here so later runs skip the scan.
+INDEX_CACHE_DIR = ".cache"
+
+class ProblemView:
+    # Lazy view over rows of a memory-mapped Hugging Face dataset. Slicing returns another view, and rows are
+    # only converted to dicts when they are accessed.
+
+    def __init__(self, dataset, indices=None):
+        self.dataset = dataset
+        self.indices = range(len(dataset)) if indices is None else indices
+
+    def __len__(self):
+        return len(self.indices)
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return ProblemView(self.dataset, self.indices[item])
+        return self.dataset[int(self.indices[item])]
+
+    def __iter__(self, batch_size=256):
+        for start in range(0, len(self.indices), batch_size):
+            rows = [int(i) for i in self.indices[start:start + batch_size]]
+            columns = self.dataset[rows]
+            for j in range(len(rows)):
+                yield {name: values[j] for name, values in columns.items()}
+
+def _load_dataset():
+    # datasets takes seconds to import, so it is only imported when a dataset is actually loaded.
+    from datasets import load_dataset
+    return load_dataset(DATASET_NAME, split="train")
 
 def load_MATH():
     # Load the dataset from Hugging Face.
-    math_problems = load_dataset("nlile/hendrycks-MATH-benchmark", split='train')
-    # Convert the Dataset object to a list of dictionaries
-    problems = [dict(item) for item in math_problems]
-    return problems
-
-def load_MATH_hard():
-    # load the training split
-    ds = load_dataset("nlile/hendrycks-MATH-benchmark", split="train")
-    # filter for Level 5
-    hard = ds.filter(lambda ex: ex["level"] == 5)
-    algebraic = ds.filter(lambda ex: ex['subject'] != 'Geometry' and ex['subject'] != 'Precalculus')
-    # pick one at random
-    shuffled = algebraic.shuffle(seed=42)
-    problems = [dict(item) for item in shuffled]
-    return problems
+    math_problems = _load_dataset()
+    return ProblemView(math_problems)
+
+def _hard_indices(ds, level, seed):
+    # Vectorized filter on the Arrow columns, followed by the same permutation Dataset.shuffle(seed) applies.
+    import numpy as np
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    mask = pc.invert(pc.is_in(ds.data.column("subject"), value_set=pa.array(HARD_EXCLUDED_SUBJECTS)))
+    if level is not None:
+        mask = pc.and_(mask, pc.equal(ds.data.column("level"), level))
+    selected = np.flatnonzero(pc.fill_null(mask, False).to_numpy())
+    permutation = np.random.default_rng(seed).permutation(len(selected))
+    return selected[permutation].tolist()
+
+def load_MATH_hard(level=None, seed=42):
+    # Non-geometry/non-precalculus problems, shuffled. 'level' optionally restricts them to one level
+    # (e.g. 5); the default keeps the selection all earlier runs were made with.
+    ds = _load_dataset()
+    key = json.dumps([ds._fingerprint, HARD_EXCLUDED_SUBJECTS, level, seed])
+    cache_path = os.path.join(INDEX_CACHE_DIR, f"math_hard_{hashlib.sha256(key.encode('utf-8')).hexdigest()[:16]}.json")
+    if os.path.exists(cache_path):
+        with open(cache_path, "r") as fin:
+            indices = json.load(fin)
+    else:
+        indices = _hard_indices(ds, level, seed)
+        os.makedirs(INDEX_CACHE_DIR, exist_ok=True)
+        with open(cache_path + ".tmp", "w") as fout:
+            json.dump(indices, fout)
+        os.replace(cache_path + ".tmp", cache_path)
+    return ProblemView(ds, indices)
 
 def load_test_problem():
     return [{'problem': r'How many vertical asymptotes does the graph of $y=\frac{x+1}{(x+1)^2}$ have?'}]
@@ -1,51 +1,182 @@
 from logger_setup import setup_logging
-# Initialize logging early in the application
-setup_logging("find_mistake")
+import argparse
 import logging
+import asyncio
+import sys
 from model import VertexAI 
+from response_cache import ResponseCache
+from run_journal import RunJournal
+from results_store import ResultsStore
+from context_cache import ContextCache
+from metrics import registry
+import sharding
 import verification
 # Get a logger for the main module
 logger = logging.getLogger(__name__)
 
-def read_sentences(file, number):
-    with open(file, 'r') as fin:
-        content = fin.read()
-    sep = '-' * 80
-    raw_paras = content.split(sep)
-    paragraphs = [p.strip() for p in raw_paras if p.strip()]
-    paragraphs = paragraphs[20:20 + number]
-    sep2 = '*'*80
-    pairs = [p.split(sep2) for p in paragraphs]
-    result = []
-    for i in range(len(pairs)):
-        temporary_problem = [sentence.strip() for sentence in pairs[i][0].splitlines() if sentence.strip()]
-        temporary_solution = [sentence.strip() for sentence in pairs[i][1].splitlines() if sentence.strip()]
-        result.append([temporary_problem, temporary_solution])
-    return result
+# Check all steps of a solution concurrently instead of one after another.
+PARALLEL_STEPS = True
 
-def test_find_first_mistake(problem_sent, solution_sent):
-    model = VertexAI("focus-heuristic-454302-d2", "us-central1")
-    verifier = verification.VerifyCotTheorems()
+def test_find_first_mistake(model, problem_sent, solution_sent, cascade=None, vote=None, stream=False, window=None,
+                            bisect=None):
+    # With a verification.Cascade, steps are checked with the cheap model and escalated to the leader model;
+    # with a verification.SequentialVote, each step is decided by voting over parallel samples; with a 'window',
+    # one call proves and checks that many consecutive steps; with 'bisect' (a span), prefix checks narrow the
+    # search to that many steps before the first mistake is checked step by step. With 'stream', responses are
+    # streamed and check_application stops reading after its JSON block.
+    verifier = verification.VerifyCotTheorems(stream=stream, registry=model.metrics)
     verifier.solution_sentences = solution_sent
     verifier.problem_sentences = problem_sent
     verifier.all_sentences = problem_sent + solution_sent
     logger.info('-'*100)
     logger.info(f"Processing {problem_sent}")
-    mistake_indices = verifier.find_first_mistake(model.generate)
+    if vote is not None:
+        mistake_indices = asyncio.run(verifier.afind_first_mistake_voting(model.agenerate, vote))
+        logger.info(f"Confidence of the flagged steps: "
+                    f"{[verifier.step_confidence[i - len(problem_sent) - 1] for i in mistake_indices]}")
+    elif bisect is not None and PARALLEL_STEPS:
+        mistake_indices = asyncio.run(verifier.afind_first_mistake_bisect(model.agenerate, bisect))
+    elif bisect is not None:
+        mistake_indices = verifier.find_first_mistake_bisect(model.generate, bisect)
+    elif window is not None and PARALLEL_STEPS:
+        mistake_indices = asyncio.run(verifier.afind_first_mistake_windowed(model.agenerate, window))
+    elif window is not None:
+        mistake_indices = verifier.find_first_mistake_windowed(model.generate, window)
+    elif cascade is not None and PARALLEL_STEPS:
+        mistake_indices = asyncio.run(verifier.afind_first_mistake_cascade(model.agenerate, model.aleader_generate, cascade))
+    elif cascade is not None:
+        mistake_indices = verifier.find_first_mistake_cascade(model.generate, model.leader_generate, cascade)
+    elif PARALLEL_STEPS:
+        mistake_indices = asyncio.run(verifier.afind_first_mistake(model.agenerate))
+    else:
+        mistake_indices = verifier.find_first_mistake(model.generate)
     logger.info(f"{problem_sent}: {mistake_indices}")
-    return mistake_indices
+    return mistake_indices, verifier.step_records(mistake_indices)
 
-if __name__ == "__main__":
-    sentences_list = read_sentences("clean_sentences_2.txt", 30)
+def run_shard(args, shard, shards):
+    program = sharding.shard_path("find_mistake", shard, shards)
+    # Initialize logging early in the application
+    setup_logging(program)
+    # Segmented solutions written by prepare_baseline_prompt_2.py, in problem order. Failed segmentations have no
+    # sentences and aren't listed, so --offset counts successful segmentations only (unlike the line numbers of
+    # the old clean_sentences_2.txt, which included the failures).
+    source = ResultsStore(args.store)
+    solutions = source.segmented_generations()[args.offset:args.offset + args.solutions]
+    source.close()
+    selected = sharding.select(solutions, shard, shards, args.split, key=lambda solution: solution[0])
+    logger.info(f"Shard {shard + 1}/{shards}: {len(selected)} of {len(solutions)} solutions.")
+    # Shards append their verdicts to their own store, merged into --store afterwards.
+    store = ResultsStore(sharding.shard_path(args.store, shard, shards))
+    # Shared by all local shards; ResponseCache handles concurrent writers.
+    cache = ResponseCache("response_cache.sqlite")
+    # Step prompts of one solution share a prefix, which can be served from provider-side context caches. Off by
+    # default: MATH solutions are far shorter than the provider minimum, so the prefixes never qualify.
+    context_cache = ContextCache() if args.context_cache else None
+    model = VertexAI(args.project, args.location, cache=cache, context_cache=context_cache, store=store)
+    # Solutions already verified in an earlier, interrupted run are read back from the journal.
+    journal = RunJournal(program + ".journal.jsonl")
+    registry.start_periodic_summary()
+    cascade = None
+    if args.cascade:
+        cascade = verification.Cascade(args.cheap_attempts, args.agreement, args.max_unsettled, not args.accept_cheap_mistakes)
+    vote = None
+    if args.vote:
+        vote = verification.SequentialVote(args.vote_accuracy, args.vote_error, args.max_samples, probe=not args.vote_full)
+    mode = "_cascade" if cascade is not None else f"_window{args.window}" if args.window is not None else ""
+    bisect = args.bisect_span if args.bisect else None
+    if bisect is not None:
+        mode = "_bisect"
+    run = ("parallel" if PARALLEL_STEPS else "sequential") + mode
+    if vote is not None:
+        run = "vote"
     result = []
-    for sentences in sentences_list:
-        indices = test_find_first_mistake(sentences[0], sentences[1])
-        with open("partial_result.txt", "a") as file:
-            file.write('-'*80)
-            file.write('\n')
-            file.write(f'{sentences}\n')
-            file.write('*'*80)
-            file.write('\n')
-            file.write(f'{indices}\n')
+    for _, (generation_id, problem_sent, solution_sent) in selected:
+        key = journal.key(problem_sent, solution_sent)
+        if mode or vote is not None:
+            # Cascade, voting, windowed and bisection results are journaled separately from per-step results.
+            key = journal.key(run, problem_sent, solution_sent)
+        if key in journal:
+            indices = journal.get(key)
+            # Runs that didn't write a store only journaled the mistakes.
+            store.add_verdicts(generation_id, run, [{"step": step, "mistake": True} for step in indices])
+            result.append(indices)
+            continue
+        indices, steps = test_find_first_mistake(model, problem_sent, solution_sent, cascade, vote, args.stream,
+                                                 args.window, bisect)
+        store.add_verdicts(generation_id, run, steps)
+        journal.record(key, indices)
         result.append(indices)
+    journal.close()
     logger.info(f"result={result}")
+    logger.info(f"Response cache: {cache.stats()}")
+    if context_cache is not None:
+        logger.info(f"Context cache: {context_cache.stats()}")
+        context_cache.close()
+    registry.stop_periodic_summary()
+    registry.log_summary()
+    registry.export(program)
+    store.close()
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Find the first mistaken step of cleaned problem-solution pairs.")
+    parser.add_argument("--project", default="focus-heuristic-454302-d2", help="GCP project id.")
+    parser.add_argument("--location", default="us-central1", help="GCP region.")
+    parser.add_argument("--store", default="results.sqlite",
+                        help="Results store to read segmented solutions from and append per-step verdicts to.")
+    parser.add_argument("--offset", type=int, default=20, help="Number of segmented solutions to skip (failed segmentations aren't counted).")
+    parser.add_argument("--solutions", type=int, default=30)
+    # Search modes; without one, every step gets its own name_theorem and check_application calls.
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--cascade", action="store_true",
+                      help="Check steps with the cheap model and escalate uncertain ones to the leader model.")
+    mode.add_argument("--vote", action="store_true",
+                      help="Decide each step by a sequential vote over parallel samples, with a confidence per step.")
+    mode.add_argument("--window", type=int, metavar="N",
+                      help="Prove and check N consecutive steps per call, falling back to per-step checks for "
+                           "windows whose answer doesn't validate.")
+    mode.add_argument("--bisect", action="store_true",
+                      help="Only locate the first mistake: bisect with prefix checks, then check the remaining "
+                           "--bisect-span steps one by one.")
+    parser.add_argument("--cheap-attempts", type=int, default=3, help="Cheap attempts per step before escalating.")
+    parser.add_argument("--agreement", type=int, default=2, help="Agreeing cheap verdicts needed to accept a step.")
+    parser.add_argument("--max-unsettled", type=int, default=0,
+                        help="Cheap attempts that may fail to parse or come back 'neither' before escalating.")
+    parser.add_argument("--accept-cheap-mistakes", action="store_true",
+                        help="Accept cheap 'contradict' verdicts instead of having the leader model confirm them.")
+    parser.add_argument("--vote-full", action="store_true",
+                        help="Vote on every step instead of probing each step with one sample first.")
+    parser.add_argument("--vote-accuracy", type=float, default=0.9, help="Assumed per-sample accuracy of the vote.")
+    parser.add_argument("--vote-error", type=float, default=0.05, help="Error rate at which the vote stops.")
+    parser.add_argument("--max-samples", type=int, default=10, help="Samples per step before the vote gives up.")
+    parser.add_argument("--bisect-span", type=int, default=2, help="Candidate steps left when --bisect stops bisecting.")
+    parser.add_argument("--stream", action="store_true",
+                        help="Stream responses and stop reading check_application answers after their JSON block.")
+    parser.add_argument("--context-cache", action="store_true",
+                        help="Serve the shared solution prefix of step prompts from provider-side context caches "
+                             "(only pays off for solutions longer than the provider minimum, 2048 tokens).")
+    sharding.add_arguments(parser)
+    args = parser.parse_args(argv)
+    if args.window is not None and args.window < 1:
+        parser.error("--window needs at least 1 step per call")
+    if args.bisect_span < 1:
+        parser.error("--bisect-span needs at least 1 step")
+    return args
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    args = parse_args(argv)
+    if args.shard is not None:
+        run_shard(args, args.shard, args.shards)
+    elif args.merge:
+        setup_logging("find_mistake")
+        sharding.merge_stores(args.store, args.shards)
+    elif args.workers > 1:
+        setup_logging("find_mistake")
+        if not sharding.run_workers(__file__, argv, args.workers, args.targets):
+            sys.exit(1)
+        sharding.merge_stores(args.store, args.workers)
+    else:
+        run_shard(args, 0, 1)
+
+if __name__ == "__main__":
+    main()
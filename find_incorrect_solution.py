@@ -1,54 +1,158 @@
-import json
-from model import VertexAI 
-from dataloader import load_MATH_hard 
+import argparse
+import asyncio
+import sys
+from model import VertexAI
+from response_cache import ResponseCache
+from run_journal import RunJournal
+from results_store import ResultsStore
+from batch_prediction import LocalBatchBackend, VertexBatchBackend
+from dataloader import load_MATH_hard
 import re
-from logger_setup import setup_logging
+from logger_setup import setup_logging, EXCHANGE
 from math_equivalence import is_equiv
+from answer_extraction import extract_boxed
+from symbolic_equivalence import SymbolicChecker
+from metrics import call_site, registry
+import sharding
 import logging
-setup_logging("find_incorrect_solution")
 logger = logging.getLogger(__name__)
 
 PROBLEM_NUMBERS = 850
-math_problems = load_MATH_hard() # or 'load_MATH' if testing on all problems
-math_problems = math_problems[:PROBLEM_NUMBERS]
-model = VertexAI(# Your project name, # Your project region)
-incorrect_solutions = []
-
-for idx, problem in enumerate(math_problems):
-    bare_prompt = problem['problem']  # Use 'problem' key
-    # TODO: if necessary, add the prompt "Please provide your final answer within \boxed{...}.".
-    prompt = bare_prompt
+
+def check_response(idx, total, problem, response, symbolic):
+    # Returns the incorrect-solution record for a response, or None if the answer matches or can't be extracted.
+    bare_prompt = problem['problem']
     logger.info("-"*80)
-    logger.info(f"Processing problem {idx + 1}/{len(math_problems)}: {prompt}")
-    response = model.generate(prompt)
+    logger.info(f"Processing problem {idx + 1}/{total}: {bare_prompt}")
     logger.info("-"*40)
-    logger.info(f"response = {response}")
+    logger.info(f"response = {response}", extra=EXCHANGE)
     logger.info("-"*40)
-    if not response:
-        logger.info(f"Couldn't generate model response while processing problem {idx + 1}/{len(math_problems)}")
-        continue
     answer_key = problem.get('answer', '').strip()
-    start_tag = r'\boxed{'
-    start = response.rfind(start_tag)
-    if start == -1:
-        logger.info(f"couldn't find boxed content solving problem {idx + 1}")
-        continue
-    start += len(start_tag)
-    end = response.rfind('}')
-    if end == -1 or end < start:
+    boxed_content = extract_boxed(response)
+    if boxed_content is None:
         logger.info(f"couldn't find boxed content solving problem {idx + 1}")
-        continue
-    boxed_content = response[start:end].strip()
-    if not is_equiv(boxed_content, answer_key):
-        incorrect_solutions.append({
+        return
+    if not is_equiv(boxed_content, answer_key, symbolic=symbolic):
+        return {
             "problem": bare_prompt,
             "official_answer": answer_key,
             "model_answer": boxed_content,
             "model_response": response
-        })
+        }
+
+def record_solution(model, journal, store, idx, total, problem, response, symbolic):
+    if not response:
+        # Not journaled, so the problem is retried on the next run.
+        logger.info(f"Couldn't generate model response while processing problem {idx + 1}/{total}")
+        return
+    prompt = problem['problem']
+    case = check_response(idx, total, problem, response, symbolic)
+    problem_id = store.add_problem(prompt, problem.get('answer', '').strip(), position=idx)
+    model_answer = case["model_answer"] if case is not None else extract_boxed(response)
+    # Responses without a \boxed{} answer are stored with correct unknown.
+    correct = case is None if model_answer is not None else None
+    store.add_generation(problem_id, model.model_name, response, model_answer, correct)
+    journal.record(journal.key(prompt), case)
+
+async def solve_all(model, journal, store, problems, total, symbolic):
+    async def solve(idx, problem):
+        # TODO: if necessary, add the prompt "Please provide your final answer within \boxed{...}.".
+        prompt = problem['problem']  # Use 'problem' key
+        if journal.key(prompt) in journal:
+            return
+        with call_site("solve"):
+            response = await model.agenerate(prompt)
+        record_solution(model, journal, store, idx, total, problem, response, symbolic)
+
+    # Keep up to model.max_concurrency requests in flight.
+    await asyncio.gather(*(solve(idx, problem) for idx, problem in problems))
+
+def solve_batch(model, batch, journal, store, problems, total, symbolic, poll_interval):
+    # Generates all problems not journaled yet as one batch prediction job and records the responses as
+    # solve_all does. Failed requests are left for the next run.
+    todo = [(idx, problem) for idx, problem in problems if journal.key(problem['problem']) not in journal]
+    logger.info(f"Submitting {len(todo)} problems as a batch job.")
+    with call_site("solve"):
+        responses = model.batch_generate([problem['problem'] for _, problem in todo], batch, poll_interval=poll_interval)
+    for (idx, problem), response in zip(todo, responses):
+        record_solution(model, journal, store, idx, total, problem, response, symbolic)
+
+def make_batch_backend(args, model):
+    if args.batch == "vertex":
+        return VertexBatchBackend(model.model_name, args.project, args.location, args.batch_staging)
+    # Runs the batch locally through the online backend, e.g. to test the batch flow.
+    return LocalBatchBackend(model.backend)
+
+def run_shard(args, shard, shards):
+    program = sharding.shard_path("find_incorrect_solution", shard, shards)
+    setup_logging(program)
+    math_problems = load_MATH_hard() # or 'load_MATH' if testing on all problems
+    math_problems = math_problems[:args.problems]
+    problems = sharding.select(math_problems, shard, shards, args.split, key=lambda problem: problem['problem'])
+    logger.info(f"Shard {shard + 1}/{shards}: {len(problems)} of {len(math_problems)} problems.")
+    # Answers whose normalized strings differ are compared symbolically before being flagged as incorrect.
+    # Its worker processes are spawned, so it's safe to start them after the logging thread is running.
+    symbolic = SymbolicChecker()
+    # Shared by all local shards; ResponseCache handles concurrent writers.
+    cache = ResponseCache("response_cache.sqlite")
+    store = ResultsStore(sharding.shard_path(args.store, shard, shards))
+    model = VertexAI(args.project, args.location, cache=cache, store=store)
+    # Completed problems are journaled as they finish, so a rerun only generates the missing ones.
+    journal = RunJournal(program + ".journal.jsonl")
+    logger.info(f"{len(journal)} problems already completed.")
+    registry.start_periodic_summary()
+    if args.batch:
+        solve_batch(model, make_batch_backend(args, model), journal, store, problems, len(math_problems), symbolic,
+                    args.poll_interval)
+    else:
+        asyncio.run(solve_all(model, journal, store, problems, len(math_problems), symbolic))
+    registry.stop_periodic_summary()
+    journal.close()
+    symbolic.close()
+    incorrect_solutions = [(idx, journal.get(journal.key(problem['problem']))) for idx, problem in problems]
+    incorrect_solutions = [(idx, case) for idx, case in incorrect_solutions if case is not None]
+    for idx, case in incorrect_solutions:
+        # Backfills problems journaled by runs that didn't write a store; existing rows are left alone.
+        problem_id = store.add_problem(case["problem"], case["official_answer"], position=idx)
+        store.add_generation(problem_id, model.model_name, case["model_response"], case["model_answer"], correct=False)
+    store.close()
+    logger.info(f"Found and saved {len(incorrect_solutions)} incorrect solutions.")
+    logger.info(f"Response cache: {cache.stats()}")
+    registry.log_summary()
+    registry.export(program)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Generate solutions to MATH problems and record those with a wrong answer.")
+    parser.add_argument("--project", help="GCP project id.")
+    parser.add_argument("--location", help="GCP region.")
+    parser.add_argument("--problems", type=int, default=PROBLEM_NUMBERS)
+    parser.add_argument("--store", default="results.sqlite", help="Results store the generations are appended to.")
+    parser.add_argument("--batch", choices=["vertex", "local"],
+                        help="Generate all solutions as one batch prediction job instead of online requests "
+                             "('local' runs the job in-process, for testing).")
+    parser.add_argument("--batch-staging", help="gs:// prefix for the request and prediction files of --batch vertex.")
+    parser.add_argument("--poll-interval", type=float, default=30.0, help="Seconds between batch job status checks.")
+    sharding.add_arguments(parser)
+    args = parser.parse_args(argv)
+    if args.batch == "vertex" and not args.batch_staging:
+        parser.error("--batch vertex needs --batch-staging gs://bucket/prefix")
+    return args
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    args = parse_args(argv)
+    if args.shard is not None:
+        run_shard(args, args.shard, args.shards)
+    elif args.merge:
+        setup_logging("find_incorrect_solution")
+        sharding.merge_stores(args.store, args.shards)
+    elif args.workers > 1:
+        setup_logging("find_incorrect_solution")
+        if not sharding.run_workers(__file__, argv, args.workers, args.targets):
+            sys.exit(1)
+        sharding.merge_stores(args.store, args.workers)
+    else:
+        run_shard(args, 0, 1)
 
-out_path = "incorrect_solutions.jsonl"
-with open(out_path, "w", encoding="utf-8") as fout:
-    for case in incorrect_solutions:
-        fout.write(json.dumps(case, ensure_ascii=False) + '\n')
-logger.info(f"Found and saved {len(incorrect_solutions)} incorrect solutions.")
+if __name__ == "__main__":
+    main()
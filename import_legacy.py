@@ -0,0 +1,78 @@
+import argparse
+import json
+import logging
+import os
+from logger_setup import setup_logging
+from results_store import ResultsStore
+# Get a logger for the main module
+logger = logging.getLogger(__name__)
+
+def read_solutions(path):
+    # Records of the old incorrect_solutions.jsonl: problem, official_answer, model_answer, model_response.
+    with open(path, "r", encoding="utf-8") as fin:
+        return [json.loads(line) for line in fin if line.strip()]
+
+def read_sentences(path):
+    # (problem sentences, solution sentences) per paragraph of the old clean_sentences_2.txt, failed
+    # segmentations included (as empty lists), like the old find_first_mistake.read_sentences.
+    with open(path, "r", encoding="utf-8") as fin:
+        content = fin.read()
+    paragraphs = [p.strip() for p in content.split("-" * 80) if p.strip()]
+    result = []
+    for paragraph in paragraphs:
+        problem, _, solution = paragraph.partition("*" * 80)
+        result.append(([s.strip() for s in problem.splitlines() if s.strip()],
+                       [s.strip() for s in solution.splitlines() if s.strip()]))
+    return result
+
+def import_legacy(store, solutions_path, sentences_path=None, model_name="gemini-2.0-flash-001", sentences_offset=10):
+    # Copies the outputs of the old file-based scripts into 'store' (a results_store.ResultsStore). Every
+    # incorrect solution becomes a problem (positioned by its line number) with a wrong-answer generation of
+    # 'model_name'. Paragraph j of the sentences file belongs to solution sentences_offset + j, as the old
+    # prepare_baseline_prompt_2.py skipped the first ten solutions. Safe to rerun: existing rows are left alone.
+    # Returns (generations, segmented generations) imported.
+    solutions = read_solutions(solutions_path)
+    generation_ids = []
+    for position, case in enumerate(solutions):
+        problem_id = store.add_problem(case["problem"], case.get("official_answer"), position=position)
+        generation_ids.append(store.add_generation(problem_id, model_name, case["model_response"],
+                                                   case.get("model_answer"), correct=False))
+    segmented = 0
+    if sentences_path is not None:
+        paragraphs = read_sentences(sentences_path)
+        if sentences_offset + len(paragraphs) > len(solutions):
+            logger.warning(f"{sentences_path} has {len(paragraphs)} segmentations, more than the "
+                           f"{len(solutions) - sentences_offset} solutions after offset {sentences_offset}; "
+                           f"the extra ones are skipped.")
+        for generation_id, (problem_sentences, solution_sentences) in zip(generation_ids[sentences_offset:], paragraphs):
+            # Failed segmentations were written as empty paragraphs; they stay unsegmented.
+            if solution_sentences:
+                store.add_sentences(generation_id, problem_sentences, solution_sentences)
+                segmented += 1
+    logger.info(f"Imported {len(generation_ids)} incorrect solutions from {solutions_path}, {segmented} of them segmented.")
+    return len(generation_ids), segmented
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Import incorrect_solutions.jsonl and clean_sentences_2.txt into a results store.")
+    parser.add_argument("--store", default="results.sqlite", help="Results store to import into.")
+    parser.add_argument("--solutions", default="incorrect_solutions.jsonl", help="Incorrect solutions of find_incorrect_solution.py.")
+    parser.add_argument("--sentences", default="clean_sentences_2.txt",
+                        help="Segmented solutions of prepare_baseline_prompt_2.py; skipped if the file doesn't exist.")
+    parser.add_argument("--sentences-offset", type=int, default=10,
+                        help="Solutions skipped before the first paragraph of --sentences.")
+    parser.add_argument("--model", default="gemini-2.0-flash-001", help="Model the solutions were generated with.")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    setup_logging("import_legacy")
+    sentences = args.sentences if os.path.exists(args.sentences) else None
+    if sentences is None:
+        logger.info(f"No {args.sentences}; importing the solutions only.")
+    store = ResultsStore(args.store)
+    generations, segmented = import_legacy(store, args.solutions, sentences, args.model, args.sentences_offset)
+    store.close()
+    print(f"Imported {generations} incorrect solutions ({segmented} segmented) into {args.store}.")
+
+if __name__ == "__main__":
+    main()
@@ -1,39 +1,98 @@
+import atexit
+import datetime
+import gzip
+import json
 import logging
+import logging.handlers
 import os
-import datetime
+import queue
+import shutil
+
+# Pass as extra=EXCHANGE when logging a full prompt or response. With setup_logging(trace=True) such
+# records are left out of the text log, since the model client writes the exchange to the trace file.
+EXCHANGE = {"exchange": True}
+# Logger receiving one structured record per model call (see model.VertexAI).
+TRACE_LOGGER = "trace"
+
+def _gzip_rotator(source, dest):
+    with open(source, "rb") as fin, gzip.open(dest, "wb") as fout:
+        shutil.copyfileobj(fin, fout)
+    os.remove(source)
 
-def setup_logging(program="app"):
-    # Clean 'app.log' if it is too long.
+def _rotating_handler(path, max_bytes, backup_count, compress):
+    handler = logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8")
+    if compress:
+        handler.namer = lambda name: name + ".gz"
+        handler.rotator = _gzip_rotator
+    return handler
+
+def _archive_log(program, max_bytes, compress):
+    # Archive '<program>.log' into log/ if it is too long; only the file size is looked at.
+    path = program + ".log"
     try:
-        with open(program + ".log", 'r') as f:
-            log_content = f.read()
-        if len(log_content) > 100000:
-            if not os.path.exists("log"):
-                os.makedirs("log")
-            timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-            archive_filename = os.path.join("log", program + f"_{timestamp}.log")
-            with open(archive_filename, 'w') as archive_f:
-                archive_f.write(log_content)
-            with open(program + '.log', 'w') as f:
-                f.write("")
-            print(f"Log file cleaned and archived to {archive_filename}.")
+        size = os.path.getsize(path)
     except FileNotFoundError:
         print("Log file " + program + "'.log' not found.")
+        return
+    if size <= max_bytes:
+        return
+    try:
+        os.makedirs("log", exist_ok=True)
+        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+        archive_filename = os.path.join("log", program + f"_{timestamp}.log")
+        if compress:
+            archive_filename += ".gz"
+            _gzip_rotator(path, archive_filename)
+        else:
+            os.replace(path, archive_filename)
+        print(f"Log file cleaned and archived to {archive_filename}.")
     except Exception as e:
         print(f"An error occured: {e}.")
+
+class _NoExchangeFilter(logging.Filter):
+
+    def filter(self, record):
+        return not getattr(record, "exchange", False)
+
+class _TraceFormatter(logging.Formatter):
+
+    def format(self, record):
+        return json.dumps(getattr(record, "trace", {"message": record.getMessage()}), ensure_ascii=False, separators=(",", ":"))
+
+def _start_listener(logger, handlers):
+    # The logger only enqueues records; a background thread formats and writes them.
+    log_queue = queue.SimpleQueue()
+    logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+
+def setup_logging(program="app", max_bytes=10 * 1024 * 1024, backup_count=5, compress=False, trace=False):
+    # Logs go to the console (INFO) and '<program>.log' (DEBUG), rotated at 'max_bytes' (gzipped if
+    # 'compress'). With 'trace', model calls are written to '<program>.trace.jsonl' instead of the text log.
+    _archive_log(program, max_bytes, compress)
     # Create a root logger and set its level
     logger = logging.getLogger()
     logger.setLevel(logging.DEBUG)
+    # Avoid adding duplicate handlers if setup_logging is called more than once
+    if logger.handlers:
+        return
     # Create handlers
     console_handler = logging.StreamHandler()
     console_handler.setLevel(logging.INFO)
-    file_handler = logging.FileHandler(program + '.log')
+    file_handler = _rotating_handler(program + ".log", max_bytes, backup_count, compress)
     file_handler.setLevel(logging.DEBUG)
     # Create a formatter
     formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(funcName)s - %(message)s')
     console_handler.setFormatter(formatter)
     file_handler.setFormatter(formatter)
-    # Avoid adding duplicate handlers if setup_logging is called more than once
-    if not logger.handlers:
-        logger.addHandler(console_handler)
-        logger.addHandler(file_handler)
\ No newline at end of file
+    # Trace records never reach the text handlers.
+    trace_logger = logging.getLogger(TRACE_LOGGER)
+    trace_logger.propagate = False
+    if trace:
+        for handler in (console_handler, file_handler):
+            handler.addFilter(_NoExchangeFilter())
+        trace_handler = _rotating_handler(program + ".trace.jsonl", max_bytes, backup_count, compress)
+        trace_handler.setFormatter(_TraceFormatter())
+        _start_listener(trace_logger, [trace_handler])
+    _start_listener(logger, [console_handler, file_handler])
@@ -1,3 +1,4 @@
+import functools
 import logging
 
 # Get a logger for this module
@@ -140,18 +141,63 @@ def _strip_string(string):
 
     return string
 
-def is_equiv(str1, str2, verbose=False):
+@functools.lru_cache(maxsize=65536)
+def _normalize_cached(string):
+    try:
+        return _strip_string(string)
+    except Exception:
+        return None
+
+def normalize_answer(string):
+    # Canonical form used by is_equiv, or None if the string can't be normalized. Cached in a bounded LRU,
+    # so an official answer compared against many candidates is only normalized once.
+    try:
+        return _normalize_cached(string)
+    except TypeError:
+        # Unhashable input.
+        return None
+
+def is_equiv(str1, str2, verbose=False, symbolic=None):
+    # 'symbolic' is an optional symbolic_equivalence.SymbolicChecker, consulted only when the normalized strings differ.
     if str1 is None and str2 is None:
         print("WARNING: Both None")
         return True
     if str1 is None or str2 is None:
         return False
 
-    try:
-        ss1 = _strip_string(str1)
-        ss2 = _strip_string(str2)
-        if verbose:
-            print(ss1, ss2)
-        return ss1 == ss2
-    except:
+    ss1 = normalize_answer(str1)
+    ss2 = normalize_answer(str2)
+    if ss1 is None or ss2 is None:
         return str1 == str2
+    if verbose:
+        print(ss1, ss2)
+    if ss1 == ss2:
+        return True
+    if symbolic is not None:
+        return symbolic.check(ss1, ss2)
+    return False
+
+def is_equiv_batch(candidates, reference, symbolic=None):
+    # is_equiv of every candidate against one reference, normalizing the reference once.
+    if reference is None:
+        return [candidate is None for candidate in candidates]
+    reference_form = normalize_answer(reference)
+    results = []
+    unresolved = []
+    for i, candidate in enumerate(candidates):
+        if candidate is None:
+            results.append(False)
+            continue
+        candidate_form = normalize_answer(candidate)
+        if candidate_form is None or reference_form is None:
+            results.append(candidate == reference)
+        else:
+            results.append(candidate_form == reference_form)
+            if not results[-1]:
+                unresolved.append((i, candidate_form))
+    if symbolic is not None and unresolved:
+        # Only string mismatches go to the symbolic tier, as one batch.
+        verdicts = symbolic.check_many([(form, reference_form) for _, form in unresolved])
+        for (i, _), verdict in zip(unresolved, verdicts):
+            results[i] = verdict
+    return results
@@ -0,0 +1,157 @@
+import contextlib
+import contextvars
+import json
+import logging
+import threading
+import time
+
+# Get a logger for this module
+logger = logging.getLogger(__name__)
+
+# Upper bounds (seconds) of the call latency histogram buckets.
+LATENCY_BUCKETS = [0.1, 0.25, 0.5, 1, 2, 5, 10, 20, 60, float("inf")]
+
+_call_site = contextvars.ContextVar("call_site", default="unknown")
+
+@contextlib.contextmanager
+def call_site(name):
+    # Tags model calls made inside the block (including awaited ones) with 'name'.
+    token = _call_site.set(name)
+    try:
+        yield
+    finally:
+        _call_site.reset(token)
+
+def current_call_site():
+    return _call_site.get()
+
+class _SiteStats:
+
+    def __init__(self):
+        self.calls = 0
+        self.failures = 0
+        self.retries = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        # Input tokens served from a provider-side context cache.
+        self.cached_tokens = 0
+        self.wall_time = 0.0
+        self.max_wall_time = 0.0
+        self.buckets = [0] * len(LATENCY_BUCKETS)
+
+    def summary(self):
+        return {
+            "calls": self.calls,
+            "failures": self.failures,
+            "retries": self.retries,
+            "input_tokens": self.input_tokens,
+            "output_tokens": self.output_tokens,
+            "cached_tokens": self.cached_tokens,
+            "wall_sec": round(self.wall_time, 3),
+            "mean_wall_sec": round(self.wall_time / self.calls, 3) if self.calls else None,
+            "max_wall_sec": round(self.max_wall_time, 3),
+        }
+
+class Metrics:
+    # Per-call-site model call statistics (wall time, tokens, retries) and event counters such as parse failures.
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sites = {}
+        self._events = {}
+        self._periodic = None
+
+    def record_call(self, site, wall_time, input_tokens=0, output_tokens=0, retries=0, ok=True, cached_tokens=0):
+        with self._lock:
+            stats = self._sites.setdefault(site, _SiteStats())
+            stats.calls += 1
+            stats.failures += 0 if ok else 1
+            stats.retries += retries
+            stats.input_tokens += input_tokens or 0
+            stats.output_tokens += output_tokens or 0
+            stats.cached_tokens += cached_tokens or 0
+            stats.wall_time += wall_time
+            stats.max_wall_time = max(stats.max_wall_time, wall_time)
+            for i, bound in enumerate(LATENCY_BUCKETS):
+                if wall_time <= bound:
+                    stats.buckets[i] += 1
+                    break
+
+    def count(self, event, site=None, amount=1):
+        key = (site if site is not None else current_call_site(), event)
+        with self._lock:
+            self._events[key] = self._events.get(key, 0) + amount
+
+    def reset(self):
+        with self._lock:
+            self._sites = {}
+            self._events = {}
+
+    def summary(self):
+        with self._lock:
+            sites = {site: stats.summary() for site, stats in sorted(self._sites.items())}
+            for (site, event), value in sorted(self._events.items()):
+                sites.setdefault(site, {}).setdefault("events", {})[event] = value
+        return sites
+
+    def log_summary(self):
+        for site, summary in self.summary().items():
+            logger.info(f"Metrics {site}: {summary}")
+
+    def write_json(self, path):
+        with open(path, "w", encoding="utf-8") as fout:
+            json.dump({"timestamp": time.time(), "sites": self.summary()}, fout, indent=2)
+
+    def write_openmetrics(self, path):
+        lines = []
+        with self._lock:
+            sites = sorted(self._sites.items())
+            events = sorted(self._events.items())
+        for name, attribute in [("model_calls", "calls"), ("model_call_failures", "failures"),
+                                ("model_retries", "retries"), ("model_input_tokens", "input_tokens"),
+                                ("model_output_tokens", "output_tokens"), ("model_cached_tokens", "cached_tokens")]:
+            lines.append(f"# TYPE {name} counter")
+            for site, stats in sites:
+                lines.append(f'{name}_total{{site="{site}"}} {getattr(stats, attribute)}')
+        lines.append("# TYPE model_call_seconds histogram")
+        for site, stats in sites:
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS, stats.buckets):
+                cumulative += count
+                label = "+Inf" if bound == float("inf") else bound
+                lines.append(f'model_call_seconds_bucket{{site="{site}",le="{label}"}} {cumulative}')
+            lines.append(f'model_call_seconds_sum{{site="{site}"}} {stats.wall_time}')
+            lines.append(f'model_call_seconds_count{{site="{site}"}} {stats.calls}')
+        lines.append("# TYPE events counter")
+        for (site, event), value in events:
+            lines.append(f'events_total{{site="{site}",event="{event}"}} {value}')
+        lines.append("# EOF")
+        with open(path, "w", encoding="utf-8") as fout:
+            fout.write("\n".join(lines) + "\n")
+
+    def export(self, prefix):
+        # Writes '<prefix>.metrics.json' and '<prefix>.metrics.prom' (OpenMetrics text format).
+        self.write_json(prefix + ".metrics.json")
+        self.write_openmetrics(prefix + ".metrics.prom")
+
+    def start_periodic_summary(self, interval=60.0):
+        # Logs the summary every 'interval' seconds from a daemon thread until stop_periodic_summary().
+        if self._periodic is not None:
+            return
+        stop = threading.Event()
+
+        def report():
+            while not stop.wait(interval):
+                self.log_summary()
+
+        thread = threading.Thread(target=report, name="metrics-summary", daemon=True)
+        thread.start()
+        self._periodic = stop
+
+    def stop_periodic_summary(self):
+        if self._periodic is not None:
+            self._periodic.set()
+            self._periodic = None
+
+# Process-wide registry used by the model client and the verifier.
+registry = Metrics()
@@ -2,59 +2,272 @@ import time
 import logging
 # Get a logger for this module
 logger = logging.getLogger(__name__)
-import os
-# Set environment variables for this process
-os.environ['GOOGLE_CLOUD_PROJECT'] = # Enter your project name
-os.environ['GOOGLE_CLOUD_LOCATION'] = # Enter your VM location
-os.environ['GOOGLE_GENAI_USE_VERTEXAI'] = 'True'
-from google import genai
+# Structured prompt/response records, written only if logger_setup.setup_logging(trace=True) attached a handler.
+trace_logger = logging.getLogger("trace")
 import asyncio
-import vertexai
-from vertexai.generative_models import GenerativeModel
-import random
+import sqlite3
+import threading
+import collections
+from backends import VertexBackend
+from batch_prediction import run_batch
+from context_cache import current_prefix
+from metrics import current_call_site, registry
+from stream_extract import ABORT
+from rate_limiter import RateLimiter, CircuitBreaker, backoff, estimate_tokens, is_context_error, is_retryable, is_throttle
 
 class VertexAI:
     
-    def __init__(self, project_id, location):
-        # Initialize GCP VM instance with service account that could access Vertex AI and "Allow full access to all cloud APIs" 
-        import vertexai
-        from vertexai.generative_models import (
-            GenerativeModel,
-            Tool,
-            grounding
-        )
-        vertexai.init(project=project_id, location=location)
-        self.model = GenerativeModel("gemini-2.0-flash-001")
-        self.leader_model = GenerativeModel("gemini-2.5-flash-preview-04-17")
-
-    def generate(self, prompt, low_temp=0.05, top_P=0.95, top_K=20):
-        # Generate completion with backoff for API waiting.
+    def __init__(self, project_id, location, max_concurrency=8, cache=None, rate_limiter=None, circuit_breaker=None,
+                 backend=None, leader_backend=None, capture=None, metrics=None, context_cache=None, store=None):
+        # 'backend' and 'leader_backend' are backends.ModelBackend instances; by default both are Vertex AI
+        # models. Pass backends.ReplayBackend instances to run offline from a recorded capture.
+        if backend is None:
+            backend = VertexBackend("gemini-2.0-flash-001", project_id, location)
+        if leader_backend is None:
+            leader_backend = VertexBackend("gemini-2.5-flash-preview-04-17", project_id, location)
+        self.backend = backend
+        self.leader_backend = leader_backend
+        self.model_name = backend.name
+        self.leader_model_name = leader_backend.name
+        # Optional backends.ResponseCapture recording every response received from a backend.
+        self.capture = capture
+        # Optional response_cache.ResponseCache shared by generate and leader_generate.
+        self.cache = cache
+        # metrics.Metrics receiving per-call wall time, tokens and retries, tagged by metrics.call_site.
+        self.metrics = metrics if metrics is not None else registry
+        # Optional context_cache.ContextCache; prompts sent inside context_cache.shared_prefix(prefix) then
+        # reuse a provider-side cache of the prefix.
+        self.context_cache = context_cache
+        # Optional results_store.ResultsStore receiving a row per model call.
+        self.store = store
+        self._samples = collections.Counter()
+        # Client-side quota management shared by generate and leader_generate.
+        self.rate_limiter = rate_limiter if rate_limiter is not None else RateLimiter()
+        self.circuit_breaker = circuit_breaker if circuit_breaker is not None else CircuitBreaker()
+        # Maximum number of requests in flight across all callers.
+        self.max_concurrency = max_concurrency
+        self._semaphore = None
+        self._event_loop = None
+        self._loop_lock = threading.Lock()
+
+    def _loop(self):
+        # All API calls run on one background event loop, so the async clients and the
+        # concurrency limit are shared by sync callers, threads and other event loops.
+        with self._loop_lock:
+            if self._event_loop is None:
+                self._event_loop = asyncio.new_event_loop()
+                thread = threading.Thread(target=self._event_loop.run_forever, name="vertexai-loop", daemon=True)
+                thread.start()
+        return self._event_loop
+
+    def _trace(self, site, model_name, prompt, response, wall_time=0.0, usage=None, retries=0, cached=False):
+        if not trace_logger.handlers:
+            return
+        record = {"time": time.time(), "site": site, "model": model_name, "cached": cached, "wall_sec": round(wall_time, 3),
+                  "retries": retries, "usage": usage, "prompt": prompt, "response": response}
+        trace_logger.debug("model call", extra={"trace": record})
+
+    def _submit(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop())
+
+    def _record_call(self, site, model_name, prompt, wall_time, usage=None, retries=0, ok=True):
+        usage = usage or {}
+        self.metrics.record_call(site, wall_time, usage.get("input_tokens", 0), usage.get("output_tokens", 0), retries,
+                                 ok, usage.get("cached_tokens", 0))
+        if self.store is not None:
+            self.store.record_call(site, model_name, prompt, wall_time, usage, retries, ok)
+
+    def _cache_key(self, model_name, prompt, low_temp, stream=None):
+        # Repeated requests for the same prompt map to successive cached samples. Streams that may stop after the
+        # first valid JSON block are cached apart ('stream'), so their truncated text never answers a full request.
+        base_key = (model_name, prompt, low_temp, stream)
+        sample = self._samples[base_key]
+        self._samples[base_key] += 1
+        config = {"temperature": low_temp}
+        if stream is not None:
+            config["stream"] = stream
+        return self.cache.key(model_name, prompt, config, sample)
+
+    def _cache_get(self, key):
+        # Cache failures (e.g. "database is locked" with several processes on one file) fall through to the model.
+        try:
+            return self.cache.get(key)
+        except sqlite3.OperationalError as e:
+            logger.warning(f"Response cache read failed: {e}")
+            self.metrics.count("cache_error")
+
+    def _cache_put(self, key, text):
+        try:
+            self.cache.put(key, text)
+        except sqlite3.OperationalError as e:
+            logger.warning(f"Response cache write failed: {e}")
+            self.metrics.count("cache_error")
+
+    async def _agenerate(self, leader, prompt, low_temp, use_cache=True, extractor=None):
+        model_name = self.leader_model_name if leader else self.model_name
+        config = {"temperature": low_temp}
+        cache_key = None
+        if self.cache is not None and use_cache:
+            stream = "first_valid_block" if extractor is not None and not extractor.last_block else None
+            cache_key = self._cache_key(model_name, prompt, low_temp, stream)
+            # In a thread: with other processes writing to the cache file, the call can wait for its lock.
+            cached = await asyncio.to_thread(self._cache_get, cache_key)
+            if cached is not None:
+                self.metrics.count("cache_hit")
+                self._trace(current_call_site(), model_name, prompt, cached, cached=True)
+                return cached
+        text = await self._agenerate_uncached(self.leader_backend if leader else self.backend, prompt, config, extractor)
+        if extractor is not None and extractor.state == ABORT:
+            # Aborted streams are never cached, so the retry really samples again.
+            return text
+        if cache_key is not None and text is not None:
+            await asyncio.to_thread(self._cache_put, cache_key, text)
+        return text
+
+    async def _astream(self, backend, prompt, config, context, extractor):
+        # Reads the streamed response only until 'extractor' (a stream_extract.JsonBlockExtractor) has accepted a
+        # JSON block or given up; closing the stream stops the generation.
+        extractor.reset()
+        usage = None
+        stream = backend.astream(prompt, config, context)
+        try:
+            async for chunk, chunk_usage in stream:
+                usage = chunk_usage or usage
+                if extractor.feed(chunk) is not None:
+                    break
+        finally:
+            await stream.aclose()
+        if extractor.state is not None:
+            self.metrics.count(f"stream_{extractor.state}")
+        return extractor.result(), usage
+
+    async def _agenerate_uncached(self, backend, prompt, config, extractor=None):
+        # Generate completion, retrying transient errors with jittered backoff. Both models share
+        # one rate limiter and circuit breaker, so concurrent callers back off together.
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        # The call site is read from the caller's context, which run_coroutine_threadsafe carries over.
+        site = current_call_site()
+        prefix = current_prefix() if self.context_cache is not None else None
+        if prefix and not prompt.startswith(prefix):
+            prefix = None
+        start = time.perf_counter()
         max_retries = 6
         retries = 0
         while retries < max_retries:
+            await self.circuit_breaker.wait()
+            await self.rate_limiter.acquire(estimate_tokens(prompt))
+            context = None
             try:
-                response = self.model.generate_content(prompt, generation_config={"temperature":low_temp})
-                return response.text
+                async with self._semaphore:
+                    if prefix:
+                        context = await self.context_cache.acquire(backend, prefix)
+                    # With a context, only the text after the cached prefix is sent.
+                    sent = prompt if context is None else prompt[len(prefix):]
+                    if extractor is None:
+                        text, usage = await backend.agenerate_with_usage(sent, config, context)
+                    else:
+                        text, usage = await self._astream(backend, sent, config, context, extractor)
             except Exception as e:
-                retries += 1
-                wait_time = (2 ** retries) + 1 # Exponential backoff
                 logger.info(f"Exception: {e}")
-                logger.info(f"Retrying in {wait_time} seconds.")
-                time.sleep(wait_time)
-        logger.error("Max retries exceeded. API call failed.")
-
-    def leader_generate(self, prompt, low_temp=0.05):
-        # Generate completion with backoff for API waiting.
-        max_retries = 6
-        retries  = 0
-        while retries < max_retries:
-            try:
-                response = self.leader_model.generate_content(prompt, generation_config={"temperature":low_temp})
-                return response.text
-            except Exception as e:
+                if context is not None and is_context_error(e):
+                    # The provider expired or rejected the context; resend the full prompt. Other errors keep
+                    # the context and go through the normal retry path.
+                    self.context_cache.discard(backend, prefix)
+                    prefix = None
+                    retries += 1
+                    continue
+                if not is_retryable(e):
+                    logger.error("Non-retryable error. API call failed.")
+                    self._record_call(site, backend.name, prompt, time.perf_counter() - start, retries=retries, ok=False)
+                    return
+                if is_throttle(e):
+                    self.rate_limiter.on_throttle()
+                else:
+                    self.circuit_breaker.record_failure()
                 retries += 1
-                wait_time = (2 ** retries) + 1 # Exponential backoff
-                logger.info(f"Exception: {e}")
-                logger.info(f"Retrying in {wait_time} seconds.")
-                time.sleep(wait_time)
+                wait_time = backoff(retries)
+                logger.info(f"Retrying in {wait_time:.1f} seconds.")
+                await asyncio.sleep(wait_time)
+                continue
+            self.rate_limiter.on_success()
+            self.circuit_breaker.record_success()
+            if usage is None:
+                # Providers without usage metadata get the same estimate the rate limiter uses.
+                usage = {"input_tokens": estimate_tokens(prompt), "output_tokens": estimate_tokens(text or "")}
+            wall_time = time.perf_counter() - start
+            self._record_call(site, backend.name, prompt, wall_time, usage, retries)
+            self._trace(site, backend.name, prompt, text, wall_time, usage, retries)
+            # Only complete responses are captured: a replay serves them to streamed and plain requests alike.
+            if self.capture is not None and text is not None and (extractor is None or extractor.state is None):
+                self.capture.record(backend.name, prompt, config, text)
+            return text
         logger.error("Max retries exceeded. API call failed.")
+        self._record_call(site, backend.name, prompt, time.perf_counter() - start, retries=retries, ok=False)
+
+    async def _agenerate_many(self, leader, prompts, low_temp, use_cache):
+        # gather keeps results in input order.
+        return await asyncio.gather(*(self._agenerate(leader, prompt, low_temp, use_cache) for prompt in prompts))
+
+    async def agenerate(self, prompt, low_temp=0.05, top_P=0.95, top_K=20, use_cache=True, extractor=None):
+        # With a stream_extract.JsonBlockExtractor the response is streamed and cut off after the first valid
+        # JSON block (see _astream).
+        return await asyncio.wrap_future(self._submit(self._agenerate(False, prompt, low_temp, use_cache, extractor)))
+
+    async def aleader_generate(self, prompt, low_temp=0.05, use_cache=True, extractor=None):
+        return await asyncio.wrap_future(self._submit(self._agenerate(True, prompt, low_temp, use_cache, extractor)))
+
+    async def agenerate_many(self, prompts, low_temp=0.05, leader=False, use_cache=True):
+        return await asyncio.wrap_future(self._submit(self._agenerate_many(leader, list(prompts), low_temp, use_cache)))
+
+    def generate(self, prompt, low_temp=0.05, top_P=0.95, top_K=20, use_cache=True, extractor=None):
+        # use_cache=False bypasses the response cache, e.g. for deliberate resampling.
+        return self._submit(self._agenerate(False, prompt, low_temp, use_cache, extractor)).result()
+
+    def leader_generate(self, prompt, low_temp=0.05, use_cache=True, extractor=None):
+        return self._submit(self._agenerate(True, prompt, low_temp, use_cache, extractor)).result()
+
+    def generate_many(self, prompts, low_temp=0.05, leader=False, use_cache=True):
+        return self._submit(self._agenerate_many(leader, list(prompts), low_temp, use_cache)).result()
+
+    def batch_generate(self, prompts, batch, low_temp=0.05, use_cache=True, workdir="batch", poll_interval=30.0,
+                       timeout=None):
+        # Generates 'prompts' as one job on 'batch' (a batch_prediction.BatchBackend) instead of one online request
+        # each, blocking until the job ends, and returns the responses in input order (None for failed requests).
+        # Cached prompts aren't resubmitted, and batch responses are cached under batch.name like online ones,
+        # so a later generate call for the same prompt and model is a cache hit.
+        config = {"temperature": low_temp}
+        site = current_call_site()
+        prompts = list(prompts)
+        results = [None] * len(prompts)
+        cache_keys = [None] * len(prompts)
+        requests = []
+        for i, prompt in enumerate(prompts):
+            if self.cache is not None and use_cache:
+                cache_keys[i] = self._cache_key(batch.name, prompt, low_temp)
+                results[i] = self._cache_get(cache_keys[i])
+                if results[i] is not None:
+                    self.metrics.count("cache_hit", site)
+                    continue
+            requests.append((f"r{i}", prompt))
+        if not requests:
+            return results
+        predictions = run_batch(batch, requests, config, workdir, poll_interval, timeout)
+        self.metrics.count("batch_requests", site, len(requests))
+        for request_id, prompt in requests:
+            i = int(request_id[1:])
+            text, usage = predictions.get(request_id, (None, None))
+            if text is None:
+                self.metrics.count("batch_failures", site)
+                continue
+            results[i] = text
+            if usage is None:
+                usage = {"input_tokens": estimate_tokens(prompt), "output_tokens": estimate_tokens(text)}
+            # Batch requests have no latency of their own; the job's wall time is logged by run_batch.
+            self._record_call(site, batch.name, prompt, 0.0, usage)
+            self._trace(site, batch.name, prompt, text, usage=usage)
+            if self.capture is not None:
+                self.capture.record(batch.name, prompt, config, text)
+            if cache_keys[i] is not None:
+                self._cache_put(cache_keys[i], text)
+        return results
@@ -0,0 +1,275 @@
+import argparse
+import asyncio
+import json
+import logging
+import time
+
+# Get a logger for this module
+logger = logging.getLogger(__name__)
+
+_DONE = object()
+
+class Stage:
+    # One pipeline stage: 'workers' coroutines take items from a bounded input queue and call
+    # 'process(item)'. A result of None drops the item, anything else goes to the next stage.
+
+    def __init__(self, name, process, workers=1, queue_size=16):
+        self.name = name
+        self.process = process
+        self.workers = workers
+        self.queue_size = queue_size
+        self.queue = None
+        self.processed = 0
+        self.forwarded = 0
+        self.busy_time = 0.0
+        # Time spent waiting for input (starved) and for room in the next queue (backpressure).
+        self.starved_time = 0.0
+        self.blocked_time = 0.0
+        self.max_depth = 0
+
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "processed": self.processed,
+            "forwarded": self.forwarded,
+            "queue_depth": self.queue.qsize() if self.queue is not None else 0,
+            "max_queue_depth": self.max_depth,
+            "busy_sec": round(self.busy_time, 3),
+            "starved_sec": round(self.starved_time, 3),
+            "blocked_sec": round(self.blocked_time, 3),
+        }
+
+class _DepthTrackingQueue(asyncio.Queue):
+
+    def __init__(self, stage, maxsize):
+        super().__init__(maxsize)
+        self._stage = stage
+
+    def _put(self, item):
+        super()._put(item)
+        self._stage.max_depth = max(self._stage.max_depth, self.qsize())
+
+class StreamingPipeline:
+    # Runs stages concurrently, connected by bounded queues, so later stages start on the first items while
+    # earlier stages are still producing. A full queue makes the upstream workers wait (backpressure).
+
+    def __init__(self, stages, on_result=None, report_interval=30.0):
+        self.stages = stages
+        self.on_result = on_result
+        self.report_interval = report_interval
+
+    async def _put(self, stage, queue, item):
+        start = time.perf_counter()
+        await queue.put(item)
+        stage.blocked_time += time.perf_counter() - start
+
+    async def _worker(self, index):
+        stage = self.stages[index]
+        next_queue = self.stages[index + 1].queue if index + 1 < len(self.stages) else None
+        while True:
+            start = time.perf_counter()
+            item = await stage.queue.get()
+            stage.starved_time += time.perf_counter() - start
+            if item is _DONE:
+                return
+            start = time.perf_counter()
+            try:
+                result = await stage.process(item)
+            except Exception as e:
+                logger.exception(f"Stage {stage.name} failed on an item: {e}")
+                result = None
+            stage.busy_time += time.perf_counter() - start
+            stage.processed += 1
+            if result is None:
+                continue
+            stage.forwarded += 1
+            if next_queue is not None:
+                await self._put(stage, next_queue, result)
+            elif self.on_result is not None:
+                self.on_result(result)
+
+    async def _run_stage(self, index):
+        stage = self.stages[index]
+        await asyncio.gather(*(self._worker(index) for _ in range(stage.workers)))
+        if index + 1 < len(self.stages):
+            for _ in range(self.stages[index + 1].workers):
+                await self.stages[index + 1].queue.put(_DONE)
+
+    async def _feed(self, items):
+        first = self.stages[0]
+        start = time.perf_counter()
+        for item in items:
+            await first.queue.put(item)
+        for _ in range(first.workers):
+            await first.queue.put(_DONE)
+        logger.info(f"All inputs queued after {time.perf_counter() - start:.1f}s.")
+
+    async def _monitor(self):
+        while True:
+            await asyncio.sleep(self.report_interval)
+            self.log_stats()
+
+    def log_stats(self):
+        for stage in self.stages:
+            logger.info(f"Stage {stage.name}: {stage.stats()}")
+
+    def stats(self):
+        return {stage.name: stage.stats() for stage in self.stages}
+
+    async def run(self, items):
+        for stage in self.stages:
+            stage.queue = _DepthTrackingQueue(stage, stage.queue_size)
+        monitor = asyncio.create_task(self._monitor())
+        try:
+            await asyncio.gather(self._feed(items), *(self._run_stage(i) for i in range(len(self.stages))))
+        finally:
+            monitor.cancel()
+        self.log_stats()
+        return self.stats()
+
+def build_stages(model, splitter, symbolic, store, journal, args):
+    # generate -> answer-match -> cleanup/segment -> step verification. Generations, sentences and verdicts go to
+    # 'store' (a results_store.ResultsStore) as they are produced, and every problem that reaches a final outcome
+    # is recorded in 'journal' (a run_journal.RunJournal) under journal.key(problem): None if its answer is right
+    # or it can't be verified, otherwise the result record. Problems that fail to generate are left for a rerun.
+    from answer_extraction import extract_boxed
+    from math_equivalence import is_equiv
+    import verification
+
+    async def generate(item):
+        idx, problem = item
+        response = await model.agenerate(problem['problem'])
+        if not response:
+            logger.info(f"Couldn't generate model response while processing problem {idx + 1}")
+            return
+        return {"index": idx, "problem": problem['problem'], "official_answer": problem.get('answer', '').strip(),
+                "model_response": response}
+
+    async def match_answer(record):
+        problem_id = store.add_problem(record["problem"], record["official_answer"], position=record["index"])
+        boxed_content = extract_boxed(record["model_response"])
+        correct = None
+        if boxed_content is None:
+            logger.info(f"couldn't find boxed content solving problem {record['index'] + 1}")
+        else:
+            # The symbolic tier waits on its worker pool (up to its timeout, plus a pool restart), so it runs off
+            # the event loop. The stage has one worker, so checks never overlap on the shared SymbolicChecker.
+            correct = await asyncio.to_thread(is_equiv, boxed_content, record["official_answer"], symbolic=symbolic)
+        # Responses without a \boxed{} answer are stored with correct unknown.
+        record["generation_id"] = store.add_generation(problem_id, model.model_name, record["model_response"],
+                                                       boxed_content, correct)
+        if correct is not False:
+            journal.record(journal.key(record["problem"]), None)
+            return
+        record["model_answer"] = boxed_content
+        return record
+
+    async def cleanup(record):
+        verifier = verification.VerifyCotTheorems(splitter, registry=model.metrics)
+        punctuated = await verifier.apunctuate(model.agenerate, record["model_response"])
+        if punctuated is not None:
+            # Local segmentation (and the rare model fallback) runs off the event loop.
+            await asyncio.to_thread(verifier.segment, model.generate, record["problem"], punctuated)
+        if punctuated is None or not verifier.solution_sentences:
+            logger.info(f"Couldn't segment the solution of problem {record['index'] + 1}")
+            journal.record(journal.key(record["problem"]), None)
+            return
+        store.add_sentences(record["generation_id"], verifier.problem_sentences, verifier.solution_sentences)
+        record["problem_sentences"] = verifier.problem_sentences
+        record["solution_sentences"] = verifier.solution_sentences
+        return record
+
+    async def verify(record):
+        verifier = verification.VerifyCotTheorems(registry=model.metrics)
+        verifier.problem_sentences = record["problem_sentences"]
+        verifier.solution_sentences = record["solution_sentences"]
+        verifier.all_sentences = verifier.problem_sentences + verifier.solution_sentences
+        record["mistakes"] = await verifier.afind_first_mistake(model.agenerate, first_only=args.first_only)
+        store.add_verdicts(record["generation_id"], "pipeline", verifier.step_records(record["mistakes"]))
+        journal.record(journal.key(record["problem"]), record)
+        return record
+
+    return [
+        Stage("generate", generate, args.generate_workers, args.queue_size),
+        # One worker: SymbolicChecker isn't thread-safe.
+        Stage("match_answer", match_answer, 1, args.queue_size),
+        Stage("cleanup", cleanup, args.cleanup_workers, args.queue_size),
+        Stage("verify", verify, args.verify_workers, args.queue_size),
+    ]
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Stream MATH problems through generation, answer matching, cleanup and step verification.")
+    parser.add_argument("--project", required=True, help="GCP project id.")
+    parser.add_argument("--location", required=True, help="GCP region.")
+    parser.add_argument("--problems", type=int, default=850)
+    parser.add_argument("--generate-workers", type=int, default=16)
+    parser.add_argument("--cleanup-workers", type=int, default=4)
+    parser.add_argument("--verify-workers", type=int, default=4)
+    parser.add_argument("--queue-size", type=int, default=16, help="Capacity of each stage's input queue.")
+    parser.add_argument("--max-concurrency", type=int, default=32, help="Model requests in flight across all stages.")
+    parser.add_argument("--first-only", action="store_true", help="Stop verifying a solution at its first mistake.")
+    parser.add_argument("--report-interval", type=float, default=30.0, help="Seconds between stage and metrics summaries.")
+    parser.add_argument("--trace", action="store_true", help="Write prompts and responses to pipeline.trace.jsonl instead of the text log.")
+    parser.add_argument("--compress-logs", action="store_true", help="Gzip rotated and archived logs.")
+    parser.add_argument("--context-cache", action="store_true",
+                        help="Serve shared prompt prefixes from provider-side context caches (long solutions only).")
+    parser.add_argument("--store", default="results.sqlite",
+                        help="Results store the generations, sentences and verdicts are appended to.")
+    parser.add_argument("--output", default="pipeline_results.jsonl",
+                        help="Verified incorrect solutions, rewritten from the run journal at the end of every run.")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    from logger_setup import setup_logging
+    setup_logging("pipeline", compress=args.compress_logs, trace=args.trace)
+    from context_cache import ContextCache
+    from dataloader import load_MATH_hard
+    from metrics import registry
+    from model import VertexAI
+    from response_cache import ResponseCache
+    from results_store import ResultsStore
+    from run_journal import RunJournal
+    from segmentation import SentenceSplitter
+    from symbolic_equivalence import SymbolicChecker
+    symbolic = SymbolicChecker()
+    cache = ResponseCache("response_cache.sqlite")
+    # Off by default: MATH solutions are far shorter than the provider minimum, so the prefixes never qualify.
+    context_cache = ContextCache() if args.context_cache else None
+    store = ResultsStore(args.store)
+    model = VertexAI(args.project, args.location, max_concurrency=args.max_concurrency, cache=cache,
+                     context_cache=context_cache, store=store)
+    problems = load_MATH_hard()[:args.problems]
+    # Problems that reached a final outcome in an earlier, interrupted run are read back from the journal.
+    journal = RunJournal("pipeline.journal.jsonl")
+    todo = [(idx, problem) for idx, problem in enumerate(problems) if journal.key(problem['problem']) not in journal]
+    logger.info(f"{len(problems) - len(todo)} of {len(problems)} problems already completed.")
+    registry.start_periodic_summary(args.report_interval)
+
+    def log_result(record):
+        logger.info(f"Problem {record['index'] + 1}: first mistakes at {record['mistakes']}")
+
+    pipeline = StreamingPipeline(build_stages(model, SentenceSplitter(), symbolic, store, journal, args),
+                                 on_result=log_result, report_interval=args.report_interval)
+    stats = asyncio.run(pipeline.run(todo))
+    journal.close()
+    symbolic.close()
+    # Rewritten rather than appended, so reruns and resumed runs list every verified solution once.
+    results = [journal.get(journal.key(problem['problem'])) for problem in problems]
+    results = [record for record in results if record is not None]
+    with open(args.output, "w", encoding="utf-8") as fout:
+        for record in results:
+            fout.write(json.dumps(record, ensure_ascii=False) + "\n")
+    logger.info(f"Wrote {len(results)} verified incorrect solutions to {args.output}.")
+    registry.stop_periodic_summary()
+    registry.log_summary()
+    registry.export("pipeline")
+    logger.info(f"Pipeline finished: {stats}")
+    logger.info(f"Response cache: {cache.stats()}")
+    if context_cache is not None:
+        logger.info(f"Context cache: {context_cache.stats()}")
+        context_cache.close()
+    store.close()
+
+if __name__ == "__main__":
+    main()
@@ -1,81 +1,109 @@
-from logger_setup import setup_logging
-# Initialize logging early in the application
-setup_logging("prepare_baseline")
+import argparse
 import logging
+from logger_setup import setup_logging
 from model import VertexAI
+from response_cache import ResponseCache
+from segmentation import SentenceSplitter
+from run_journal import RunJournal
+from results_store import ResultsStore
+from metrics import registry
 import verification
 # Get a logger for the main module
 logger = logging.getLogger(__name__)
-import json
-import re
-
-quadruplets = []
-jsonl_path = 'incorrect_solutions.jsonl'
-with open (jsonl_path, 'r', encoding='utf-8') as fin:
-    for line in fin:
-        line = line.strip()
-        if not line:
-            continue
-        entry = json.loads(line)
-        quadruplets.append(entry)
-quadruplets = quadruplets[10:]
-
-exceptions = []
-sentences = []
-model = VertexAI(# Your project name, # Your project location)
-for i in range(min(len(quadruplets), 50)):
-    try:
-        verifier = verification.VerifyCotTheorems()
-        verifier.cleanup_answer(
-            model.generate, 
-            quadruplets[i]['problem'],
-            quadruplets[i]['model_response']
-        )
-        sentences.append([verifier.problem_sentences, verifier.solution_sentences])
-    except Exception as e:
-        print(f"An error occured: {e}. ")
-        sentences.append([[], []])
-        exceptions.append(i)
 
-with open("clean_sentences_2.txt", 'w') as fout:
-    for sentence_list in sentences:
-        fout.write("-"*80 + '\n')
-        for sentence in sentence_list[0]:
-            fout.write(sentence + '\n')
-        fout.write("*"*80 + '\n')
-        for sentence in sentence_list[1]:
-            fout.write(sentence + '\n')
-
-prompts_with_answer = []
-for i in range(len(sentences)):
-    all_sentences = sentences[i][0] + sentences[i][1]
+def baseline_prompt(sentences, official_answer=None):
+    all_sentences = sentences[0] + sentences[1]
     progress = ' '.join(f"({j + 1}) {s}" for j, s in enumerate(all_sentences))
-    prompt = (
+    reference = f"For your reference, the correct answer is {official_answer}. " if official_answer is not None else ""
+    return (
         f"Find the sentence number of the first sentence in the solution that makes a mistake in \"{progress}\". "
-        f"For your reference, the correct answer is {quadruplets[i]['official_answer']}. "
+        f"{reference}"
         "Think before you answer. If the solution is correct, say -1."
     )
-    prompts_with_answer.append(prompt)
 
-prompts_without_answer = []
-for i in range(len(sentences)):
-    all_sentences = sentences[i][0] + sentences[i][1]
-    progress = ' '.join(f"({j + 1}) {s}" for j, s in enumerate(all_sentences))
-    prompt = (
-        f"Find the sentence number of the first sentence in the solution that makes a mistake in \"{progress}\". "
-        "Think before you answer. If the solution is correct, say -1."
-    )
-    prompts_without_answer.append(prompt)
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Segment incorrect solutions and prepare baseline prompts.")
+    parser.add_argument("--project", help="GCP project id.")
+    parser.add_argument("--location", help="GCP region.")
+    parser.add_argument("--store", default="results.sqlite",
+                        help="Results store to read incorrect generations from and append sentences and prompts to.")
+    parser.add_argument("--offset", type=int, default=10, help="Number of incorrect generations to skip.")
+    parser.add_argument("--count", type=int, default=50, help="Number of generations to segment.")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    # Initialize logging early in the application
+    setup_logging("prepare_baseline")
+
+    # Reads the incorrect generations written by find_incorrect_solution.py and appends the segmented sentences
+    # and baseline prompts to the same store.
+    store = ResultsStore(args.store)
+    quadruplets = store.incorrect_generations()
+    quadruplets = quadruplets[args.offset:]
 
-with open("baseline_prompts_1.txt", 'w') as file:
-    for prompt in prompts_without_answer:
-        file.write("-"*80)
-        file.write(f'\n{prompt}\n')
+    exceptions = []
+    sentences = []
+    cache = ResponseCache("response_cache.sqlite")
+    model = VertexAI(args.project, args.location, cache=cache, store=store)
+    count = min(len(quadruplets), args.count)
+    # Punctuated solutions and final segmentations are journaled per solution so a rerun resumes.
+    journal = RunJournal("prepare_baseline.journal.jsonl")
+    segment_keys = [journal.key("segment", q['problem'], q['model_response']) for q in quadruplets[:count]]
+    punctuate_keys = [journal.key("punctuate", q['model_response']) for q in quadruplets[:count]]
+    splitter = SentenceSplitter()
+    verifiers = [verification.VerifyCotTheorems(splitter, registry=model.metrics) for _ in range(count)]
+    punctuated = [None] * count
+    for i in range(count):
+        if segment_keys[i] in journal:
+            continue
+        if punctuate_keys[i] in journal:
+            punctuated[i] = journal.get(punctuate_keys[i])
+            continue
+        try:
+            punctuated[i] = verifiers[i].punctuate(model.generate, quadruplets[i]['model_response'])
+            if punctuated[i] is not None:
+                journal.record(punctuate_keys[i], punctuated[i])
+        except Exception as e:
+            print(f"An error occured: {e}. ")
+            exceptions.append(i)
 
-with open("baseline_prompts_2.txt", 'w') as file:
-    for prompt in prompts_with_answer:
-        file.write("-"*80)
-        file.write(f'\n{prompt}\n')
+    # Segment all problems and punctuated solutions locally in one nlp.pipe pass; the model is only
+    # asked to split texts the local splitter is not confident about.
+    problems = [quadruplets[i]['problem'] for i in range(count)]
+    splits = splitter.split_many(problems + [text or "" for text in punctuated])
+    for i in range(count):
+        if segment_keys[i] in journal:
+            sentences.append(journal.get(segment_keys[i]))
+            store.add_sentences(quadruplets[i]['generation_id'], *sentences[-1])
+            continue
+        if i in exceptions or punctuated[i] is None:
+            sentences.append([[], []])
+            continue
+        try:
+            verifiers[i].segment(model.generate, problems[i], punctuated[i], splits[i], splits[count + i])
+            sentences.append([verifiers[i].problem_sentences, verifiers[i].solution_sentences])
+            journal.record(segment_keys[i], sentences[-1])
+            store.add_sentences(quadruplets[i]['generation_id'], *sentences[-1])
+        except Exception as e:
+            print(f"An error occured: {e}. ")
+            sentences.append([[], []])
+            exceptions.append(i)
+    journal.close()
+
+    for i in range(len(sentences)):
+        if not sentences[i][1]:
+            # Failed segmentations have nothing to prompt about.
+            continue
+        store.add_baseline_prompt(quadruplets[i]['generation_id'], "without_answer", baseline_prompt(sentences[i]))
+        store.add_baseline_prompt(quadruplets[i]['generation_id'], "with_answer",
+                                  baseline_prompt(sentences[i], quadruplets[i]['official_answer']))
+    store.close()
 
-print(f'exceptions occured at {list(quadruplets[i] for i in exceptions)}')
+    logger.info(f"Response cache: {cache.stats()}")
+    registry.log_summary()
+    registry.export("prepare_baseline")
+    print(f'exceptions occured at {list(quadruplets[i] for i in exceptions)}')
 
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+import asyncio
+import logging
+import random
+import threading
+import time
+
+# Get a logger for this module
+logger = logging.getLogger(__name__)
+
+# Exception names (google.api_core.exceptions and builtins) that are worth retrying.
+THROTTLE_ERRORS = {"ResourceExhausted", "TooManyRequests"}
+TRANSIENT_ERRORS = {
+    "ServiceUnavailable", "InternalServerError", "DeadlineExceeded", "GatewayTimeout",
+    "BadGateway", "Aborted", "Unknown", "TimeoutError", "ConnectionError", "ConnectionResetError",
+}
+# Exception names of requests whose context cache is gone; the full prompt may still succeed.
+CONTEXT_ERRORS = {"NotFound", "FailedPrecondition"}
+
+def _status_code(exception):
+    code = getattr(exception, "code", None)
+    try:
+        return int(code)
+    except (TypeError, ValueError):
+        return None
+
+def is_throttle(exception):
+    return type(exception).__name__ in THROTTLE_ERRORS or _status_code(exception) == 429
+
+def is_retryable(exception):
+    if is_throttle(exception):
+        return True
+    return type(exception).__name__ in TRANSIENT_ERRORS or _status_code(exception) in (500, 502, 503, 504)
+
+def is_context_error(exception):
+    # The provider-side context cache a request referenced has expired, was deleted or was rejected.
+    if type(exception).__name__ in CONTEXT_ERRORS or _status_code(exception) == 404:
+        return True
+    return _status_code(exception) in (400, 412) and "cache" in str(exception).lower()
+
+def backoff(retries, base=1.0, cap=60.0):
+    # Full jitter: spread retries uniformly so concurrent callers don't retry in lockstep.
+    return random.uniform(0, min(cap, base * 2 ** retries))
+
+def estimate_tokens(prompt):
+    # Rough count for budgeting; roughly four characters per token for English and LaTeX.
+    return len(prompt) // 4 + 1
+
+class _Bucket:
+
+    def __init__(self, per_minute, burst_seconds):
+        self.per_minute = per_minute
+        self.burst_seconds = burst_seconds
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    @property
+    def capacity(self):
+        return max(1.0, self.per_minute * self.burst_seconds / 60)
+
+    def refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.per_minute / 60)
+        self.updated = now
+
+    def wait_time(self, amount):
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0
+        return (amount - self.level) * 60 / self.per_minute
+
+class RateLimiter:
+    # Token bucket limiting requests/min and (optionally) tokens/min, shared by all model calls.
+    # The request rate adapts to throttling (AIMD): it grows additively after successes and is
+    # cut multiplicatively on 429/resource-exhausted responses.
+
+    def __init__(self, requests_per_minute=600, tokens_per_minute=None, min_requests_per_minute=6,
+                 increase=1.0, decrease=0.5, burst_seconds=2.0, decrease_interval=5.0):
+        self.max_requests_per_minute = requests_per_minute
+        self.min_requests_per_minute = min_requests_per_minute
+        self.increase = increase
+        self.decrease = decrease
+        # A burst of concurrent calls hitting the same quota counts as one throttling event.
+        self.decrease_interval = decrease_interval
+        self._last_decrease = float("-inf")
+        self._requests = _Bucket(requests_per_minute, burst_seconds)
+        self._tokens = _Bucket(tokens_per_minute, burst_seconds) if tokens_per_minute else None
+        self._lock = threading.Lock()
+
+    @property
+    def requests_per_minute(self):
+        return self._requests.per_minute
+
+    def _try_acquire(self, tokens):
+        # Returns 0 if the request may go ahead, otherwise the seconds to wait before trying again.
+        with self._lock:
+            now = time.monotonic()
+            buckets = [(self._requests, 1)]
+            if self._tokens is not None:
+                buckets.append((self._tokens, tokens))
+            for bucket, amount in buckets:
+                bucket.refill(now)
+            wait = max(bucket.wait_time(amount) for bucket, amount in buckets)
+            if wait == 0:
+                for bucket, amount in buckets:
+                    bucket.level -= min(amount, bucket.capacity)
+            return wait
+
+    async def acquire(self, tokens=1):
+        while True:
+            wait = self._try_acquire(tokens)
+            if wait == 0:
+                return
+            await asyncio.sleep(wait)
+
+    def on_success(self):
+        with self._lock:
+            self._requests.per_minute = min(self.max_requests_per_minute, self._requests.per_minute + self.increase)
+
+    def on_throttle(self):
+        with self._lock:
+            now = time.monotonic()
+            if now - self._last_decrease < self.decrease_interval:
+                return
+            self._last_decrease = now
+            self._requests.per_minute = max(self.min_requests_per_minute, self._requests.per_minute * self.decrease)
+            self._requests.level = min(self._requests.level, self._requests.capacity)
+            rate = self._requests.per_minute
+        logger.info(f"Throttled, request rate lowered to {rate:.1f}/min.")
+
+class CircuitBreaker:
+    # Opens after failure_threshold consecutive transient failures. While open, callers pause instead of
+    # retrying on their own; after reset_timeout a single probe call is let through (half-open) and its
+    # outcome closes or re-opens the circuit.
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._lock = threading.Lock()
+
+    def wait_time(self):
+        # Returns 0 if a call may be attempted now, otherwise the seconds to wait before asking again.
+        with self._lock:
+            if self.state == "closed":
+                return 0
+            now = time.monotonic()
+            remaining = self.opened_at + self.reset_timeout - now
+            if remaining <= 0:
+                # Let one probe through; another one follows if it hasn't settled within reset_timeout.
+                self.state = "half_open"
+                self.opened_at = now
+                return 0
+            if self.state == "half_open":
+                # Wait for the probe call to settle the circuit.
+                return min(1.0, remaining)
+            return remaining
+
+    async def wait(self):
+        while True:
+            wait = self.wait_time()
+            if wait == 0:
+                return
+            await asyncio.sleep(wait)
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == "half_open" or self.failures >= self.failure_threshold:
+                if self.state != "open":
+                    logger.warning(f"Circuit opened after {self.failures} consecutive failures.")
+                self.state = "open"
+                self.opened_at = time.monotonic()
@@ -0,0 +1,124 @@
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+# Get a logger for this module
+logger = logging.getLogger(__name__)
+
+class ResponseCache:
+    # Disk-backed cache of model responses, keyed on a hash of model name, prompt and generation config.
+    # Several processes (e.g. shard workers) may share one file: the total size is kept in the database, so
+    # eviction sees every process's writes, and hits record their recency in batches ('touch_batch') instead of
+    # taking the write lock on every read.
+
+    def __init__(self, path="response_cache.sqlite", max_bytes=512 * 1024 * 1024, touch_batch=64):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.touch_batch = touch_batch
+        self.hits = 0
+        self.misses = 0
+        self._touched = {}
+        self._lock = threading.Lock()
+        # Writers from other processes can hold the lock for a while under load.
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=60)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, response TEXT NOT NULL, size INTEGER NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS cache_size (id INTEGER PRIMARY KEY CHECK (id = 0), bytes INTEGER NOT NULL)")
+        # Caches created before the size was stored start from the size of their entries.
+        self._conn.execute("INSERT OR IGNORE INTO cache_size SELECT 0, COALESCE(SUM(size), 0) FROM responses")
+        self._conn.commit()
+
+    @staticmethod
+    def key(model_name, prompt, config, sample=0):
+        # 'sample' separates repeated requests for the same prompt (e.g. retries after a parse failure),
+        # so a rerun replays the same sequence of responses instead of one response over and over.
+        payload = json.dumps([model_name, prompt, config, sample], sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._touched[key] = time.time()
+            if len(self._touched) >= self.touch_batch:
+                self._flush_touched()
+            return row[0]
+
+    def _flush_touched(self):
+        # Best effort: a hit's recency only steers eviction, so it's dropped rather than failing the read.
+        touched, self._touched = self._touched, {}
+        try:
+            self._write_touched(touched)
+            self._conn.commit()
+        except sqlite3.OperationalError as e:
+            self._conn.rollback()
+            logger.info(f"Skipped recording the use of {len(touched)} cached responses: {e}")
+
+    def _write_touched(self, touched):
+        self._conn.executemany("UPDATE responses SET last_used = ? WHERE key = ?",
+                               [(last_used, key) for key, last_used in touched.items()])
+
+    def put(self, key, response):
+        size = len(response.encode("utf-8"))
+        with self._lock:
+            try:
+                # Takes the write lock up front, so the size read below can't go stale before the update.
+                self._conn.execute("BEGIN IMMEDIATE")
+                touched, self._touched = self._touched, {}
+                self._write_touched(touched)
+                row = self._conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO responses (key, response, size, last_used) VALUES (?, ?, ?, ?)",
+                    (key, response, size, time.time())
+                )
+                self._add_size(size - (row[0] if row else 0))
+                self._evict()
+                self._conn.commit()
+            except sqlite3.Error:
+                self._conn.rollback()
+                raise
+
+    def _add_size(self, delta):
+        self._conn.execute("UPDATE cache_size SET bytes = bytes + ? WHERE id = 0", (delta,))
+
+    def _size(self):
+        return self._conn.execute("SELECT bytes FROM cache_size WHERE id = 0").fetchone()[0]
+
+    def _evict(self):
+        # Drop least recently used entries until the cache fits in max_bytes.
+        size = self._size()
+        while size > self.max_bytes:
+            rows = self._conn.execute(
+                "SELECT key, size FROM responses ORDER BY last_used LIMIT 64"
+            ).fetchall()
+            if not rows:
+                self._add_size(-size)
+                return
+            for key, entry_size in rows:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._add_size(-entry_size)
+                size -= entry_size
+                if size <= self.max_bytes:
+                    break
+
+    def stats(self):
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            size = self._size()
+        return {"hits": self.hits, "misses": self.misses, "entries": entries, "bytes": size}
+
+    def close(self):
+        with self._lock:
+            if self._touched:
+                self._flush_touched()
+            self._conn.close()
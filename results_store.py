@@ -0,0 +1,233 @@
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+# Get a logger for this module
+logger = logging.getLogger(__name__)
+
+_SCHEMA = [
+    "CREATE TABLE IF NOT EXISTS problems ("
+    "problem_id TEXT PRIMARY KEY, position INTEGER, problem TEXT NOT NULL, official_answer TEXT)",
+    "CREATE TABLE IF NOT EXISTS generations ("
+    "generation_id TEXT PRIMARY KEY, problem_id TEXT NOT NULL, model TEXT, response TEXT NOT NULL, "
+    "model_answer TEXT, correct INTEGER, created REAL NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS generations_problem ON generations (problem_id)",
+    "CREATE TABLE IF NOT EXISTS sentences ("
+    "generation_id TEXT NOT NULL, part TEXT NOT NULL, position INTEGER NOT NULL, sentence TEXT NOT NULL, "
+    "PRIMARY KEY (generation_id, part, position))",
+    "CREATE TABLE IF NOT EXISTS verdicts ("
+    "generation_id TEXT NOT NULL, run TEXT NOT NULL, step INTEGER NOT NULL, theorem TEXT, verdicts TEXT, "
+    "relation TEXT, mistake INTEGER NOT NULL, created REAL NOT NULL, confidence REAL, PRIMARY KEY (generation_id, run, step))",
+    "CREATE INDEX IF NOT EXISTS verdicts_step ON verdicts (generation_id, step)",
+    "CREATE TABLE IF NOT EXISTS baseline_prompts ("
+    "generation_id TEXT NOT NULL, kind TEXT NOT NULL, prompt TEXT NOT NULL, PRIMARY KEY (generation_id, kind))",
+    "CREATE TABLE IF NOT EXISTS model_calls ("
+    "call_id INTEGER PRIMARY KEY, site TEXT, model TEXT, prompt_hash TEXT, input_tokens INTEGER, "
+    "output_tokens INTEGER, cached_tokens INTEGER, retries INTEGER, wall_sec REAL, ok INTEGER, created REAL NOT NULL)",
+    "CREATE INDEX IF NOT EXISTS model_calls_site ON model_calls (site)",
+]
+
+# Columns copied by merge(); merged model_calls get new call ids.
+_TABLES = {
+    "problems": "problem_id, position, problem, official_answer",
+    "generations": "generation_id, problem_id, model, response, model_answer, correct, created",
+    "sentences": "generation_id, part, position, sentence",
+    "verdicts": "generation_id, run, step, theorem, verdicts, relation, mistake, created, confidence",
+    "baseline_prompts": "generation_id, kind, prompt",
+    "model_calls": "site, model, prompt_hash, input_tokens, output_tokens, cached_tokens, retries, wall_sec, ok, created",
+}
+
+def _hash(*parts):
+    payload = json.dumps(parts, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:32]
+
+class ResultsStore:
+    # SQLite store for everything the driver scripts produce: problems, generations, segmented sentences,
+    # per-step verdicts, baseline prompts and model calls. Writes are append-only and idempotent (rows are
+    # keyed by content hashes), so reruns and resumed runs don't duplicate results.
+
+    def __init__(self, path="results.sqlite", call_batch=64):
+        self.path = path
+        self.call_batch = call_batch
+        self._calls = []
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=60)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        for statement in _SCHEMA:
+            self._conn.execute(statement)
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(verdicts)")]
+        if "confidence" not in columns:
+            # Stores created before per-step confidences were recorded.
+            self._conn.execute("ALTER TABLE verdicts ADD COLUMN confidence REAL")
+        self._conn.commit()
+
+    @staticmethod
+    def problem_id(problem):
+        return _hash(problem)
+
+    @staticmethod
+    def generation_id(problem_id, model_name, response):
+        return _hash(problem_id, model_name, response)
+
+    def _write(self, statement, rows):
+        with self._lock:
+            self._conn.executemany(statement, rows)
+            self._conn.commit()
+
+    def add_problem(self, problem, official_answer=None, position=None):
+        problem_id = self.problem_id(problem)
+        self._write("INSERT OR IGNORE INTO problems VALUES (?, ?, ?, ?)", [(problem_id, position, problem, official_answer)])
+        return problem_id
+
+    def add_generation(self, problem_id, model_name, response, model_answer=None, correct=None):
+        generation_id = self.generation_id(problem_id, model_name, response)
+        self._write(
+            "INSERT OR IGNORE INTO generations VALUES (?, ?, ?, ?, ?, ?, ?)",
+            [(generation_id, problem_id, model_name, response, model_answer,
+              None if correct is None else int(correct), time.time())]
+        )
+        return generation_id
+
+    def add_sentences(self, generation_id, problem_sentences, solution_sentences):
+        rows = [(generation_id, "problem", i, sentence) for i, sentence in enumerate(problem_sentences)]
+        rows += [(generation_id, "solution", i, sentence) for i, sentence in enumerate(solution_sentences)]
+        self._write("INSERT OR IGNORE INTO sentences VALUES (?, ?, ?, ?)", rows)
+
+    def add_verdicts(self, generation_id, run, steps):
+        # 'steps' are dicts with "step" (sentence number), "theorem", "verdicts", "relation", "mistake" and
+        # optionally "confidence"; 'run' names the verification mode, so results of different modes are kept
+        # side by side.
+        now = time.time()
+        rows = [
+            (generation_id, run, step["step"], step.get("theorem"), json.dumps(step.get("verdicts")),
+             step.get("relation"), int(step["mistake"]), now, step.get("confidence"))
+            for step in steps
+        ]
+        self._write(f"INSERT OR IGNORE INTO verdicts ({_TABLES['verdicts']}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+    def add_baseline_prompt(self, generation_id, kind, prompt):
+        self._write("INSERT OR IGNORE INTO baseline_prompts VALUES (?, ?, ?)", [(generation_id, kind, prompt)])
+
+    def record_call(self, site, model_name, prompt, wall_time, usage=None, retries=0, ok=True):
+        # Buffered; written every 'call_batch' calls and on flush()/close().
+        usage = usage or {}
+        row = (site, model_name, _hash(prompt), usage.get("input_tokens"), usage.get("output_tokens"),
+               usage.get("cached_tokens"), retries, wall_time, int(ok), time.time())
+        with self._lock:
+            self._calls.append(row)
+            if len(self._calls) >= self.call_batch:
+                self._flush_calls()
+
+    def _flush_calls(self):
+        if self._calls:
+            self._conn.executemany(f"INSERT INTO model_calls ({_TABLES['model_calls']}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", self._calls)
+            self._conn.commit()
+            self._calls = []
+
+    def flush(self):
+        with self._lock:
+            self._flush_calls()
+
+    def _query(self, statement, parameters=()):
+        with self._lock:
+            return self._conn.execute(statement, parameters).fetchall()
+
+    def incorrect_generations(self):
+        # Wrong-answer generations in problem order, as dicts with the fields of the old incorrect_solutions.jsonl.
+        rows = self._query(
+            "SELECT g.generation_id, p.problem, p.official_answer, g.model_answer, g.response "
+            "FROM generations g JOIN problems p ON p.problem_id = g.problem_id "
+            "WHERE g.correct = 0 ORDER BY p.position, g.created, g.generation_id"
+        )
+        return [
+            {"generation_id": row[0], "problem": row[1], "official_answer": row[2], "model_answer": row[3],
+             "model_response": row[4]}
+            for row in rows
+        ]
+
+    def generations(self):
+        # Every generation in problem order, as dicts with its stored answer match.
+        rows = self._query(
+            "SELECT g.generation_id, p.official_answer, g.response, g.model_answer, g.correct "
+            "FROM generations g JOIN problems p ON p.problem_id = g.problem_id "
+            "ORDER BY p.position, g.created, g.generation_id"
+        )
+        return [
+            {"generation_id": row[0], "official_answer": row[1], "model_response": row[2], "model_answer": row[3],
+             "correct": None if row[4] is None else bool(row[4])}
+            for row in rows
+        ]
+
+    def set_scores(self, scores):
+        # 'scores' are (generation_id, model_answer, correct) triples, e.g. from a re-scoring run.
+        self._write("UPDATE generations SET model_answer = ?, correct = ? WHERE generation_id = ?",
+                    [(answer, None if correct is None else int(correct), gid) for gid, answer, correct in scores])
+
+    def sentences(self, generation_id):
+        # (problem sentences, solution sentences) of a segmented generation.
+        rows = self._query(
+            "SELECT part, sentence FROM sentences WHERE generation_id = ? ORDER BY part, position", (generation_id,)
+        )
+        return [s for part, s in rows if part == "problem"], [s for part, s in rows if part == "solution"]
+
+    def segmented_generations(self):
+        # (generation_id, problem sentences, solution sentences) of every segmented generation, in problem order.
+        rows = self._query(
+            "SELECT g.generation_id FROM generations g JOIN problems p ON p.problem_id = g.problem_id "
+            "WHERE EXISTS (SELECT 1 FROM sentences s WHERE s.generation_id = g.generation_id) "
+            "ORDER BY p.position, g.created, g.generation_id"
+        )
+        return [(row[0], *self.sentences(row[0])) for row in rows]
+
+    def verdicts(self, generation_id, run=None):
+        statement = "SELECT run, step, theorem, verdicts, relation, mistake, confidence FROM verdicts WHERE generation_id = ?"
+        parameters = (generation_id,)
+        if run is not None:
+            statement += " AND run = ?"
+            parameters += (run,)
+        rows = self._query(statement + " ORDER BY run, step", parameters)
+        return [
+            {"run": row[0], "step": row[1], "theorem": row[2], "verdicts": json.loads(row[3]), "relation": row[4],
+             "mistake": bool(row[5]), "confidence": row[6]}
+            for row in rows
+        ]
+
+    def mistakes(self, generation_id, run):
+        return [step["step"] for step in self.verdicts(generation_id, run) if step["mistake"]]
+
+    def baseline_prompts(self, kind):
+        return [row[0] for row in self._query(
+            "SELECT b.prompt FROM baseline_prompts b JOIN generations g ON g.generation_id = b.generation_id "
+            "JOIN problems p ON p.problem_id = g.problem_id WHERE b.kind = ? ORDER BY p.position, g.created", (kind,)
+        )]
+
+    def merge(self, paths):
+        # Copies the rows of other stores (e.g. per-shard stores) into this one.
+        with self._lock:
+            self._flush_calls()
+            for path in paths:
+                self._conn.execute("ATTACH DATABASE ? AS shard", (path,))
+                try:
+                    for table, columns in _TABLES.items():
+                        if table == "model_calls":
+                            # Calls have no natural key; skip the ones an earlier merge already copied.
+                            self._conn.execute(
+                                f"INSERT INTO main.model_calls ({columns}) SELECT {columns} FROM shard.model_calls s "
+                                "WHERE NOT EXISTS (SELECT 1 FROM main.model_calls m WHERE m.created = s.created "
+                                "AND m.site IS s.site AND m.prompt_hash = s.prompt_hash)"
+                            )
+                        else:
+                            self._conn.execute(f"INSERT OR IGNORE INTO main.{table} ({columns}) SELECT {columns} FROM shard.{table}")
+                    self._conn.commit()
+                finally:
+                    self._conn.execute("DETACH DATABASE shard")
+                logger.info(f"Merged results from {path}.")
+
+    def close(self):
+        with self._lock:
+            self._flush_calls()
+            self._conn.close()
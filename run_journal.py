@@ -0,0 +1,89 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+
+# Get a logger for this module
+logger = logging.getLogger(__name__)
+
+class RunJournal:
+    # Append-only JSONL record of completed work units, so an interrupted run can resume where it stopped.
+
+    def __init__(self, path, fsync="always", fsync_every=16):
+        # fsync: "always" syncs after every record, "batch" after every fsync_every records, "never" leaves it to the OS.
+        if fsync not in ("always", "batch", "never"):
+            raise ValueError(f"Unknown fsync policy: {fsync}")
+        self.path = path
+        self.fsync = fsync
+        self.fsync_every = fsync_every
+        self._entries = {}
+        self._unsynced = 0
+        self._lock = threading.Lock()
+        self._load()
+        self._file = open(path, "a", encoding="utf-8")
+        if self._file.tell() > 0 and not self._ends_with_newline():
+            # Terminate a record truncated by a crash so the next record starts on its own line.
+            self._file.write("\n")
+            self._file.flush()
+
+    @staticmethod
+    def key(*inputs):
+        payload = json.dumps(inputs, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "r", encoding="utf-8") as fin:
+            for line_number, line in enumerate(fin, 1):
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    logger.warning(f"Skipping unreadable record on line {line_number} of {self.path}.")
+                    continue
+                self._entries[entry["key"]] = entry["result"]
+        logger.info(f"Loaded {len(self._entries)} completed units from {self.path}.")
+
+    def _ends_with_newline(self):
+        with open(self.path, "rb") as fin:
+            fin.seek(-1, os.SEEK_END)
+            return fin.read(1) == b"\n"
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        return self._entries.get(key, default)
+
+    def record(self, key, result):
+        line = json.dumps({"key": key, "result": result}, ensure_ascii=False)
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+            self._entries[key] = result
+            self._unsynced += 1
+            if self.fsync == "always" or (self.fsync == "batch" and self._unsynced >= self.fsync_every):
+                os.fsync(self._file.fileno())
+                self._unsynced = 0
+
+    def close(self):
+        with self._lock:
+            if self._file.closed:
+                return
+            self._file.flush()
+            if self.fsync != "never":
+                os.fsync(self._file.fileno())
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
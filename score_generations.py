@@ -0,0 +1,91 @@
+import argparse
+import collections
+import json
+import logging
+import os
+import time
+from logger_setup import setup_logging
+from results_store import ResultsStore
+from symbolic_equivalence import SymbolicChecker
+import answer_extraction
+# Get a logger for the main module
+logger = logging.getLogger(__name__)
+
+def read_items(path, id_field, response_field, answer_field):
+    # (id, response, official answer, previous verdict) of every generation in a results store (.sqlite),
+    # a JSONL file or an Arrow/Parquet table. Rows without 'id_field' are identified by their position.
+    if path.endswith(".sqlite"):
+        store = ResultsStore(path)
+        rows = store.generations()
+        store.close()
+        return [(row["generation_id"], row["model_response"], row["official_answer"], row["correct"]) for row in rows]
+    if path.endswith(".jsonl"):
+        with open(path, "r", encoding="utf-8") as fin:
+            rows = [json.loads(line) for line in fin if line.strip()]
+    else:
+        # Arrow files are read with pyarrow, which is only needed for these input formats.
+        if path.endswith(".parquet"):
+            import pyarrow.parquet
+            table = pyarrow.parquet.read_table(path)
+        else:
+            import pyarrow.feather
+            table = pyarrow.feather.read_table(path)
+        rows = table.to_pylist()
+    return [(row.get(id_field, i), row.get(response_field), row.get(answer_field), row.get("correct"))
+            for i, row in enumerate(rows)]
+
+def rescore(args):
+    items = read_items(args.input, args.id_field, args.response_field, args.answer_field)
+    logger.info(f"Scoring {len(items)} generations from {args.input} with {args.processes or os.cpu_count()} processes.")
+    # Answers whose normalized strings differ are only compared symbolically with --symbolic.
+    symbolic = SymbolicChecker() if args.symbolic else None
+    start = time.perf_counter()
+    results = answer_extraction.score_items([item[:3] for item in items], args.processes, args.chunksize, symbolic)
+    wall = time.perf_counter() - start
+    if symbolic is not None:
+        symbolic.close()
+    statuses = collections.Counter(result[1] for result in results)
+    verdicts = collections.Counter(result[3] for result in results)
+    changed = 0
+    with open(args.output, "w", encoding="utf-8") as fout:
+        for item, (item_id, status, model_answer, correct) in zip(items, results):
+            record = {"id": item_id, "status": status, "model_answer": model_answer, "correct": correct}
+            if item[3] is not None:
+                # Verdict stored before re-scoring.
+                record["previous"] = item[3]
+                changed += item[3] != correct
+            fout.write(json.dumps(record, ensure_ascii=False) + "\n")
+    if args.update_store:
+        store = ResultsStore(args.input)
+        store.set_scores([(item_id, model_answer, correct) for item_id, _, model_answer, correct in results])
+        store.close()
+        logger.info(f"Updated the answer match of {len(results)} generations in {args.input}.")
+    summary = (f"Scored {len(results)} generations in {wall:.2f} s ({len(results) / max(wall, 1e-9):.0f}/s): "
+               f"extraction {dict(statuses)}, {verdicts[True]} correct, {verdicts[False]} incorrect, "
+               f"{changed} changed. Scores written to {args.output}.")
+    logger.info(summary)
+    print(summary)
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Re-extract and re-score the boxed answers of stored generations.")
+    parser.add_argument("input", help="Results store (.sqlite), JSONL file or Arrow/Parquet table of generations.")
+    parser.add_argument("--output", default="scores.jsonl", help="Per-generation extraction status and verdict.")
+    parser.add_argument("--id-field", default="generation_id")
+    parser.add_argument("--response-field", default="model_response")
+    parser.add_argument("--answer-field", default="official_answer")
+    parser.add_argument("--processes", type=int, help="Scoring processes (default: one per CPU).")
+    parser.add_argument("--chunksize", type=int, default=256, help="Generations per task sent to a process.")
+    parser.add_argument("--symbolic", action="store_true", help="Compare answers whose normalized strings differ symbolically.")
+    parser.add_argument("--update-store", action="store_true", help="Write the new answers and verdicts back to the input store.")
+    args = parser.parse_args(argv)
+    if args.update_store and not args.input.endswith(".sqlite"):
+        parser.error("--update-store needs a results store (.sqlite) as input")
+    return args
+
+def main(argv=None):
+    args = parse_args(argv)
+    setup_logging("score_generations")
+    rescore(args)
+
+if __name__ == "__main__":
+    main()
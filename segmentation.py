@@ -0,0 +1,119 @@
+import logging
+import re
+from answer_extraction import find_closing_brace
+
+# Get a logger for this module
+logger = logging.getLogger(__name__)
+
+# Opening and closing delimiters of math spans that must never be split, longest openers first.
+_MATH_DELIMITERS = [("$$", "$$"), ("\\[", "\\]"), ("\\(", "\\)"), ("$", "$")]
+_PLACEHOLDER = "MATHSPAN{}"
+_PARAGRAPH_BREAK = re.compile(r"\n\s*\n")
+
+def _find_closing(text, start, closing):
+    i = start
+    while i < len(text):
+        if text[i] == "\\" and not closing.startswith("\\"):
+            # Skip escaped characters such as \$ inside inline math.
+            i += 2
+            continue
+        if text.startswith(closing, i):
+            return i
+        i += 1
+    return -1
+
+def protect_math(text):
+    # Replace $...$, $$...$$, \[...\], \(...\) and \boxed{...} spans by placeholders.
+    # Returns (protected text, spans, balanced); balanced is False if a delimiter is never closed.
+    spans = []
+    pieces = []
+    balanced = True
+    last = 0
+    i = 0
+    while i < len(text):
+        end = -1
+        if text.startswith("\\boxed{", i):
+            close = find_closing_brace(text, i + len("\\boxed{"))
+            end = close + 1 if close != -1 else -1
+            found = True
+        elif text.startswith("\\$", i):
+            i += 2
+            continue
+        else:
+            found = False
+            for opening, closing in _MATH_DELIMITERS:
+                if text.startswith(opening, i):
+                    close = _find_closing(text, i + len(opening), closing)
+                    end = close + len(closing) if close != -1 else -1
+                    found = True
+                    break
+        if not found:
+            i += 1
+            continue
+        if end == -1:
+            balanced = False
+            break
+        span = text[i:end]
+        placeholder = _PLACEHOLDER.format(len(spans))
+        # Display math often carries the sentence's full stop inside the delimiters.
+        if re.search(r"[.!?]\s*(\\\]|\$\$|\\\))$", span):
+            placeholder += "."
+        pieces.append(text[last:i])
+        pieces.append(placeholder)
+        spans.append((placeholder, span))
+        last = i = end
+    pieces.append(text[last:])
+    return "".join(pieces), spans, balanced
+
+def restore_math(sentence, spans):
+    for placeholder, span in reversed(spans):
+        sentence = sentence.replace(placeholder, span)
+    return sentence
+
+class SentenceSplitter:
+    # LaTeX-aware local replacement for the parse_text model call, built on spaCy's rule-based sentencizer.
+
+    def __init__(self, max_sentence_chars=600, batch_size=64):
+        # Sentences longer than max_sentence_chars suggest a missed boundary and lower confidence.
+        self.max_sentence_chars = max_sentence_chars
+        self.batch_size = batch_size
+        self._nlp = None
+
+    def _pipeline(self):
+        if self._nlp is None:
+            import spacy
+            self._nlp = spacy.blank("en")
+            self._nlp.add_pipe("sentencizer")
+        return self._nlp
+
+    def _prepare(self, text):
+        protected, spans, balanced = protect_math(text)
+        paragraphs = [" ".join(p.split()) for p in _PARAGRAPH_BREAK.split(protected)]
+        return [p for p in paragraphs if p], spans, balanced
+
+    def _finish(self, text, docs, spans, balanced):
+        sentences = []
+        for doc in docs:
+            for sent in doc.sents:
+                sentence = restore_math(sent.text.strip(), spans)
+                if sentence:
+                    sentences.append(sentence)
+        confident = balanced and bool(sentences or not text.strip())
+        if any(len(sentence) > self.max_sentence_chars for sentence in sentences):
+            confident = False
+        return sentences, confident
+
+    def split(self, text):
+        # Returns (sentences, confident).
+        return self.split_many([text])[0]
+
+    def split_many(self, texts):
+        # Segments all texts with a single nlp.pipe pass over their paragraphs.
+        prepared = [self._prepare(text) for text in texts]
+        paragraphs = [p for paras, _, _ in prepared for p in paras]
+        docs = iter(self._pipeline().pipe(paragraphs, batch_size=self.batch_size))
+        results = []
+        for text, (paras, spans, balanced) in zip(texts, prepared):
+            text_docs = [next(docs) for _ in paras]
+            results.append(self._finish(text, text_docs, spans, balanced))
+        return results
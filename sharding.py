@@ -0,0 +1,76 @@
+import hashlib
+import logging
+import os
+import subprocess
+import sys
+from results_store import ResultsStore
+
+# Get a logger for this module
+logger = logging.getLogger(__name__)
+
+def add_arguments(parser):
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Run this many shards as local worker processes and merge their outputs.")
+    parser.add_argument("--targets", nargs="+", default=[],
+                        help="PROJECT:LOCATION[:CREDENTIALS_JSON] per worker, assigned round-robin, to spread quota.")
+    parser.add_argument("--split", choices=["index", "hash"], default="index",
+                        help="Assign items to shards by position or by a hash of their content.")
+    parser.add_argument("--shard", type=int, help="Run only this shard (0-based), e.g. one per node.")
+    parser.add_argument("--shards", type=int, default=1, help="Total number of shards.")
+    parser.add_argument("--merge", action="store_true", help="Only merge the shard outputs of an earlier run.")
+
+def stable_hash(text):
+    # Same value in every process and on every node, unlike hash().
+    return int(hashlib.sha256(text.encode("utf-8")).hexdigest()[:16], 16)
+
+def select(items, shard, shards, split="index", key=None):
+    # (index, item) pairs of this shard; 'key' maps an item to the text hashed for split="hash".
+    selected = []
+    for index, item in enumerate(items):
+        value = index if split == "index" else stable_hash(key(item))
+        if value % shards == shard:
+            selected.append((index, item))
+    return selected
+
+def shard_path(path, shard, shards):
+    # 'results.sqlite' -> 'results.shard-2-of-4.sqlite'; unsharded runs keep the plain name.
+    if shards == 1:
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}.shard-{shard}-of-{shards}{ext}"
+
+def parse_target(spec):
+    project, location, *credentials = spec.split(":", 2)
+    return project, location, credentials[0] if credentials else None
+
+def run_workers(script, argv, workers, targets):
+    # Starts 'workers' copies of 'script' with the same arguments plus --shard/--shards and their target's
+    # project, location and credentials, waits for all of them and returns True if every worker succeeded.
+    processes = []
+    for shard in range(workers):
+        worker_argv = list(argv) + ["--shard", str(shard), "--shards", str(workers)]
+        env = dict(os.environ)
+        if targets:
+            project, location, credentials = parse_target(targets[shard % len(targets)])
+            worker_argv += ["--project", project, "--location", location]
+            if credentials:
+                env["GOOGLE_APPLICATION_CREDENTIALS"] = credentials
+        logger.info(f"Starting shard {shard + 1}/{workers}: {' '.join(worker_argv)}")
+        processes.append(subprocess.Popen([sys.executable, script] + worker_argv, env=env))
+    codes = [process.wait() for process in processes]
+    for shard, code in enumerate(codes):
+        if code != 0:
+            logger.error(f"Shard {shard + 1}/{workers} exited with code {code}.")
+    return all(code == 0 for code in codes)
+
+def merge_stores(path, shards):
+    # Merges the per-shard results stores of 'path' into it. Reads order rows by problem position, so the
+    # result doesn't depend on the number of shards or on which shard finished first.
+    shard_files = [shard_path(path, shard, shards) for shard in range(shards)]
+    missing = [shard_file for shard_file in shard_files if not os.path.exists(shard_file)]
+    for shard_file in missing:
+        logger.warning(f"Missing shard store {shard_file}.")
+    store = ResultsStore(path)
+    store.merge([shard_file for shard_file in shard_files if shard_file not in missing])
+    store.close()
+    logger.info(f"Merged {shards - len(missing)} shard stores into {path}.")
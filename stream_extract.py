@@ -0,0 +1,115 @@
+import json
+import logging
+
+# Get a logger for this module
+logger = logging.getLogger(__name__)
+
+DONE = "done"
+ABORT = "abort"
+
+class JsonBlockExtractor:
+    # Incrementally scans a streamed response for ```json blocks. feed() returns DONE as soon as a complete
+    # block parses and passes 'validate', and ABORT when the response can no longer yield one: with
+    # 'first_block_only' (for callers that only read the first block) the first invalid block is fatal, and
+    # any response longer than 'max_chars' is a runaway. Otherwise it returns None and wants more text.
+    # With 'last_block' (for callers that read the last block, as the model may write drafts before its final
+    # answer) no block is accepted early: the whole response is read and only a runaway is aborted.
+
+    def __init__(self, validate=None, first_block_only=False, last_block=False, max_chars=50000):
+        self.validate = validate
+        self.first_block_only = first_block_only
+        self.last_block = last_block
+        self.max_chars = max_chars
+        self.reset()
+
+    def reset(self):
+        # Called before every (re)try of a request.
+        self.text = ""
+        self.state = None
+        self.value = None
+        self._scan = 0
+        self._block = None
+        self._value_start = None
+        self._end = None
+
+    def _object_end(self, start):
+        # Index just past the JSON value starting at or after 'start', None if it isn't complete yet,
+        # or -1 if the block doesn't start with an object or array.
+        i = start
+        while i < len(self.text) and self.text[i].isspace():
+            i += 1
+        if i == len(self.text):
+            return
+        if self.text[i] not in "{[":
+            return -1
+        self._value_start = i
+        depth = 0
+        in_string = False
+        escape = False
+        for j in range(i, len(self.text)):
+            char = self.text[j]
+            if in_string:
+                if escape:
+                    escape = False
+                elif char == "\\":
+                    escape = True
+                elif char == '"':
+                    in_string = False
+            elif char == '"':
+                in_string = True
+            elif char in "{[":
+                depth += 1
+            elif char in "}]":
+                depth -= 1
+                if depth == 0:
+                    return j + 1
+
+    def _accept(self, end):
+        try:
+            value = json.loads(self.text[self._value_start:end])
+        except json.JSONDecodeError:
+            return False
+        if self.validate is not None and not self.validate(value):
+            return False
+        self.value = value
+        return True
+
+    def feed(self, chunk):
+        self.text += chunk
+        while self.state is None:
+            if self._block is None:
+                start = self.text.find("```json", self._scan)
+                if start == -1:
+                    # Keep the tail in case the fence is split across chunks.
+                    self._scan = max(self._scan, len(self.text) - len("```json"))
+                    break
+                self._block = start + len("```json")
+            end = self._object_end(self._block)
+            if end is None:
+                break
+            if end != -1 and self._accept(end):
+                if self.last_block:
+                    # A later block may still replace this one.
+                    self._scan = end
+                    self._block = None
+                    continue
+                self.state = DONE
+                self._end = end
+                break
+            logger.info("Invalid JSON block in streamed response.")
+            if self.first_block_only:
+                self.state = ABORT
+                break
+            self._scan = max(end, self._block)
+            self._block = None
+        if self.state is None and len(self.text) > self.max_chars:
+            logger.info(f"Streamed response exceeded {self.max_chars} characters without a valid JSON block.")
+            self.state = ABORT
+        return self.state
+
+    def result(self):
+        # Once DONE, the response up to the accepted block with the closing fence, so the regular parsers
+        # read the same block; otherwise everything received.
+        if self.state == DONE:
+            return self.text[:self._end] + "\n```"
+        return self.text
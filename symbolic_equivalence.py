@@ -0,0 +1,250 @@
+import collections
+import logging
+import multiprocessing
+import re
+import time
+
+# Get a logger for this module
+logger = logging.getLogger(__name__)
+
+# LaTeX commands with a direct sympy spelling; anything else left after conversion makes the answer unparseable.
+_COMMANDS = {
+    "\\cdot": "*",
+    "\\times": "*",
+    "\\div": "/",
+    "\\pi": "pi",
+    "\\infty": "oo",
+    "\\ln": "log",
+    "\\log": "log",
+    "\\sin": "sin",
+    "\\cos": "cos",
+    "\\tan": "tan",
+}
+_SPACING = re.compile(r"\\[,;:! ]|\\quad|\\qquad")
+_TEXT = re.compile(r"\\(?:text|textbf|mathrm|mbox)\{([^{}]*)\}")
+# Tokens allowed in a converted answer. parse_expr evaluates its input with eval, and answers are model output,
+# so anything else (quotes, underscores, attribute access, brackets, commas) is rejected before parsing.
+_TOKEN = re.compile(r"\s+|\d+\.?\d*|\.\d+|[a-zA-Z]+|\*\*|[-+*/^()]")
+_NAMES = set(_COMMANDS.values()) - {"*", "/"}
+
+def _group(text, start):
+    # Returns (content, end) of the {...} group or single character starting at 'start'.
+    if start >= len(text):
+        raise ValueError("Missing argument")
+    if text[start] != "{":
+        return text[start], start + 1
+    depth = 0
+    for i in range(start, len(text)):
+        if text[i] == "{":
+            depth += 1
+        elif text[i] == "}":
+            depth -= 1
+            if depth == 0:
+                return text[start + 1:i], i + 1
+    raise ValueError("Unbalanced braces")
+
+def _whitelist(expression):
+    # Returns 'expression' with every letter run other than a known function or constant split into
+    # single-letter symbols, or raises ValueError if it has a token outside _TOKEN.
+    out = []
+    i = 0
+    while i < len(expression):
+        match = _TOKEN.match(expression, i)
+        if match is None:
+            raise ValueError(f"Unsupported character {expression[i]!r} in {expression!r}")
+        token = match.group(0)
+        if token.isalpha() and token not in _NAMES:
+            token = "*".join(token)
+        out.append(token)
+        i = match.end()
+    return "".join(out)
+
+def latex_to_sympy(text):
+    # Converts a normalized LaTeX answer into a string for sympy's parse_expr; raises ValueError if it can't.
+    text = _SPACING.sub("", text)
+    for match in _TEXT.finditer(text):
+        if re.search(r"[a-zA-Z]", match.group(1)):
+            # Words would be parsed as products of symbols, so "\text{ab}" would equal "\text{ba}".
+            raise ValueError(f"Text in {text!r}")
+    text = _TEXT.sub(r"\1", text)
+    # _fix_sqrt turns \sqrt[3]{x} into \sqrt{[}3]{x}.
+    text = text.replace("\\sqrt{[}", "\\sqrt[")
+    out = []
+    i = 0
+    while i < len(text):
+        if text.startswith("\\frac", i):
+            numerator, i = _group(text, i + len("\\frac"))
+            denominator, i = _group(text, i)
+            out.append(f"(({latex_to_sympy(numerator)})/({latex_to_sympy(denominator)}))")
+        elif text.startswith("\\sqrt", i):
+            i += len("\\sqrt")
+            index = "2"
+            if i < len(text) and text[i] == "[":
+                close = text.index("]", i)
+                index, i = text[i + 1:close], close + 1
+            radicand, i = _group(text, i)
+            out.append(f"(({latex_to_sympy(radicand)})**(1/({latex_to_sympy(index)})))")
+        elif text[i] == "^":
+            exponent, i = _group(text, i + 1)
+            out.append(f"**({latex_to_sympy(exponent)})")
+        elif text[i] == "\\":
+            match = re.match(r"\\[a-zA-Z]+", text[i:])
+            if match is None or match.group(0) not in _COMMANDS:
+                raise ValueError(f"Unsupported LaTeX in {text!r}")
+            out.append(f" {_COMMANDS[match.group(0)]} ")
+            i += len(match.group(0))
+        elif text[i] == "{":
+            out.append("(")
+            i += 1
+        elif text[i] == "}":
+            out.append(")")
+            i += 1
+        else:
+            out.append(text[i])
+            i += 1
+    return _whitelist("".join(out))
+
+def _split_top_level(text):
+    # Splits tuples, lists and intervals such as "(1,2)", "[0,1)" or "1,2" into (brackets, elements).
+    brackets = ""
+    if len(text) >= 2 and text[0] in "([" and text[-1] in ")]":
+        brackets, text = text[0] + text[-1], text[1:-1]
+    parts, depth, current = [], 0, []
+    for char in text:
+        if char in "([{":
+            depth += 1
+        elif char in ")]}":
+            depth -= 1
+        if char == "," and depth == 0:
+            parts.append("".join(current))
+            current = []
+        else:
+            current.append(char)
+    parts.append("".join(current))
+    if len(parts) == 1 and brackets:
+        # Plain parentheses around a single expression.
+        return "", [brackets[0] + text + brackets[1]]
+    return brackets, parts
+
+def _expressions_equal(a, b):
+    import sympy
+    from sympy.parsing.sympy_parser import (
+        parse_expr,
+        standard_transformations,
+        implicit_multiplication_application,
+        convert_xor,
+    )
+    transformations = standard_transformations + (implicit_multiplication_application, convert_xor)
+    ea = parse_expr(latex_to_sympy(a), transformations=transformations, evaluate=True)
+    eb = parse_expr(latex_to_sympy(b), transformations=transformations, evaluate=True)
+    if ea.has(sympy.Float) and eb.has(sympy.Float):
+        # Only two decimal answers are compared with a tolerance.
+        difference = sympy.simplify(ea - eb)
+        if difference.free_symbols:
+            return False
+        value = complex(sympy.N(difference))
+        scale = max(1.0, abs(complex(sympy.N(eb))))
+        return abs(value) <= 1e-9 * scale
+    # A decimal compared with an exact answer must equal it exactly, so 0.5 equals \frac{1}{2} but
+    # 3.14159265358979 doesn't equal \pi.
+    ea = sympy.nsimplify(ea, rational=True) if ea.has(sympy.Float) else ea
+    eb = sympy.nsimplify(eb, rational=True) if eb.has(sympy.Float) else eb
+    return sympy.simplify(ea - eb) == 0
+
+def _load_sympy():
+    # Worker initializer, so a fresh worker's first check isn't charged for importing sympy.
+    import sympy.parsing.sympy_parser
+
+def symbolic_equal(a, b):
+    # Worker entry point: True if the normalized answers a and b denote the same value, False otherwise.
+    try:
+        brackets_a, parts_a = _split_top_level(a)
+        brackets_b, parts_b = _split_top_level(b)
+        if brackets_a != brackets_b or len(parts_a) != len(parts_b):
+            return False
+        return all(_expressions_equal(x, y) for x, y in zip(parts_a, parts_b))
+    except Exception:
+        return False
+
+class SymbolicChecker:
+    # Second equivalence tier for answers whose normalized strings differ: both sides are parsed into sympy
+    # expressions in a process pool. Each check has a timeout, counted from its submission, after which the pool
+    # is restarted, so a pathological expression can't stall the pipeline. Results are cached by the normalized pair.
+
+    def __init__(self, processes=2, timeout=2.0, cache_size=65536):
+        self.processes = processes
+        self.timeout = timeout
+        self.cache_size = cache_size
+        self.timeouts = 0
+        self._cache = collections.OrderedDict()
+        self._pool = None
+        self._start()
+
+    def _start(self):
+        # Spawned, not forked: by now the logging listener and the model client's event loop may be running,
+        # and a forked worker would inherit their locks in whatever state those threads left them.
+        self._pool = multiprocessing.get_context("spawn").Pool(self.processes, initializer=_load_sympy)
+        # Wait for a worker to come up, since the check timeouts don't allow for interpreter startup.
+        self._pool.apply(_load_sympy)
+
+    def _restart(self):
+        self._pool.terminate()
+        self._pool.join()
+        self._start()
+
+    def _cached(self, key):
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return self._cache[key]
+
+    def _store(self, key, value):
+        self._cache[key] = value
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def check(self, a, b):
+        return self.check_many([(a, b)])[0]
+
+    def check_many(self, pairs):
+        results = [None] * len(pairs)
+        keys = [tuple(sorted(pair)) for pair in pairs]
+        todo = collections.deque()
+        for i, key in enumerate(keys):
+            cached = self._cached(key)
+            if cached is None:
+                todo.append(i)
+            else:
+                results[i] = cached
+        # At most one check per worker is in flight, so a check starts when it is submitted and its deadline
+        # bounds its own run time, not its wait behind other checks.
+        pending = collections.deque()
+        while todo or pending:
+            while todo and len(pending) < self.processes:
+                i = todo.popleft()
+                pending.append((i, self._pool.apply_async(symbolic_equal, pairs[i]), time.monotonic() + self.timeout))
+            i, async_result, deadline = pending.popleft()
+            try:
+                results[i] = async_result.get(max(0.0, deadline - time.monotonic()))
+            except multiprocessing.TimeoutError:
+                logger.warning(f"Symbolic check timed out for {pairs[i]}.")
+                self.timeouts += 1
+                results[i] = False
+                # The stuck worker can't be interrupted; restart the pool and resubmit the checks it took down.
+                self._restart()
+                todo.extendleft(reversed([j for j, _, _ in pending]))
+                pending.clear()
+        for i, key in enumerate(keys):
+            self._store(key, results[i])
+        return results
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
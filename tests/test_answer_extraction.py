@@ -0,0 +1,38 @@
+import pytest
+from answer_extraction import EMPTY, MISSING, OK, UNBALANCED, extract_boxed, find_boxed, score_item, score_items
+from symbolic_equivalence import SymbolicChecker
+
+@pytest.mark.parametrize("response, expected", [
+    ("So $\\boxed{5}$.", ("5", OK)),
+    ("$\\boxed{\\frac{1}{2}}$ and more text", ("\\frac{1}{2}", OK)),
+    ("First \\boxed{1}, then \\boxed{2}.", ("2", OK)),
+    ("\\boxed{1} but finally \\fbox{3}", ("3", OK)),
+    ("Escaped braces: \\boxed{\\{1, 2\\}}", ("\\{1, 2\\}", OK)),
+    ("Short form: $\\boxed 7$", ("7", OK)),
+    ("\\boxed{ 4 }", ("4", OK)),
+    ("No answer here.", (None, MISSING)),
+    ("", (None, MISSING)),
+    (None, (None, MISSING)),
+    ("Cut off: \\boxed{\\frac{1}{", (None, UNBALANCED)),
+    ("Ends with \\boxed", (None, UNBALANCED)),
+    ("\\boxed{ }", (None, EMPTY)),
+])
+def test_find_boxed(response, expected):
+    assert find_boxed(response) == expected
+    assert extract_boxed(response) == expected[0]
+
+def test_score_item():
+    assert score_item(("a", "so \\boxed{\\dfrac{1}{2}}", "\\frac12")) == ("a", OK, "\\dfrac{1}{2}", True)
+    assert score_item(("b", "so \\boxed{3}", "4")) == ("b", OK, "3", False)
+    # No extracted answer is neither correct nor incorrect.
+    assert score_item(("c", "no answer", "4")) == ("c", MISSING, None, None)
+
+def test_score_items_pool_matches_serial():
+    items = [(i, f"so \\boxed{{{i % 3}}}", "1") for i in range(600)]
+    assert score_items(items, processes=2, chunksize=100) == score_items(items, processes=1)
+
+def test_score_items_symbolic_tier():
+    items = [("a", "\\boxed{2\\sqrt{2}}", "\\sqrt{8}"), ("b", "\\boxed{3.14159265358979}", "\\pi"), ("c", "none", "1")]
+    assert [result[3] for result in score_items(items, processes=1)] == [False, False, None]
+    with SymbolicChecker(processes=1) as symbolic:
+        assert [result[3] for result in score_items(items, processes=1, symbolic=symbolic)] == [True, False, None]
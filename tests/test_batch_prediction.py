@@ -0,0 +1,51 @@
+import json
+from backends import ReplayBackend
+from batch_prediction import LocalBatchBackend, prediction_record, read_predictions, request_record, run_batch
+from metrics import Metrics
+from model import VertexAI
+from response_cache import ResponseCache
+
+def write_lines(path, records):
+    with open(path, "w", encoding="utf-8") as fout:
+        for record in records:
+            fout.write(json.dumps(record) + "\n")
+
+def test_read_predictions(tmp_path):
+    config = {"temperature": 0.05}
+    ok = prediction_record(request_record("r0", "p0", config), "answer", {"input_tokens": 7, "output_tokens": 3})
+    no_usage = prediction_record(request_record("r1", "p1", config), "other")
+    failed = prediction_record(request_record("r2", "p2", config), error="quota exceeded")
+    # Services that drop the top-level id still carry it as a request label.
+    labelled = prediction_record(request_record("r3", "p3", config), "labelled")
+    del labelled["id"]
+    empty = {"id": "r4", "request": request_record("r4", "p4", config)["request"], "response": {"candidates": []}}
+    write_lines(tmp_path / "predictions.jsonl", [ok, no_usage, failed, labelled, empty])
+    assert read_predictions(str(tmp_path / "predictions.jsonl")) == {
+        "r0": ("answer", {"input_tokens": 7, "output_tokens": 3}),
+        "r1": ("other", None),
+        "r2": (None, None),
+        "r3": ("labelled", None),
+        "r4": (None, None),
+    }
+
+def test_local_batch_round_trip(tmp_path):
+    def respond(prompt, config):
+        if prompt == "bad":
+            raise ValueError("blocked")
+        return prompt.upper()
+    batch = LocalBatchBackend(ReplayBackend(responder=respond), root=str(tmp_path / "jobs"))
+    results = run_batch(batch, [("a", "one"), ("b", "bad"), ("c", "two")], {}, str(tmp_path / "work"), poll_interval=0.01)
+    assert results == {"a": ("ONE", None), "b": (None, None), "c": ("TWO", None)}
+
+def test_batch_generate_uses_and_fills_cache(tmp_path):
+    backend = ReplayBackend(responder=lambda prompt, config: prompt[::-1])
+    batch = LocalBatchBackend(backend, root=str(tmp_path / "jobs"))
+    cache = ResponseCache(str(tmp_path / "cache.sqlite"))
+    model = VertexAI(None, None, backend=backend, leader_backend=backend, cache=cache, metrics=Metrics())
+    workdir = str(tmp_path / "work")
+    assert model.batch_generate(["abc", "xyz"], batch, workdir=workdir, poll_interval=0.01) == ["cba", "zyx"]
+    assert backend.calls == 2
+    # A second model client over the same cache resubmits nothing.
+    model = VertexAI(None, None, backend=backend, leader_backend=backend, cache=cache, metrics=Metrics())
+    assert model.batch_generate(["abc", "xyz"], batch, workdir=workdir, poll_interval=0.01) == ["cba", "zyx"]
+    assert backend.calls == 2
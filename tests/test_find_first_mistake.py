@@ -0,0 +1,33 @@
+import pytest
+from backends import ReplayBackend
+from benchmark import stub_responder, synthetic_solutions
+from metrics import Metrics
+from model import VertexAI
+from rate_limiter import RateLimiter
+import find_first_mistake
+
+def make_model():
+    backend = ReplayBackend(responder=stub_responder(0.2))
+    return VertexAI(None, None, backend=backend, leader_backend=backend, metrics=Metrics(),
+                    rate_limiter=RateLimiter(requests_per_minute=float("inf")))
+
+def test_search_modes_are_exclusive():
+    assert find_first_mistake.parse_args(["--window", "4"]).window == 4
+    for argv in (["--window", "4", "--cascade"], ["--window", "4", "--vote"], ["--cascade", "--vote"],
+                 ["--bisect", "--window", "4"], ["--bisect", "--cascade"]):
+        with pytest.raises(SystemExit):
+            find_first_mistake.parse_args(argv)
+
+def test_window_mode_matches_per_step():
+    model = make_model()
+    for problem_sentences, solution_sentences in synthetic_solutions(3, 10):
+        expected, _ = find_first_mistake.test_find_first_mistake(model, problem_sentences, solution_sentences)
+        assert find_first_mistake.test_find_first_mistake(model, problem_sentences, solution_sentences,
+                                                          window=4)[0] == expected
+
+def test_bisect_mode_finds_first_mistake():
+    model = make_model()
+    for problem_sentences, solution_sentences in synthetic_solutions(3, 10):
+        expected, _ = find_first_mistake.test_find_first_mistake(model, problem_sentences, solution_sentences)
+        assert find_first_mistake.test_find_first_mistake(model, problem_sentences, solution_sentences,
+                                                          bisect=2)[0] == expected[:1]
@@ -0,0 +1,31 @@
+import json
+from import_legacy import import_legacy
+from results_store import ResultsStore
+
+def write_legacy(tmp_path, count):
+    solutions = tmp_path / "incorrect_solutions.jsonl"
+    with open(solutions, "w", encoding="utf-8") as fout:
+        for i in range(count):
+            fout.write(json.dumps({"problem": f"p{i}", "official_answer": "1", "model_answer": "2",
+                                   "model_response": f"Step {i}. So \\boxed{{2}}"}) + "\n")
+    # Written like the old prepare_baseline_prompt_2.py: solutions 1 and 2 after an offset of 1, where the
+    # second failed to segment.
+    sentences = tmp_path / "clean_sentences_2.txt"
+    with open(sentences, "w", encoding="utf-8") as fout:
+        fout.write("-" * 80 + "\np1\n" + "*" * 80 + "\nStep 1.\nSo 2.\n")
+        fout.write("-" * 80 + "\n" + "*" * 80 + "\n")
+    return str(solutions), str(sentences)
+
+def test_import_legacy(tmp_path):
+    solutions, sentences = write_legacy(tmp_path, 3)
+    store = ResultsStore(str(tmp_path / "results.sqlite"))
+    assert import_legacy(store, solutions, sentences, sentences_offset=1) == (3, 1)
+    generations = store.incorrect_generations()
+    assert [generation["problem"] for generation in generations] == ["p0", "p1", "p2"]
+    assert generations[1]["model_answer"] == "2"
+    segmented = store.segmented_generations()
+    assert segmented == [(generations[1]["generation_id"], ["p1"], ["Step 1.", "So 2."])]
+    # A second import adds nothing.
+    import_legacy(store, solutions, sentences, sentences_offset=1)
+    assert len(store.incorrect_generations()) == 3 and len(store.segmented_generations()) == 1
+    store.close()
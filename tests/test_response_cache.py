@@ -0,0 +1,80 @@
+import multiprocessing
+import sqlite3
+from backends import ReplayBackend
+from metrics import Metrics
+from model import VertexAI
+from response_cache import ResponseCache
+
+def test_size_is_shared_between_processes(tmp_path):
+    # Two caches on one file stand in for two shard workers.
+    path = str(tmp_path / "cache.sqlite")
+    first = ResponseCache(path, max_bytes=25)
+    second = ResponseCache(path, max_bytes=25)
+    first.put("a", "x" * 10)
+    second.put("b", "y" * 10)
+    assert first.stats()["bytes"] == 20
+    # Over the limit counting both writers' entries, so the oldest one goes.
+    first.put("c", "z" * 10)
+    assert second.get("a") is None
+    assert second.get("b") == "y" * 10
+    assert second.stats()["bytes"] == 20
+    first.close()
+    second.close()
+
+def test_hits_are_recorded_in_batches(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    cache = ResponseCache(path, touch_batch=2)
+    cache.put("a", "x")
+    cache.put("b", "y")
+
+    def last_used(key):
+        return cache._conn.execute("SELECT last_used FROM responses WHERE key = ?", (key,)).fetchone()[0]
+
+    before = last_used("a")
+    assert cache.get("a") == "x"
+    assert last_used("a") == before
+    assert cache.get("b") == "y"
+    assert last_used("a") > before
+    cache.close()
+
+def fill(path, worker, entries):
+    # One shard worker: writes its own entries and reads back everyone's.
+    cache = ResponseCache(path, max_bytes=2000, touch_batch=4)
+    for i in range(entries):
+        cache.put(f"{worker}-{i}", "x" * (10 + i % 7))
+        for other in range(4):
+            cache.get(f"{other}-{i}")
+    cache.close()
+
+def test_concurrent_workers_share_one_file(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    ResponseCache(path).close()
+    context = multiprocessing.get_context("spawn")
+    workers = [context.Process(target=fill, args=(path, worker, 100)) for worker in range(4)]
+    for process in workers:
+        process.start()
+    for process in workers:
+        process.join()
+    assert [process.exitcode for process in workers] == [0] * 4
+    cache = ResponseCache(path, max_bytes=2000)
+    total = cache._conn.execute("SELECT SUM(size) FROM responses").fetchone()[0]
+    # The stored size matches the entries, and eviction kept the file under the limit.
+    assert cache.stats()["bytes"] == total
+    assert 0 < total <= 2000
+    cache.close()
+
+class LockedCache(ResponseCache):
+
+    def get(self, key):
+        raise sqlite3.OperationalError("database is locked")
+
+    def put(self, key, response):
+        raise sqlite3.OperationalError("database is locked")
+
+def test_locked_cache_falls_through_to_model(tmp_path):
+    backend = ReplayBackend(model_name="cheap", responder=lambda prompt, config: "answer")
+    model = VertexAI(None, None, backend=backend, leader_backend=backend, metrics=Metrics(),
+                     cache=LockedCache(str(tmp_path / "cache.sqlite")))
+    assert model.generate("prompt") == "answer"
+    summary = model.metrics.summary()
+    assert sum(site.get("events", {}).get("cache_error", 0) for site in summary.values()) == 2
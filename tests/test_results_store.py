@@ -0,0 +1,51 @@
+from results_store import ResultsStore
+
+def make_shard(path, problems):
+    # 'problems' are (problem, position, response) triples; each gets a wrong generation, verdicts and a call.
+    store = ResultsStore(str(path))
+    for problem, position, response in problems:
+        problem_id = store.add_problem(problem, "1", position)
+        generation_id = store.add_generation(problem_id, "model", response, "2", False)
+        store.add_sentences(generation_id, [problem], response.split(". "))
+        store.add_verdicts(generation_id, "per_step", [
+            {"step": 0, "theorem": "t", "verdicts": ["restate"], "relation": "restate", "mistake": False},
+            {"step": 1, "theorem": "u", "verdicts": ["contradict"], "relation": "contradict", "mistake": True,
+             "confidence": 0.9},
+        ])
+        store.record_call("verify", "model", problem, 0.5, {"input_tokens": 10, "output_tokens": 2})
+    store.close()
+
+def count(store, table):
+    return store._query(f"SELECT COUNT(*) FROM {table}")[0][0]
+
+def test_add_is_idempotent(tmp_path):
+    store = ResultsStore(str(tmp_path / "results.sqlite"))
+    first = store.add_generation(store.add_problem("p", "1", 0), "model", "r")
+    second = store.add_generation(store.add_problem("p", "1", 0), "model", "r")
+    assert first == second
+    assert count(store, "problems") == 1 and count(store, "generations") == 1
+    store.close()
+
+def test_merge_shards(tmp_path):
+    make_shard(tmp_path / "a.sqlite", [("p0", 0, "One. Two"), ("p2", 2, "Five. Six")])
+    make_shard(tmp_path / "b.sqlite", [("p1", 1, "Three. Four")])
+    store = ResultsStore(str(tmp_path / "merged.sqlite"))
+    store.merge([str(tmp_path / "a.sqlite"), str(tmp_path / "b.sqlite")])
+    assert count(store, "model_calls") == 3
+    # Rows come back in problem order across shards.
+    generations = store.incorrect_generations()
+    assert [generation["problem"] for generation in generations] == ["p0", "p1", "p2"]
+    generation_id = generations[1]["generation_id"]
+    assert store.sentences(generation_id) == (["p1"], ["Three", "Four"])
+    assert store.mistakes(generation_id, "per_step") == [1]
+    assert [step["confidence"] for step in store.verdicts(generation_id, "per_step")] == [None, 0.9]
+    store.close()
+
+def test_merge_twice_adds_nothing(tmp_path):
+    make_shard(tmp_path / "a.sqlite", [("p0", 0, "One. Two")])
+    store = ResultsStore(str(tmp_path / "merged.sqlite"))
+    store.merge([str(tmp_path / "a.sqlite")])
+    store.merge([str(tmp_path / "a.sqlite")])
+    expected = {"problems": 1, "generations": 1, "sentences": 3, "verdicts": 2, "model_calls": 1}
+    assert {table: count(store, table) for table in expected} == expected
+    store.close()
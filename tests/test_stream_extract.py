@@ -0,0 +1,79 @@
+from backends import ReplayBackend, ResponseCapture
+from metrics import Metrics
+from model import VertexAI
+from response_cache import ResponseCache
+from stream_extract import ABORT, DONE, JsonBlockExtractor
+
+def feed_all(extractor, text, chunk_chars=5):
+    # Feeds 'text' in small chunks until the extractor decides, like model._astream.
+    for i in range(0, len(text), chunk_chars):
+        if extractor.feed(text[i:i + chunk_chars]) is not None:
+            break
+    return extractor.state
+
+def test_stops_at_first_valid_block():
+    text = 'Reasoning.\n```json\n{"verdict": "restate", "note": "a } in a string"}\n```\nTrailing text that is never read.'
+    extractor = JsonBlockExtractor()
+    assert feed_all(extractor, text) == DONE
+    assert extractor.value == {"verdict": "restate", "note": "a } in a string"}
+    assert extractor.result().endswith('"a } in a string"}\n```')
+    assert "Trailing" not in extractor.result()
+
+def test_skips_invalid_blocks():
+    text = '```json\n{"verdict": restate}\n```\n```json\n{"other": 1}\n```\n```json\n{"verdict": "contradict"}\n```'
+    extractor = JsonBlockExtractor(validate=lambda value: "verdict" in value)
+    assert feed_all(extractor, text) == DONE
+    assert extractor.value == {"verdict": "contradict"}
+
+def test_first_block_only_aborts_on_invalid_block():
+    text = '```json\n{"other": 1}\n```\n```json\n{"verdict": "contradict"}\n```'
+    extractor = JsonBlockExtractor(validate=lambda value: "verdict" in value, first_block_only=True)
+    assert feed_all(extractor, text) == ABORT
+
+def test_last_block_reads_whole_response():
+    text = 'Draft:\n```json\n{"verdict": "restate"}\n```\nOn reflection:\n```json\n{"verdict": "contradict"}\n```\nDone.'
+    extractor = JsonBlockExtractor(last_block=True)
+    assert feed_all(extractor, text) is None
+    assert extractor.value == {"verdict": "contradict"}
+    assert extractor.result() == text
+
+def test_runaway_response_aborts():
+    extractor = JsonBlockExtractor(max_chars=100)
+    assert feed_all(extractor, "no block here " * 20) == ABORT
+
+def test_reset_clears_state():
+    extractor = JsonBlockExtractor()
+    feed_all(extractor, '```json\n{"a": 1}\n```')
+    extractor.reset()
+    assert extractor.state is None and extractor.value is None and extractor.text == ""
+
+def test_model_stream_stops_at_block():
+    response = '```json\n{"verdict": "restate"}\n```\n' + "padding " * 200
+    backend = ReplayBackend(model_name="cheap", responder=lambda prompt, config: response)
+    model = VertexAI(None, None, backend=backend, leader_backend=ReplayBackend(model_name="leader"), metrics=Metrics())
+    extractor = JsonBlockExtractor()
+    text = model.generate("prompt", extractor=extractor)
+    assert extractor.state == DONE
+    assert text == '```json\n{"verdict": "restate"}\n```'
+    summary = model.metrics.summary()
+    assert sum(site.get("events", {}).get("stream_done", 0) for site in summary.values()) == 1
+    assert sum(site["calls"] for site in summary.values() if "calls" in site) == 1
+
+def test_truncated_stream_is_not_served_to_plain_requests(tmp_path):
+    response = '```json\n{"verdict": "restate"}\n```\n' + "padding " * 200
+    backend = ReplayBackend(model_name="cheap", responder=lambda prompt, config: response)
+    capture = ResponseCapture(str(tmp_path / "capture.jsonl"))
+    cache = ResponseCache(str(tmp_path / "cache.sqlite"))
+    model = VertexAI(None, None, backend=backend, leader_backend=backend, cache=cache, capture=capture, metrics=Metrics())
+    assert model.generate("prompt", extractor=JsonBlockExtractor()) == '```json\n{"verdict": "restate"}\n```'
+    assert model.generate("prompt") == response
+    assert backend.calls == 2
+    # Each mode's response is cached under its own key.
+    model = VertexAI(None, None, backend=backend, leader_backend=backend, cache=cache, metrics=Metrics())
+    assert model.generate("prompt", extractor=JsonBlockExtractor()) == '```json\n{"verdict": "restate"}\n```'
+    assert model.generate("prompt") == response
+    assert backend.calls == 2
+    capture.close()
+    # Only the complete response was captured.
+    assert ReplayBackend(str(tmp_path / "capture.jsonl")).generate("prompt", {}) == response
+    assert sum(1 for _ in open(tmp_path / "capture.jsonl", encoding="utf-8")) == 1
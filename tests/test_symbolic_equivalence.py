@@ -0,0 +1,74 @@
+import pytest
+from symbolic_equivalence import SymbolicChecker, latex_to_sympy, symbolic_equal
+
+@pytest.mark.parametrize("a, b", [
+    ("\\frac{1}{2}", "0.5"),
+    ("2\\sqrt{2}", "\\sqrt{8}"),
+    ("0.1+0.2", "0.3"),
+    ("\\frac{\\pi}{2}", "\\frac{1}{2}\\pi"),
+    ("(1,\\frac{1}{2})", "(1,0.5)"),
+    ("2x+2", "2(x+1)"),
+])
+def test_equal(a, b):
+    assert symbolic_equal(a, b)
+
+@pytest.mark.parametrize("a, b", [
+    # Large integers are compared exactly, not within a relative tolerance.
+    ("1000000000", "1000000001"),
+    # A decimal approximation isn't the exact value.
+    ("\\pi", "3.14159265358979"),
+    ("\\sqrt{2}", "1.4142135623731"),
+    # Words aren't products of symbols.
+    ("\\text{ab}", "\\text{ba}"),
+    ("\\text{no solution}", "\\text{solution no}"),
+    ("(1,2)", "(2,1)"),
+    ("(1,2)", "[1,2]"),
+    ("(1,2)", "(1,2,3)"),
+    ("1", "2"),
+])
+def test_not_equal(a, b):
+    assert not symbolic_equal(a, b)
+
+def test_unparseable_is_not_equal():
+    assert not symbolic_equal("\\frac{1", "\\frac{1}{2}")
+    assert not symbolic_equal("\\unknown{x}", "x")
+
+def test_text_with_words_is_rejected():
+    with pytest.raises(ValueError):
+        latex_to_sympy("\\text{ab}")
+    # Text without letters, e.g. units already stripped to a number, still converts.
+    assert latex_to_sympy("\\text{5}") == "5"
+
+def test_checker_pool_and_cache():
+    with SymbolicChecker(processes=1) as checker:
+        assert checker.check_many([("\\frac{1}{2}", "0.5"), ("\\pi", "3.14159265358979")]) == [True, False]
+        # Pairs are cached in either order.
+        assert checker.check("0.5", "\\frac{1}{2}")
+        assert len(checker._cache) == 2
+        assert checker.timeouts == 0
+
+@pytest.mark.parametrize("payload", [
+    "__import__('pathlib').Path({path!r}).touch()",
+    "open({path!r}, 'w')",
+    "().__class__.__base__.__subclasses__()",
+    "x.__class__",
+    "[1 for _ in 'a']",
+])
+def test_code_is_never_evaluated(tmp_path, payload):
+    # Answers are model output, and sympy's parse_expr runs eval on what latex_to_sympy returns.
+    path = str(tmp_path / "pwned")
+    payload = payload.format(path=path)
+    assert not symbolic_equal(payload, "1")
+    with pytest.raises(ValueError):
+        latex_to_sympy(payload)
+    assert not (tmp_path / "pwned").exists()
+
+def test_letter_runs_are_products_of_symbols():
+    assert latex_to_sympy("2xy+\\sin x") == "2x*y+ sin  x"
+    assert symbolic_equal("2xy", "2yx")
+
+def test_timeout_restarts_pool_and_finishes_the_rest():
+    pairs = [("9^{9^{9}}", "1")] + [(f"\\frac{{{n}}}{{2}}", f"{n / 2}") for n in range(6)]
+    with SymbolicChecker(processes=2, timeout=1.0) as checker:
+        assert checker.check_many(pairs) == [False] + [True] * 6
+        assert checker.timeouts == 1
@@ -0,0 +1,117 @@
+import asyncio
+import pytest
+from backends import ReplayBackend
+from benchmark import stub_responder, synthetic_solutions
+from metrics import Metrics
+from model import VertexAI
+from rate_limiter import RateLimiter
+import verification
+
+def test_cascade_accepts_settled_restate():
+    cascade = verification.Cascade()
+    assert cascade.decide([False]) is None
+    assert cascade.decide([False, False]) == ('accept', False)
+    assert verification.Cascade(agreement=1).decide([False]) == ('accept', False)
+
+def test_cascade_escalates_mistakes_unless_accepted():
+    assert verification.Cascade().decide([True, True]) == ('escalate', 'mistake')
+    assert verification.Cascade(confirm_mistakes=False).decide([True, True]) == ('accept', True)
+
+def test_cascade_escalates_unsettled_and_disagreement():
+    assert verification.Cascade().decide([None]) == ('escalate', 'unsettled')
+    assert verification.Cascade(max_unsettled=1).decide([None]) is None
+    cascade = verification.Cascade()
+    assert cascade.decide([False]) is None
+    assert cascade.decide([False, True]) == ('escalate', 'disagree')
+    assert cascade.decide([False, False]) == ('accept', False)
+
+def test_cascade_escalates_without_agreement():
+    cascade = verification.Cascade(cheap_attempts=3, agreement=2, max_unsettled=2)
+    assert cascade.decide([None, False]) is None
+    assert cascade.decide([None, False, None]) == ('escalate', 'no_agreement')
+
+def make_verifier(problem_sentences, solution_sentences, registry):
+    verifier = verification.VerifyCotTheorems(registry=registry)
+    verifier.problem_sentences = problem_sentences
+    verifier.solution_sentences = solution_sentences
+    verifier.all_sentences = problem_sentences + solution_sentences
+    return verifier
+
+def test_cascade_matches_leader_on_replay_stubs():
+    # With an exact cheap stub, the cascade finds the leader's mistakes and only asks the leader about them.
+    cheap = ReplayBackend(model_name="cheap", responder=stub_responder(0.2))
+    leader = ReplayBackend(model_name="leader", responder=stub_responder(0.2))
+    model = VertexAI(None, None, backend=cheap, leader_backend=leader, metrics=Metrics(),
+                     rate_limiter=RateLimiter(requests_per_minute=float("inf")))
+    for problem_sentences, solution_sentences in synthetic_solutions(3, 10):
+        expected = asyncio.run(make_verifier(problem_sentences, solution_sentences, Metrics())
+                               .afind_first_mistake(model.aleader_generate))
+        registry = Metrics()
+        verifier = make_verifier(problem_sentences, solution_sentences, registry)
+        assert asyncio.run(verifier.afind_first_mistake_cascade(model.agenerate, model.aleader_generate)) == expected
+        events = registry.summary()["cascade"]["events"]
+        # Two agreeing cheap attempts of two calls each per step.
+        assert events["cheap_calls"] == 4 * len(solution_sentences)
+        assert events.get("leader_calls", 0) == 2 * len(expected)
+
+def test_cascade_escalates_disagreeing_cheap_verdicts():
+    # A noisy cheap stub sometimes contradicts itself between attempts; those steps go to the leader.
+    cheap = ReplayBackend(model_name="cheap", responder=stub_responder(0.2, noise=0.3))
+    leader = ReplayBackend(model_name="leader", responder=stub_responder(0.2))
+    model = VertexAI(None, None, backend=cheap, leader_backend=leader, metrics=Metrics(),
+                     rate_limiter=RateLimiter(requests_per_minute=float("inf")))
+    registry = Metrics()
+    for problem_sentences, solution_sentences in synthetic_solutions(3, 10):
+        verifier = make_verifier(problem_sentences, solution_sentences, registry)
+        verifier.find_first_mistake_cascade(model.generate, model.leader_generate)
+    events = registry.summary()["cascade"]["events"]
+    assert events["escalate_disagree"] > 0
+    assert events["leader_calls"] >= 2 * events["escalate_disagree"]
+
+def test_vote_lead_and_decision():
+    vote = verification.SequentialVote(accuracy=0.9, error=0.05, max_samples=10)
+    # log(19) / log(9) rounds up to a lead of two votes.
+    assert vote.lead == 2
+    assert vote.decide(1, 0, 1) is None
+    assert vote.decide(2, 1, 3) is None
+    contradiction, confidence = vote.decide(0, 2, 2)
+    assert contradiction is False and confidence == pytest.approx(81 / 82)
+    assert vote.decide(3, 1, 4)[0] is True
+
+def test_vote_ties_and_unsettled_count_as_mistakes():
+    vote = verification.SequentialVote(max_samples=4)
+    assert vote.decide(2, 2, 4) == (True, 0.5)
+    assert vote.decide(0, 0, 4) == (True, 0.5)
+
+def test_vote_batch_size():
+    vote = verification.SequentialVote(max_samples=10)
+    assert vote.more(0, 0, 0) == 2
+    assert vote.more(1, 0, 1) == 1
+    assert vote.more(1, 1, 2) == 2
+    # Never more than the samples left.
+    assert vote.more(4, 4, 9) == 1
+
+def test_vote_probe():
+    vote = verification.SequentialVote()
+    assert vote.accept_probe(False) == (False, pytest.approx(0.9))
+    assert vote.accept_probe(None) is None
+    # Flagged steps are confirmed by the vote unless confirm_mistakes is off.
+    assert vote.accept_probe(True) is None
+    assert verification.SequentialVote(confirm_mistakes=False).accept_probe(True) == (True, pytest.approx(0.9))
+
+def test_voting_matches_per_step_on_replay_stubs():
+    # With an exact stub, every restate step is settled by its probe and every mistake by one more sample.
+    backend = ReplayBackend(responder=stub_responder(0.2))
+    model = VertexAI(None, None, backend=backend, leader_backend=backend, metrics=Metrics(),
+                     rate_limiter=RateLimiter(requests_per_minute=float("inf")))
+    for problem_sentences, solution_sentences in synthetic_solutions(3, 10):
+        expected = asyncio.run(make_verifier(problem_sentences, solution_sentences, Metrics())
+                               .afind_first_mistake(model.agenerate))
+        registry = Metrics()
+        verifier = make_verifier(problem_sentences, solution_sentences, registry)
+        assert asyncio.run(verifier.afind_first_mistake_voting(model.agenerate)) == expected
+        events = registry.summary()["vote"]["events"]
+        assert events["samples"] == len(solution_sentences) + len(expected)
+        assert events.get("contested_steps", 0) == len(expected)
+        confidences = [81 / 82 if verifier._sentence_number(i) in expected else 0.9 for i in range(len(solution_sentences))]
+        assert verifier.step_confidence == pytest.approx(confidences)
@@ -1,7 +1,14 @@
 import logging
 import re
 import json
+import asyncio
+import math
 from math_equivalence import is_equiv
+from answer_extraction import extract_boxed
+import metrics
+from context_cache import shared_prefix
+from stream_extract import JsonBlockExtractor
+from logger_setup import EXCHANGE
 
 MAX_STEPS = 100
 
@@ -15,34 +22,114 @@ class MatchAnswer:
     
     def evaluate_solution(self, problem, solution):
         answer_key = problem.get('answer', '').strip()
-        # Use regex to find the content inside \boxed{...}
-        match = re.search(r'\\boxed\{(.+?)\}', solution)
-        if match:
-            boxed_content = match.group(1).strip()
-            if is_equiv(boxed_content, answer_key):
-                return True
-            else:
-                return False
-        return False
+        # Brace-balanced content of the last \boxed{...}
+        boxed_content = extract_boxed(solution)
+        if boxed_content is None:
+            return False
+        return is_equiv(boxed_content, answer_key)
+
+class Cascade:
+    # Escalation policy of VerifyCotTheorems' cheap -> leader model cascade. A step gets up to 'cheap_attempts'
+    # attempts with the cheap model and is accepted once 'agreement' settled attempts agree. It escalates to the
+    # leader model when settled attempts disagree, when more than 'max_unsettled' attempts fail to parse, fail a
+    # rule or come back 'neither', when the cheap attempts run out without agreement, and, with
+    # 'confirm_mistakes', before accepting a cheap 'contradict' verdict. The defaults accept a step on two agreeing
+    # cheap 'restate' verdicts, so most steps cost two cheap per-step checks and steps where the cheap model is
+    # flagged, unsettled or inconsistent reach the leader. With agreement=1 disagreement can't happen, since a step
+    # is decided on its first settled verdict.
+
+    def __init__(self, cheap_attempts=3, agreement=2, max_unsettled=0, confirm_mistakes=True):
+        self.cheap_attempts = cheap_attempts
+        self.agreement = agreement
+        self.max_unsettled = max_unsettled
+        self.confirm_mistakes = confirm_mistakes
+
+    def decide(self, outcomes):
+        # 'outcomes' holds one entry per cheap attempt so far: None if it didn't settle, otherwise whether the
+        # step contradicts. Returns ('accept', contradiction), ('escalate', reason) or None to try again.
+        settled = [outcome for outcome in outcomes if outcome is not None]
+        if len(outcomes) - len(settled) > self.max_unsettled:
+            return 'escalate', 'unsettled'
+        if len(set(settled)) > 1:
+            return 'escalate', 'disagree'
+        if len(settled) >= self.agreement:
+            if settled[0] and self.confirm_mistakes:
+                return 'escalate', 'mistake'
+            return 'accept', settled[0]
+        if len(outcomes) >= self.cheap_attempts:
+            return 'escalate', 'no_agreement'
+
+class SequentialVote:
+    # Sequential probability ratio test over per-step verdict samples. Each settled sample is a vote for
+    # 'contradict' or 'restate' from a model assumed to be right with probability 'accuracy'. Voting stops once
+    # the likelihood ratio of the two outcomes passes (1 - error) / error, which means one outcome leads by
+    # 'lead' votes, or after 'max_samples' samples. Unsettled samples (unparsed, failed rules, 'neither')
+    # abstain. Samples are drawn at 'temperature', so they are closer to independent than the default low one.
+    # With 'probe', a step starts with one sample at the default low temperature, which costs what the per-step
+    # check costs. A settled 'restate' probe (or, without 'confirm_mistakes', any settled probe) decides the step
+    # with confidence 'accuracy'. Only unsettled probes and, with 'confirm_mistakes', 'contradict' probes go on
+    # to the vote, which counts the probe as its first sample, so flagged steps get the vote's confidence.
+
+    def __init__(self, accuracy=0.9, error=0.05, max_samples=10, temperature=0.7, probe=True, confirm_mistakes=True):
+        self.accuracy = accuracy
+        self.error = error
+        self.max_samples = max_samples
+        self.temperature = temperature
+        self.probe = probe
+        self.confirm_mistakes = confirm_mistakes
+        self.lead = math.ceil(math.log((1 - error) / error) / math.log(accuracy / (1 - accuracy)))
+
+    def confidence(self, contradict, restate):
+        # Posterior probability of the leading outcome, with equal priors.
+        return 1 / (1 + ((1 - self.accuracy) / self.accuracy) ** abs(contradict - restate))
+
+    def accept_probe(self, contradiction):
+        # Decision on the probe's vote (None if it didn't settle): (contradiction, confidence), or None to vote.
+        if contradiction is None or (contradiction and self.confirm_mistakes):
+            return
+        return contradiction, self.confidence(int(contradiction), int(not contradiction))
+
+    def decide(self, contradict, restate, samples):
+        # Returns (contradiction, confidence) once the test settles or the samples run out, None otherwise.
+        # Like the per-step check, a step that never settles counts as a mistake; so do ties.
+        if abs(contradict - restate) >= self.lead or samples >= self.max_samples:
+            return contradict >= restate, self.confidence(contradict, restate)
+
+    def more(self, contradict, restate, samples):
+        # Size of the next batch: just enough to settle the test if every new sample agrees with the leader.
+        return min(self.lead - abs(contradict - restate), self.max_samples - samples)
 
 class VerifyCotTheorems:
 
-    def __init__(self):
+    def __init__(self, splitter=None, prefix_stride=8, stream=False, registry=None):
+        # Optional segmentation.SentenceSplitter used instead of parse_text when it is confident.
+        self.splitter = splitter
+        # metrics.Metrics receiving parse failures and step, vote and cascade counters; pass the model client's
+        # (VertexAI.metrics) to keep one run's metrics together.
+        self.registry = registry if registry is not None else metrics.registry
+        # Steps are grouped in blocks of 'prefix_stride' that share one cacheable prompt prefix (see _stable_prefix).
+        self.prefix_stride = prefix_stride
+        # With stream=True the model callables must accept 'extractor' (like VertexAI.generate/agenerate):
+        # JSON-answer prompts are streamed and cut off once a valid block has arrived, or aborted early.
+        self.stream = stream
         self.problem_sentences = []
         self.solution_sentences = []
         self.all_sentences = []
         self.theorems_applied = []
         self.application_correctness = []
         self.application_relevance = []
+        # Posterior confidence in each step's outcome, set by the voting search.
+        self.step_confidence = []
 
     def parse_text(self, model, paragraph):
         instruction = (
             f"Place each sentence in the following text on its own line: \"{paragraph}\". "
             "Wrap your response with ```. "
         )
-        logger.info(f"Prompt: {instruction}")
-        response = model(instruction)
-        logger.info(f"Model's response: {response}")
+        logger.info(f"Prompt: {instruction}", extra=EXCHANGE)
+        with metrics.call_site("parse_text"):
+            response = model(instruction)
+        logger.info(f"Model's response: {response}", extra=EXCHANGE)
         if not response:
             logger.info("Doesn't get response from model.")
             return
@@ -50,20 +137,21 @@ class VerifyCotTheorems:
         end_index = response.rfind("```")
         if start_index == -1 or end_index == -1 or start_index == end_index:
             logger.info("Bad position(s) of ```.")
+            self.registry.count("parse_failure", "parse_text")
             return
         solution = response[start_index + 3:end_index].strip()
         sentences = solution.splitlines()
         return [sentence.strip() for sentence in sentences if sentence.strip()]
 
-    def cleanup_answer(self, model, problem, solution):
-        instruction = (
+    def _punctuate_prompt(self, solution):
+        return (
             f"Rewrite the solution by embedding each equation in a complete sentence: \"{solution}\". "
             "Do not correct the solution, omit parts of the solution, or add to the solution. "
             "Wrap your response with ```. "
         ) 
-        logger.info(f"Prompt sent to the model: {instruction}")
-        response = model(instruction)
-        logger.info(f"Model's response: {response}")
+
+    def _parse_punctuated(self, response):
+        logger.info(f"Model's response: {response}", extra=EXCHANGE)
         if not response:
             logger.info("Doesn't get response from model.")
             return
@@ -71,49 +159,584 @@ class VerifyCotTheorems:
         end_index = response.rfind("```")
         if start_index == -1 or end_index == -1 or start_index >= end_index:
             logger.info("Bad position(s) of ```.")
+            self.registry.count("parse_failure", "punctuate")
             return
-        punctuated_solution = response[start_index + 3:end_index].strip()
+        return response[start_index + 3:end_index].strip()
+
+    def punctuate(self, model, solution):
+        # Rewrite the solution so every equation is embedded in a complete sentence.
+        instruction = self._punctuate_prompt(solution)
+        logger.info(f"Prompt sent to the model: {instruction}", extra=EXCHANGE)
+        with metrics.call_site("punctuate"):
+            response = model(instruction)
+        return self._parse_punctuated(response)
+
+    async def apunctuate(self, amodel, solution):
+        instruction = self._punctuate_prompt(solution)
+        logger.info(f"Prompt sent to the model: {instruction}", extra=EXCHANGE)
+        with metrics.call_site("punctuate"):
+            response = await amodel(instruction)
+        return self._parse_punctuated(response)
+
+    def split_text(self, model, paragraph, local_split=None):
+        # 'local_split' is a precomputed (sentences, confident) pair, e.g. from SentenceSplitter.split_many.
+        if local_split is None and self.splitter is not None:
+            local_split = self.splitter.split(paragraph)
+        if local_split is not None:
+            sentences, confident = local_split
+            if confident:
+                return sentences
+            logger.info("Local sentence splitter is not confident, falling back to the model.")
+        return self.parse_text(model, paragraph)
+
+    def segment(self, model, problem, punctuated_solution, problem_split=None, solution_split=None):
         # Parse solution into list of sentences.
         logger.info("Parsing problem statement. ")
-        problem_sentences = self.parse_text(model, problem)
+        problem_sentences = self.split_text(model, problem, problem_split)
         self.problem_sentences = problem_sentences
         logger.info(f"Parsing solution. ")
-        solution_sentences = self.parse_text(model, punctuated_solution)
+        solution_sentences = self.split_text(model, punctuated_solution, solution_split)
         self.solution_sentences = solution_sentences
         self.all_sentences = problem_sentences + solution_sentences
 
-    def find_first_mistake(self, model):
+    def cleanup_answer(self, model, problem, solution):
+        punctuated_solution = self.punctuate(model, solution)
+        if punctuated_solution is None:
+            return
+        self.segment(model, problem, punctuated_solution)
+
+    def _reset_results(self):
         n = len(self.solution_sentences)
         self.theorems_applied = [[] for _ in range(n)]
         self.application_correctness = [[] for _ in range(n)]
         self.application_relevance = [""] * n
+        self.step_confidence = [None] * n
+
+    def _sentence_number(self, index):
+        return index + len(self.problem_sentences) + 1
+
+    def _attempt_settled(self, index):
+        # Returns (settled, contradiction) for the latest name_theorem/check_application attempt.
+        got_verdicts = bool(self.application_correctness[index])
+        all_correct = got_verdicts and all(self.application_correctness[index])
+        relation = self.application_relevance[index]
+        if got_verdicts:
+            if all_correct and relation != 'neither':
+                return True, relation == 'contradict'
+            else:
+                logger.info(f"Not all correct or relation='neither'")
+        else:
+            logger.info(f"No verdicts")
+        return False, False
+
+    def _record_attempts(self, attempts):
+        # Attempts beyond the first are the retries a step burned before it settled (or gave up).
+        self.registry.count("steps", "check_step")
+        self.registry.count("step_retries", "check_step", attempts - 1)
+
+    def _check_step(self, index, model):
+        # A step is a mistake if it is shown to contradict the previous sentences or never gets an acceptable verdict.
+        logger.info(f"Checking {self._sentence_number(index)}.")
+        for attempt in range(1, 11):
+            self.name_theorem(index, model)
+            self.check_application(index, model)
+            settled, contradiction = self._attempt_settled(index)
+            if settled:
+                self._record_attempts(attempt)
+                return contradiction
+        self._record_attempts(attempt)
+        return True
+
+    async def _acheck_step(self, index, amodel):
+        logger.info(f"Checking {self._sentence_number(index)}.")
+        for attempt in range(1, 11):
+            await self.aname_theorem(index, amodel)
+            await self.acheck_application(index, amodel)
+            settled, contradiction = self._attempt_settled(index)
+            if settled:
+                self._record_attempts(attempt)
+                return contradiction
+        self._record_attempts(attempt)
+        return True
+
+    def find_first_mistake(self, model):
+        self._reset_results()
         result = []
         for i in range(min(len(self.solution_sentences), MAX_STEPS)):
-            logger.info(f"Checking {i + len(self.problem_sentences) + 1}.")
-            for attempt in range(1, 11):
-                self.name_theorem(i, model)
-                self.check_application(i, model)
-                got_verdicts = bool(self.application_correctness[i])
-                all_correct = got_verdicts and all(self.application_correctness[i])
-                relation = self.application_relevance[i]
-                if got_verdicts:
-                    if all_correct and relation != 'neither':
-                        if relation == 'contradict':
-                            result.append(i + len(self.problem_sentences) + 1)
-                        break
-                    else:
-                        logger.info(f"Not all correct or relation='neither'")
+            if self._check_step(i, model):
+                result.append(self._sentence_number(i))
+        return result
+
+    async def _astep_mistakes(self, index, amodel):
+        return [index] if await self._acheck_step(index, amodel) else []
+
+    async def _collect_mistakes(self, checks, first_only):
+        # 'checks' maps the first step index of each check to a coroutine returning the indices of its mistaken
+        # steps. With first_only, checks starting after a confirmed mistake are cancelled.
+        tasks = {asyncio.create_task(check): start for start, check in checks.items()}
+        pending = set(tasks)
+        mistakes = []
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.cancelled() or not task.result():
+                        continue
+                    mistakes.extend(task.result())
+                    if first_only:
+                        for later in pending:
+                            if tasks[later] > tasks[task]:
+                                later.cancel()
+        finally:
+            for task in pending:
+                task.cancel()
+        mistakes.sort()
+        if first_only:
+            mistakes = mistakes[:1]
+        return [self._sentence_number(i) for i in mistakes]
+
+    async def afind_first_mistake(self, amodel, first_only=False):
+        # Each step only conditions on the fixed prefix all_sentences[:n], so all steps are checked concurrently.
+        # With first_only, checks of later steps are cancelled once an earlier step is confirmed as a mistake.
+        self._reset_results()
+        steps = range(min(len(self.solution_sentences), MAX_STEPS))
+        return await self._collect_mistakes({i: self._astep_mistakes(i, amodel) for i in steps}, first_only)
+
+    def step_records(self, mistakes):
+        # Per-step results of the last search, for results_store.ResultsStore.add_verdicts: every step that got
+        # a verdict or is in 'mistakes' (sentence numbers, as returned by the find_first_mistake methods).
+        records = []
+        for index in range(len(self.solution_sentences)):
+            step = self._sentence_number(index)
+            verdicts = self.application_correctness[index] if index < len(self.application_correctness) else []
+            if not verdicts and step not in mistakes:
+                continue
+            records.append({
+                "step": step,
+                "theorem": self.theorems_applied[index] or None,
+                "verdicts": verdicts,
+                "relation": self.application_relevance[index] or None,
+                "mistake": step in mistakes,
+                "confidence": self.step_confidence[index] if index < len(self.step_confidence) else None,
+            })
+        return records
+
+    def _vote(self, verdicts, relation):
+        # True for 'contradict', False for 'restate', None if the sample doesn't settle the step.
+        if verdicts and all(verdicts) and relation in ('restate', 'contradict'):
+            return relation == 'contradict'
+
+    async def _asample_step(self, index, amodel):
+        # One independent name_theorem + check_application sample that leaves the stored results alone:
+        # (proof, verdicts, relation), or None if an answer doesn't parse. Unparsed answers aren't retried.
+        prefix = self._stable_prefix(index)
+        with metrics.call_site("name_theorem"), shared_prefix(prefix):
+            response = await self._request(amodel, self._name_theorem_prompt(index), self._valid_theorem)
+        proof = self._parse_theorem(response)
+        if proof is None:
+            return
+        prompt = self._check_application_prompt(index, proof)
+        with metrics.call_site("check_application"), shared_prefix(prefix):
+            response = await self._request(amodel, prompt, self._valid_application, first_block_only=True)
+        verdicts, relation = self._parse_application(response)
+        if relation is None:
+            if response:
+                self.registry.count("parse_failure", "check_application")
+            return
+        return proof, verdicts, relation
+
+    async def _avote_step(self, index, amodel, sampler, vote):
+        # Draws samples ('sampler' answers at the vote's temperature) in parallel batches until 'vote' settles the
+        # step, keeps a sample that agrees with the outcome as the step's result and returns whether the step is
+        # a mistake. With vote.probe the first sample is a single low-temperature one from 'amodel'.
+        logger.info(f"Voting on {self._sentence_number(index)}.")
+        samples = []
+        contradict = restate = 0
+        decision = None
+        if vote.probe:
+            samples.append(await self._asample_step(index, amodel))
+            probe = self._vote(samples[0][1], samples[0][2]) if samples[0] is not None else None
+            contradict, restate = int(probe is True), int(probe is False)
+            decision = vote.accept_probe(probe)
+        while decision is None:
+            batch = vote.more(contradict, restate, len(samples))
+            samples += await asyncio.gather(*(self._asample_step(index, sampler) for _ in range(batch)))
+            votes = [self._vote(sample[1], sample[2]) for sample in samples if sample is not None]
+            contradict, restate = votes.count(True), votes.count(False)
+            decision = vote.decide(contradict, restate, len(samples))
+        contradiction, confidence = decision
+        self.step_confidence[index] = confidence
+        for sample in samples:
+            if sample is not None and self._vote(sample[1], sample[2]) == contradiction:
+                self.theorems_applied[index], self.application_correctness[index], self.application_relevance[index] = sample
+                break
+        self.registry.count("steps", "vote")
+        self.registry.count("samples", "vote", len(samples))
+        if len(samples) > (1 if vote.probe else vote.lead):
+            self.registry.count("contested_steps", "vote")
+        logger.info(f"Vote on {self._sentence_number(index)}: {contradict} contradict, {restate} restate, "
+                    f"{len(samples)} samples, confidence {confidence:.3f}.")
+        return contradiction
+
+    async def _astep_mistakes_voting(self, index, amodel, sampler, vote):
+        return [index] if await self._avote_step(index, amodel, sampler, vote) else []
+
+    async def afind_first_mistake_voting(self, amodel, vote=None, first_only=False):
+        # Same result format as afind_first_mistake. Each step is decided by a SequentialVote over independent
+        # samples drawn in parallel, and only unsettled or contested steps draw more than one. step_confidence (and
+        # step_records) hold the confidence of every decided step. With a 'temperature', 'amodel' must accept
+        # 'low_temp' like VertexAI.agenerate.
+        vote = vote if vote is not None else SequentialVote()
+        def sampler(prompt, **kwargs):
+            if vote.temperature is not None:
+                kwargs["low_temp"] = vote.temperature
+            return amodel(prompt, **kwargs)
+        self._reset_results()
+        steps = range(min(len(self.solution_sentences), MAX_STEPS))
+        return await self._collect_mistakes({i: self._astep_mistakes_voting(i, amodel, sampler, vote) for i in steps}, first_only)
+
+    def _windows(self, window):
+        steps = min(len(self.solution_sentences), MAX_STEPS)
+        return [list(range(start, min(start + window, steps))) for start in range(0, steps, window)]
+
+    def _window_prompt(self, indices):
+        n = len(self.problem_sentences) + indices[0]
+        progress = ' '.join(f"{s}" for s in self.all_sentences[:n])
+        steps = ' '.join(f"({j + 1}) \"{self.all_sentences[n + j]}\"" for j in range(len(indices)))
+        return (
+            f"{progress} Now, let's verify each of the following {len(indices)} sentences in order, assuming only "
+            f"the sentences before it: {steps}. For each sentence: 1. prove or disprove exactly that sentence by "
+            "applying one theorem/logical rule a time; 2. check each rule n is a rigorous theorem, that all its "
+            "premises are fulfilled, and that it implies conclusion n; 3. check if the last conclusion restates or "
+            "contradicts the sentence. Reason using natural language before outputing ONE JSON array with one object "
+            "per sentence, in order, of the form "
+            "\"```json[{\"proof\": {\"rule 1\": theorem/logical axiom applied, \"conclusion 1\": conclusion obtained, ... }, "
+            "\"rule 1\": true or false, ... \"relation\": 'restate'/'contradict'/'neither' }, ...]```\" "
+            "or go to jail for failing."
+        )
+
+    def _parse_window(self, response, size):
+        # Returns one (proof, verdicts, relation) per sentence, or None if the response doesn't validate.
+        if not response:
+            logger.info("Doesn't receive model response for the window.")
+            return
+        matches = re.findall(r"```json\s*(\[.*?\])\s*```", response, re.DOTALL)
+        if not matches:
+            logger.info("JSON array not in response.")
+            self.registry.count("parse_failure", "check_window")
+            return
+        try:
+            parsed_response = json.loads(matches[-1])
+        except json.JSONDecodeError:
+            logger.info("Failed to parse JSON from LLM response.")
+            self.registry.count("parse_failure", "check_window")
+            return
+        if not isinstance(parsed_response, list) or len(parsed_response) != size:
+            logger.info(f"Expected a JSON array of {size} objects.")
+            self.registry.count("parse_failure", "check_window")
+            return
+        results = []
+        for entry in parsed_response:
+            if not isinstance(entry, dict):
+                return
+            verdicts = self._rule_verdicts(entry)
+            relation = entry.get('relation')
+            if not verdicts or relation not in ['restate', 'contradict', 'neither']:
+                logger.info(f"Window entry not properly formatted: {entry}")
+                self.registry.count("parse_failure", "check_window")
+                return
+            results.append((json.dumps(entry.get('proof', {}), ensure_ascii=False), verdicts, relation))
+        logger.info(f"Model's response: {response}", extra=EXCHANGE)
+        return results
+
+    def _settle_window(self, indices, results):
+        # Stores the window's verdicts and returns (mistakes, unsettled) step indices; unsettled steps, and all
+        # steps of a window whose output never validated, go through the per-step check.
+        if results is None:
+            self.registry.count("window_fallback", "check_window")
+            return [], indices
+        mistakes, unsettled = [], []
+        for index, (proof, verdicts, relation) in zip(indices, results):
+            self.theorems_applied[index] = proof
+            self.application_correctness[index] = verdicts
+            self.application_relevance[index] = relation
+            settled, contradiction = self._attempt_settled(index)
+            if not settled:
+                unsettled.append(index)
+            elif contradiction:
+                mistakes.append(index)
+        self.registry.count("unsettled_steps", "check_window", len(unsettled))
+        return mistakes, unsettled
+
+    def _check_window(self, indices, model):
+        prompt = self._window_prompt(indices)
+        prefix = self._stable_prefix(indices[0])
+        logger.info(f"Prompt: {prompt}", extra=EXCHANGE)
+        results = None
+        for i in range(3):
+            with metrics.call_site("check_window"), shared_prefix(prefix):
+                response = self._request(model, prompt, self._valid_window(len(indices)))
+            results = self._parse_window(response, len(indices))
+            if results is not None:
+                break
+        mistakes, unsettled = self._settle_window(indices, results)
+        mistakes += [index for index in unsettled if self._check_step(index, model)]
+        return sorted(mistakes)
+
+    async def _acheck_window(self, indices, amodel):
+        prompt = self._window_prompt(indices)
+        prefix = self._stable_prefix(indices[0])
+        logger.info(f"Prompt: {prompt}", extra=EXCHANGE)
+        results = None
+        for i in range(3):
+            with metrics.call_site("check_window"), shared_prefix(prefix):
+                response = await self._request(amodel, prompt, self._valid_window(len(indices)))
+            results = self._parse_window(response, len(indices))
+            if results is not None:
+                break
+        mistakes, unsettled = self._settle_window(indices, results)
+        for index in unsettled:
+            if await self._acheck_step(index, amodel):
+                mistakes.append(index)
+        return sorted(mistakes)
+
+    def find_first_mistake_windowed(self, model, window=4):
+        # Same result as find_first_mistake, but one call proves and checks 'window' consecutive steps.
+        self._reset_results()
+        result = []
+        for indices in self._windows(window):
+            result += [self._sentence_number(i) for i in self._check_window(indices, model)]
+        return result
+
+    async def afind_first_mistake_windowed(self, amodel, window=4, first_only=False):
+        self._reset_results()
+        checks = {indices[0]: self._acheck_window(indices, amodel) for indices in self._windows(window)}
+        return await self._collect_mistakes(checks, first_only)
+
+    def _prefix_check_prompt(self, start, k):
+        n = len(self.problem_sentences) + k
+        progress = ' '.join(f"{s}" for s in self.all_sentences[:n])
+        return (
+            f"{progress} Now, let's check whether the solution so far is correct: decide if every sentence from "
+            f"\"{self.solution_sentences[start]}\" to \"{self.all_sentences[n-1]}\" follows from the sentences before it. "
+            "Reason using natural language before outputing ONE JSON object of the form "
+            "\"```json{\"consistent\": true or false}```\" or go to jail for failing."
+        )
+
+    def _parse_prefix_check(self, response):
+        # True/False for the 'consistent' field, or None if the response doesn't contain it.
+        if not response:
+            logger.info("Doesn't receive model response for the prefix check.")
+            return
+        matches = re.findall(r"```json\s*(\{.*?\})\s*```", response, re.DOTALL)
+        try:
+            consistent = json.loads(matches[-1]).get('consistent') if matches else None
+        except (json.JSONDecodeError, AttributeError):
+            consistent = None
+        if not isinstance(consistent, bool):
+            logger.info("'consistent' field not in response.")
+            self.registry.count("parse_failure", "check_prefix")
+            return
+        logger.info(f"Model's response: {response}", extra=EXCHANGE)
+        return consistent
+
+    def _prefix_checks(self, steps, span):
+        # Bisection for the first mistaken step. The generator yields ('prefix', lo, k) for "do steps lo..k-1 follow
+        # from the sentences before them?" and is sent the answer. It yields ('range', lo, hi) once the first mistake
+        # is narrowed down to steps lo..hi-1, and is sent True if the per-step checks found it there. Unanswerable
+        # prefix checks count as inconsistent, which only moves more steps into the per-step range.
+        lo, hi = 0, steps
+        if (yield ('prefix', 0, steps)):
+            return
+        while lo < steps:
+            while hi - lo > span:
+                mid = (lo + hi) // 2
+                if (yield ('prefix', lo, mid)):
+                    lo = mid
                 else:
-                    logger.info(f"No verdicts")
-            else:
-                result.append(i + len(self.problem_sentences) + 1)
+                    hi = mid
+            if (yield ('range', lo, hi)):
+                return
+            # The prefix checks were wrong about steps lo..hi-1; bisect the remaining steps, assuming (as the
+            # first check said) that they still contain a mistake.
+            self.registry.count("false_alarm", "check_prefix")
+            lo, hi = hi, steps
+
+    def _check_prefix(self, start, k, model):
+        prompt = self._prefix_check_prompt(start, k)
+        logger.info(f"Prompt: {prompt}", extra=EXCHANGE)
+        for i in range(5):
+            with metrics.call_site("check_prefix"), shared_prefix(self._stable_prefix(k - 1)):
+                response = self._request(model, prompt, self._valid_prefix_check)
+            consistent = self._parse_prefix_check(response)
+            if consistent is not None:
+                return consistent
+        return False
+
+    async def _acheck_prefix(self, start, k, amodel):
+        prompt = self._prefix_check_prompt(start, k)
+        logger.info(f"Prompt: {prompt}", extra=EXCHANGE)
+        for i in range(5):
+            with metrics.call_site("check_prefix"), shared_prefix(self._stable_prefix(k - 1)):
+                response = await self._request(amodel, prompt, self._valid_prefix_check)
+            consistent = self._parse_prefix_check(response)
+            if consistent is not None:
+                return consistent
+        return False
+
+    def find_first_mistake_bisect(self, model, span=2):
+        # Returns [number of the first mistaken sentence] or []. Cheap prefix checks bisect the solution down to
+        # at most 'span' candidate steps, and only those get the full per-step check: O(log N) calls instead of O(N).
+        self._reset_results()
+        steps = min(len(self.solution_sentences), MAX_STEPS)
+        if steps == 0:
+            return []
+        search = self._prefix_checks(steps, span)
+        request = next(search)
+        try:
+            while True:
+                kind, lo, hi = request
+                if kind == 'range':
+                    mistake = next((i for i in range(lo, hi) if self._check_step(i, model)), None)
+                    if mistake is not None:
+                        return [self._sentence_number(mistake)]
+                    request = search.send(False)
+                else:
+                    request = search.send(self._check_prefix(lo, hi, model))
+        except StopIteration:
+            return []
+
+    async def afind_first_mistake_bisect(self, amodel, span=2):
+        # The candidate steps of each narrowed range are checked concurrently.
+        self._reset_results()
+        steps = min(len(self.solution_sentences), MAX_STEPS)
+        if steps == 0:
+            return []
+        search = self._prefix_checks(steps, span)
+        request = next(search)
+        try:
+            while True:
+                kind, lo, hi = request
+                if kind == 'range':
+                    checks = {i: self._astep_mistakes(i, amodel) for i in range(lo, hi)}
+                    mistakes = await self._collect_mistakes(checks, first_only=True)
+                    if mistakes:
+                        return mistakes
+                    request = search.send(False)
+                else:
+                    request = search.send(await self._acheck_prefix(lo, hi, amodel))
+        except StopIteration:
+            return []
+
+    def _tier(self, model, tier):
+        # Wraps a model callable to count its calls per cascade tier ('cheap' or 'leader').
+        def call(prompt, **kwargs):
+            self.registry.count(f"{tier}_calls", "cascade")
+            return model(prompt, **kwargs)
+        return call
+
+    def _cascade_decided(self, index, decision):
+        # Returns the accepted verdict, or None if the step escalates to the leader model.
+        kind, value = decision
+        self.registry.count("steps", "cascade")
+        if kind == 'accept':
+            return value
+        logger.info(f"Escalating {self._sentence_number(index)} to the leader model ({value}).")
+        self.registry.count("escalations", "cascade")
+        self.registry.count(f"escalate_{value}", "cascade")
+
+    def _check_step_cascade(self, index, model, leader, cascade):
+        logger.info(f"Checking {self._sentence_number(index)} with the cheap model.")
+        cheap = self._tier(model, "cheap")
+        outcomes = []
+        decision = None
+        while decision is None:
+            self.name_theorem(index, cheap)
+            self.check_application(index, cheap)
+            settled, contradiction = self._attempt_settled(index)
+            outcomes.append(contradiction if settled else None)
+            decision = cascade.decide(outcomes)
+        verdict = self._cascade_decided(index, decision)
+        if verdict is not None:
+            return verdict
+        return self._check_step(index, self._tier(leader, "leader"))
+
+    async def _acheck_step_cascade(self, index, amodel, aleader, cascade):
+        logger.info(f"Checking {self._sentence_number(index)} with the cheap model.")
+        cheap = self._tier(amodel, "cheap")
+        outcomes = []
+        decision = None
+        while decision is None:
+            await self.aname_theorem(index, cheap)
+            await self.acheck_application(index, cheap)
+            settled, contradiction = self._attempt_settled(index)
+            outcomes.append(contradiction if settled else None)
+            decision = cascade.decide(outcomes)
+        verdict = self._cascade_decided(index, decision)
+        if verdict is not None:
+            return verdict
+        return await self._acheck_step(index, self._tier(aleader, "leader"))
+
+    def find_first_mistake_cascade(self, model, leader, cascade=None):
+        # Same result format as find_first_mistake. Steps are checked with 'model' (e.g. VertexAI.generate) and
+        # only escalated to 'leader' (e.g. VertexAI.leader_generate) as decided by 'cascade' (a Cascade).
+        # The 'cascade' metrics site counts the calls per tier and the escalations by reason.
+        cascade = cascade if cascade is not None else Cascade()
+        self._reset_results()
+        result = []
+        for i in range(min(len(self.solution_sentences), MAX_STEPS)):
+            if self._check_step_cascade(i, model, leader, cascade):
+                result.append(self._sentence_number(i))
         return result
 
-    def name_theorem(self, index, model):
-        # Identify premises and theorem(s) used in the sentence.
+    async def _astep_mistakes_cascade(self, index, amodel, aleader, cascade):
+        return [index] if await self._acheck_step_cascade(index, amodel, aleader, cascade) else []
+
+    async def afind_first_mistake_cascade(self, amodel, aleader, cascade=None, first_only=False):
+        # Steps are checked concurrently, as in afind_first_mistake.
+        cascade = cascade if cascade is not None else Cascade()
+        self._reset_results()
+        steps = range(min(len(self.solution_sentences), MAX_STEPS))
+        checks = {i: self._astep_mistakes_cascade(i, amodel, aleader, cascade) for i in steps}
+        return await self._collect_mistakes(checks, first_only)
+
+    def _request(self, model, prompt, validate, first_block_only=False):
+        # Returns model(prompt), or its coroutine for async models. Streams are only cut off after the first
+        # valid block for parsers that read the first block (first_block_only); the others read the last one,
+        # so their streams run to the end and both paths parse the same block.
+        if not self.stream:
+            return model(prompt)
+        return model(prompt, extractor=JsonBlockExtractor(validate, first_block_only, last_block=not first_block_only))
+
+    def _valid_theorem(self, value):
+        return isinstance(value, dict) and bool(value)
+
+    def _valid_application(self, value):
+        return (isinstance(value, dict) and bool(self._rule_verdicts(value))
+                and value.get('relation') in ['restate', 'contradict', 'neither'])
+
+    def _valid_window(self, size):
+        return lambda value: isinstance(value, list) and len(value) == size and all(self._valid_application(v) for v in value)
+
+    def _valid_prefix_check(self, value):
+        return isinstance(value, dict) and isinstance(value.get('consistent'), bool)
+
+    def _stable_prefix(self, index):
+        # The step prompts start with all sentences before the step, so every step of a block of prefix_stride
+        # steps (and all of their retries) starts with the sentences before the block. A ContextCache given to
+        # the model client can serve this text from a provider-side cache instead of resending it.
+        # Late in a block the block's prefix covers less and less of the prompt; once it is under half of the
+        # sentences before the step, the step's prompts share those sentences instead, so the prefix stays long
+        # enough to reach the provider's minimum context size whenever the step's own text does.
+        n = len(self.problem_sentences) + index - index % self.prefix_stride
+        block = ' '.join(f"{s}" for s in self.all_sentences[:n])
+        before = ' '.join(f"{s}" for s in self.all_sentences[:len(self.problem_sentences) + index])
+        return before if 2 * len(block) < len(before) else block
+
+    def _name_theorem_prompt(self, index):
         n = len(self.problem_sentences) + index + 1 
         progress = ' '.join(f"{s}" for s in self.all_sentences[:n])
-        prompt = (
+        return (
             f"{progress} Now, let's: 1. prove or disprove exactly the previous sentence by applying one theorem/logical rule a time; "
             "2. clean up the proof and output ONE JSON object of the form "
             "\"```json{\"rule 1\": theorem/logical axiom applied, \"conclusion 1\": conclusion obtained, ... }```\". "
@@ -121,69 +744,129 @@ class VerifyCotTheorems:
             "Reason using natural language before outputing ONE JSON object or go to jail for failing. "
             "For suppositions, prove or disprove it doesn't contradict previous sentences or go to jail for failing. "
         ) 
-        logger.info(f"Prompt: {prompt}")
-        for i in range(5):
-            response = model(prompt)
-            if not response:
-                logger.warning("Doesn't get response from model.")
-                continue
-            json_pattern = re.compile(r"```json\s*(\{.*?\})\s*```", re.DOTALL)
-            matches = json_pattern.findall(response)
-            if not matches:
-                logger.warning("JSON not in response.")
-                continue
-            match = matches[-1]
-            logger.info(f"Response: {response}")
-            self.theorems_applied[index] = match
+
+    def _parse_theorem(self, response):
+        if not response:
+            logger.warning("Doesn't get response from model.")
             return
+        json_pattern = re.compile(r"```json\s*(\{.*?\})\s*```", re.DOTALL)
+        matches = json_pattern.findall(response)
+        if not matches:
+            logger.warning("JSON not in response.")
+            self.registry.count("parse_failure", "name_theorem")
+            return
+        logger.info(f"Response: {response}", extra=EXCHANGE)
+        return matches[-1]
 
- 
-    def check_application(self, index, model):
+    def name_theorem(self, index, model):
+        # Identify premises and theorem(s) used in the sentence.
+        prompt = self._name_theorem_prompt(index)
+        prefix = self._stable_prefix(index)
+        logger.info(f"Prompt: {prompt}", extra=EXCHANGE)
+        for i in range(5):
+            with metrics.call_site("name_theorem"), shared_prefix(prefix):
+                response = self._request(model, prompt, self._valid_theorem)
+            match = self._parse_theorem(response)
+            if match is not None:
+                self.theorems_applied[index] = match
+                return
+
+    async def aname_theorem(self, index, amodel):
+        prompt = self._name_theorem_prompt(index)
+        prefix = self._stable_prefix(index)
+        logger.info(f"Prompt: {prompt}", extra=EXCHANGE)
+        for i in range(5):
+            with metrics.call_site("name_theorem"), shared_prefix(prefix):
+                response = await self._request(amodel, prompt, self._valid_theorem)
+            match = self._parse_theorem(response)
+            if match is not None:
+                self.theorems_applied[index] = match
+                return
+
+    def _check_application_prompt(self, index, theorem=None):
+        # 'theorem' defaults to the proof stored by name_theorem.
+        theorem = theorem if theorem is not None else self.theorems_applied[index]
         n = len(self.problem_sentences) + index + 1
         progress = ' '.join(f"{s}" for s in self.all_sentences[:n])
-        prompt = (
+        return (
             f"{progress} "
-            f"Now, let's check the proof \"{self.theorems_applied[index]}\"of the previous sentence: "
+            f"Now, let's check the proof \"{theorem}\"of the previous sentence: "
             "1. Check each rule n is a rigorous theorem, that all its premises are fulfilled, and that it implies conclusion n. "
             f"2. Check if the last conclusion restates or contradicts \"{self.all_sentences[n-1]}\". "
             "3. Clean up your analysis and output ONE JSON object: "
             "\"```json{\"rule 1\": true or false, ... \"relation\": 'restate'/'contradict'/'neither' }```\" "
             "Analyze using natural language before outputing ONE JSON object or go to jail for failing."
         )
-        logger.info(f"Prompt: {prompt}")
+
+    def _rule_verdicts(self, parsed_response):
+        all_verdicts = []
+        j = 1
+        while True:
+            k_verdict = f"rule {j}"
+            if k_verdict not in parsed_response:
+                break
+            verdict = parsed_response[k_verdict]
+            all_verdicts.append(verdict)
+            j += 1
+        return all_verdicts
+
+    def _parse_application(self, model_response):
+        # Returns (verdicts, relation); relation is None unless the response is fully usable.
+        if not model_response:
+            logger.info(f"Doesn't receive model response for check_application.")
+            return None, None
+        pattern = r"```json\s*(\{.*?\})\s*```"
+        match = re.search(pattern, model_response, re.DOTALL)
+        if not match:
+            logger.info("JSON not in response.")
+            return None, None
+        response = match.group(1)
+        try:
+            parsed_response = json.loads(response)
+        except json.JSONDecodeError:
+            logger.info("Failed to parse JSON from LLM response.")
+            return None, None
+        all_verdicts = self._rule_verdicts(parsed_response)
+        if all_verdicts == []:
+            logger.info("Couldn't find 'rule 1'.")
+            return None, None
+        if ('relation' not in parsed_response or 
+            parsed_response['relation'] not in ['restate', 'contradict', 'neither']):
+            logger.info(f"'relation' field in response not properly formatted")
+            return all_verdicts, None
+        logger.info(f"Model's response: {model_response}", extra=EXCHANGE)
+        return all_verdicts, parsed_response['relation']
+
+    def check_application(self, index, model):
+        prompt = self._check_application_prompt(index)
+        prefix = self._stable_prefix(index)
+        logger.info(f"Prompt: {prompt}", extra=EXCHANGE)
         for i in range(5):
-            model_response = model(prompt)
-            if not model_response:
-                logger.info(f"Doesn't receive model response for check_application.")
+            with metrics.call_site("check_application"), shared_prefix(prefix):
+                response = self._request(model, prompt, self._valid_application, first_block_only=True)
+            verdicts, relation = self._parse_application(response)
+            if verdicts:
+                self.application_correctness[index] = verdicts
+            if relation is None:
+                if response:
+                    self.registry.count("parse_failure", "check_application")
                 continue
-            pattern = r"```json\s*(\{.*?\})\s*```"
-            match = re.search(pattern, model_response, re.DOTALL)
-            if not match:
-                logger.info("JSON not in response.")
-                continue
-            response = match.group(1)
-            try:
-                parsed_response = json.loads(response)
-            except json.JSONDecodeError:
-                logger.info("Failed to parse JSON from LLM response.")
-                continue
-            all_verdicts = []
-            j = 1
-            while True:
-                k_verdict = f"rule {j}"
-                if k_verdict not in parsed_response:
-                    break
-                verdict = parsed_response[k_verdict]
-                all_verdicts.append(verdict)
-                j += 1
-            if all_verdicts == []:
-                logger.info("Couldn't find 'rule 1'.")
-                continue
-            self.application_correctness[index] = all_verdicts
-            if ('relation' not in parsed_response or 
-                parsed_response['relation'] not in ['restate', 'contradict', 'neither']):
-                logger.info(f"'relation' field in response not properly formatted")
+            self.application_relevance[index] = relation
+            return
+
+    async def acheck_application(self, index, amodel):
+        prompt = self._check_application_prompt(index)
+        prefix = self._stable_prefix(index)
+        logger.info(f"Prompt: {prompt}", extra=EXCHANGE)
+        for i in range(5):
+            with metrics.call_site("check_application"), shared_prefix(prefix):
+                response = await self._request(amodel, prompt, self._valid_application, first_block_only=True)
+            verdicts, relation = self._parse_application(response)
+            if verdicts:
+                self.application_correctness[index] = verdicts
+            if relation is None:
+                if response:
+                    self.registry.count("parse_failure", "check_application")
                 continue
-            logger.info(f"Model's response: {model_response}")
-            self.application_relevance[index] = parsed_response['relation']
+            self.application_relevance[index] = relation
             return